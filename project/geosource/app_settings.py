@@ -2,4 +2,84 @@ from django.conf import settings
 
 # Max time a task can be running until another one can be runned.
 # This is to prevent when a task is blocked.
+# In hours, refresh leases of sources expire after it too.
 MAX_TASK_RUNTIME = getattr(settings, "GEOSOURCE_MAX_TASK_RUNTIME", 24)
+
+# Seconds a scheduled task coalesces the duplicate requests of its method until
+# it starts. It is the longest a lost task can delay the next request.
+PENDING_TASK_TIMEOUT = getattr(settings, "GEOSOURCE_PENDING_TASK_TIMEOUT", 600)
+
+# Write source features by batches, merged into the layer with set-based
+# statements, instead of one update_or_create per record.
+BULK_INGESTION = getattr(settings, "GEOSOURCE_BULK_INGESTION", False)
+BULK_BATCH_SIZE = getattr(settings, "GEOSOURCE_BULK_BATCH_SIZE", 1000)
+
+# Record a content hash of each feature written by bulk ingestion, so that the
+# next refresh only touches the features that didn't change.
+CHANGE_DETECTION = getattr(settings, "GEOSOURCE_CHANGE_DETECTION", True)
+
+# How features are refreshed: "merge" writes them into the live layer, then
+# deletes the ones not seen, while "rebuild" loads them into a shadow layer
+# swapped with the live one once complete.
+REFRESH_STRATEGY = getattr(settings, "GEOSOURCE_REFRESH_STRATEGY", "merge")
+
+# Documents sent to Elasticsearch per bulk request, bounded by a size in bytes
+ES_BULK_CHUNK_SIZE = getattr(settings, "GEOSOURCE_ES_BULK_CHUNK_SIZE", 500)
+ES_BULK_MAX_BYTES = getattr(settings, "GEOSOURCE_ES_BULK_MAX_BYTES", 100 * 1024 * 1024)
+
+# Number of refreshes run concurrently by workers, periodic refreshes are
+# packed on these slots according to their estimated duration
+REFRESH_SLOTS = getattr(settings, "GEOSOURCE_REFRESH_SLOTS", 1)
+
+# Records read to infer source fields: the first SAMPLE_SIZE ones with the
+# "head" strategy, or SAMPLE_CHUNKS evenly spaced chunks with "spread"
+SAMPLE_SIZE = getattr(settings, "GEOSOURCE_SAMPLE_SIZE", 50)
+SAMPLING = getattr(settings, "GEOSOURCE_SAMPLING", "head")
+SAMPLE_CHUNKS = getattr(settings, "GEOSOURCE_SAMPLE_CHUNKS", 5)
+
+# Profile field values during refreshes, so that styles and filters read
+# statistics instead of scanning features: numeric fields keep a sample of
+# PROFILE_SKETCH_SIZE values for quantiles, all fields count up to
+# PROFILE_MAX_VALUES distinct values.
+FIELD_PROFILES = getattr(settings, "GEOSOURCE_FIELD_PROFILES", False)
+PROFILE_SKETCH_SIZE = getattr(settings, "GEOSOURCE_PROFILE_SKETCH_SIZE", 1000)
+PROFILE_MAX_VALUES = getattr(settings, "GEOSOURCE_PROFILE_MAX_VALUES", 100)
+
+# Distinct property values listed by the property_values endpoint when they
+# are not paginated, and how long they are cached, in seconds. The cache is
+# also cleared by source refreshes.
+PROPERTY_VALUES_LIMIT = getattr(settings, "GEOSOURCE_PROPERTY_VALUES_LIMIT", 1000)
+PROPERTY_VALUES_CACHE_TIMEOUT = getattr(
+    settings, "GEOSOURCE_PROPERTY_VALUES_CACHE_TIMEOUT", 60 * 60 * 24
+)
+
+# Number of rows fetched at once from the server-side cursor of PostGIS sources
+POSTGIS_ITERSIZE = getattr(settings, "GEOSOURCE_POSTGIS_ITERSIZE", 2000)
+
+# Processes parsing the records of file sources during refreshes, by chunks of
+# PARSE_CHUNK_SIZE records, while the refresh process writes them. Sources are
+# parsed by the refresh process itself with a single one.
+PARSE_WORKERS = getattr(settings, "GEOSOURCE_PARSE_WORKERS", 1)
+PARSE_CHUNK_SIZE = getattr(settings, "GEOSOURCE_PARSE_CHUNK_SIZE", 5000)
+
+# Full refreshes of sources of at least SHARD_MIN_ROWS records are split in
+# REFRESH_SHARDS shards written by concurrent tasks, then finished by a last
+# one. They are run by a single task with 1.
+REFRESH_SHARDS = getattr(settings, "GEOSOURCE_REFRESH_SHARDS", 1)
+SHARD_MIN_ROWS = getattr(settings, "GEOSOURCE_SHARD_MIN_ROWS", 500000)
+# In hours, sharded refreshes not finished by then, as a shard was lost, are
+# failed and release their lease. Shards not started by then are dropped.
+SHARDED_REFRESH_TIMEOUT = getattr(settings, "GEOSOURCE_SHARDED_REFRESH_TIMEOUT", 6)
+
+# Minimal interval between two publications of the progress of a refresh to
+# the cache, in seconds, it is not published with 0. The progress_stream
+# endpoint, streaming it as server-sent events, is only enabled with
+# PROGRESS_STREAM, as each stream holds a server thread or worker. Streams end
+# after PROGRESS_STREAM_DURATION seconds, clients reconnecting to follow on.
+PROGRESS_INTERVAL = getattr(settings, "GEOSOURCE_PROGRESS_INTERVAL", 2)
+PROGRESS_STREAM = getattr(settings, "GEOSOURCE_PROGRESS_STREAM", False)
+PROGRESS_STREAM_DURATION = getattr(settings, "GEOSOURCE_PROGRESS_STREAM_DURATION", 30)
+
+# Examples kept for each kind of error in the report of a refresh, all errors
+# being downloadable from the errors endpoint of its source
+ERROR_EXAMPLES = getattr(settings, "GEOSOURCE_ERROR_EXAMPLES", 10)
@@ -0,0 +1,69 @@
+import codecs
+import csv
+import os
+from functools import lru_cache
+from itertools import islice
+
+from pyexcel_io import service
+
+# File types read by pyexcel's CSV plugin
+FILE_TYPES = ("csv", "tsv")
+
+INFINITY = (float("inf"), float("-inf"))
+
+
+def iter_rows(path, encoding, delimiter, quotechar):
+    """
+    Yield the rows of a CSV file as lists of raw text cells, without their
+    trailing empty cells, as pyexcel does.
+    """
+    # Line endings quoted in cells are left to the CSV reader
+    with open(path, encoding=encoding, newline="") as file:
+        for row in csv.reader(file, delimiter=delimiter, quotechar=quotechar):
+            yield _strip_row(row)
+
+
+def iter_spread_rows(path, encoding, delimiter, quotechar, chunks, chunk_size):
+    """
+    Yield rows from evenly spaced positions of a CSV file, ``chunk_size`` rows
+    from each of the ``chunks`` positions, the first one being its start. Rows
+    cut by a position are skipped, and chunks never overlap.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        position = 0
+        for k in range(chunks):
+            offset = size * k // chunks
+            if offset > position:
+                file.seek(offset - 1)
+                # Resume after the line cut by the offset
+                file.readline()
+            lines = (decoder.decode(line) for line in iter(file.readline, b""))
+            reader = csv.reader(lines, delimiter=delimiter, quotechar=quotechar)
+            for row in islice(reader, chunk_size):
+                yield _strip_row(row)
+            position = file.tell()
+
+
+def _strip_row(row):
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+@lru_cache(maxsize=4096)
+def convert_cell(text):
+    """
+    Convert a non empty cell to an int, float, date or datetime with the
+    converters of pyexcel's CSV reader, in its order and with its default
+    options. Cached, as columns often repeat values.
+    """
+    value = service.detect_int_value(text)
+    if value is None:
+        value = service.detect_float_value(text)
+        if value in INFINITY:
+            value = None
+    if value is None:
+        value = service.detect_date_value(text)
+    return text if value is None else value
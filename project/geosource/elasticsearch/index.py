@@ -1,50 +1,301 @@
 import json
 import logging
+import re
 from collections import defaultdict
+from functools import cached_property
 
+from django.contrib.gis.db.models.functions import (
+    AsGeoJSON,
+    Centroid,
+    Envelope,
+    GeomOutputGeoFunc,
+)
+from django.db.models import Value
+from django.utils import timezone
+from elasticsearch.helpers import streaming_bulk
+from geostore.models import Feature
+
+from project.geosource import app_settings
 from project.geosource.elasticsearch import ESMixin
 
 logger = logging.getLogger(__name__)
 
+# Index settings while documents are loaded: no refresh, no replica
+LOADING_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+
+# Geometry indexed for a feature: its shape, centroid or bounding box
+GEOMETRY_MODES = ("shape", "centroid", "bbox")
+
+# Source index settings, overridden by its index_settings field:
+# - dynamic: map properties that are not source fields when indexed
+# - geometry: one of GEOMETRY_MODES
+# - simplify: tolerance of the shape simplification, in degrees
+# - precision: number of decimals of coordinates
+DEFAULT_INDEX_SETTINGS = {
+    "dynamic": True,
+    "geometry": "shape",
+    "simplify": None,
+    "precision": 15,
+}
+
+
+class SimplifyPreserveTopology(GeomOutputGeoFunc):
+    arity = 2
+
 
 class LayerESIndex(ESMixin):
     def __init__(self, layer, client=None):
         self.layer = layer
         self.client = self.get_client() if not client else client
+        # Features waiting for the next bulk request, and errors of the
+        # requests sent, as (identifier, message) tuples
+        self.buffer = []
+        self.errors = []
+        # Whether a bulk request failed as a whole, rather than some documents
+        self.failed = False
+        self.restore_settings = None
+        # Version of the index being loaded, published under the layer name
+        self.index_name = None
+
+    @property
+    def target(self):
+        """Index documents are written to"""
+        return self.index_name or self.layer.name
 
     def index(self):
-        self.clean_index()
+        """
+        Create a new version of the index, named after the layer and a timestamp.
+        The layer name stays an alias of the previous version until it is
+        published.
+        """
+        self.index_name = f"{self.layer.name}.{timezone.now():%Y%m%d%H%M%S%f}"
         self.create_index()
 
-    def _get_formatted_record(self, index, feature):
+    def get_versions(self):
+        """
+        Return the versions of the layer index with their aliases, along with
+        an index named as the layer by previous releases
+        """
+        name = self.layer.name
+        pattern = re.compile(rf"{re.escape(name)}(\.\d{{20}})?")
+        indices = self.client.indices.get_alias(index=f"{name}*")
+        return {
+            index: info["aliases"]
+            for index, info in indices.items()
+            if pattern.fullmatch(index)
+        }
+
+    def publish(self):
+        """
+        Swap the layer alias to the loaded version in a single request, then
+        drop the previous versions. If it fails, the previous version stays live.
+        """
+        index_name, self.index_name = self.index_name, None
+        if not index_name:
+            return
+        name = self.layer.name
+        try:
+            versions = self.get_versions()
+            actions = []
+            for index, aliases in versions.items():
+                if index == name:
+                    actions.append({"remove_index": {"index": index}})
+                elif name in aliases:
+                    actions.append({"remove": {"index": index, "alias": name}})
+            actions.append({"add": {"index": index_name, "alias": name}})
+            self.client.indices.update_aliases(actions=actions)
+        except Exception:
+            logger.exception("Failed to publish index %s", index_name)
+            self.drop_index(index_name)
+            return
+        previous = [index for index in versions if index not in (name, index_name)]
+        if previous:
+            self.drop_index(",".join(previous))
+
+    def discard(self):
+        """Drop the version being loaded, the previous one stays live"""
+        index_name, self.index_name = self.index_name, None
+        if index_name:
+            self.drop_index(index_name)
+
+    def drop_index(self, index):
+        try:
+            self.client.indices.delete(index=index, ignore=[400, 404])
+        except Exception:
+            logger.exception("Failed to delete index %s", index)
+
+    @cached_property
+    def source(self):
+        """Source of the layer, None if it is not a source layer"""
+        from project.geosource.models import Source
+
+        return (
+            Source.objects.filter(slug=self.layer.name)
+            .prefetch_related("fields")
+            .first()
+        )
+
+    def get_index_settings(self):
+        index_settings = {**DEFAULT_INDEX_SETTINGS}
+        if self.source:
+            index_settings.update(self.source.index_settings)
+        return index_settings
+
+    def get_excluded_fields(self):
+        if not self.source:
+            return set()
         return {
-            "index": index,
-            "id": feature.identifier,
-            "document": {
-                "_feature_id": feature.identifier,
-                "geom": json.loads(feature.geom.geojson),
-                **feature.properties,
-            },
+            field.name for field in self.source.fields.all() if not field.searchable
         }
 
+    def get_geometry(self, index_settings):
+        """Database expression of the indexed geometry, as GeoJSON"""
+        geometry = "geom"
+        if index_settings["geometry"] == "centroid":
+            geometry = Centroid(geometry)
+        elif index_settings["geometry"] == "bbox":
+            geometry = Envelope(geometry)
+        elif index_settings["simplify"]:
+            geometry = SimplifyPreserveTopology(
+                geometry, Value(float(index_settings["simplify"]))
+            )
+        return AsGeoJSON(geometry, precision=index_settings["precision"])
+
+    def _get_actions(self, index, features):
+        index_settings = self.get_index_settings()
+        excluded = self.get_excluded_fields()
+        # GeoJSON is serialized by the database rather than by GDAL
+        rows = (
+            features.annotate(geojson=self.get_geometry(index_settings))
+            .values_list("identifier", "properties", "geojson")
+            .iterator(chunk_size=app_settings.ES_BULK_CHUNK_SIZE)
+        )
+        for identifier, properties, geojson in rows:
+            if excluded:
+                properties = {
+                    key: value
+                    for key, value in properties.items()
+                    if key not in excluded
+                }
+            yield {
+                "_index": index,
+                "_id": identifier,
+                "_source": {
+                    "_feature_id": identifier,
+                    "geom": json.loads(geojson),
+                    **properties,
+                },
+            }
+
+    def _bulk(self, actions):
+        """Send actions by bulk requests, return the errors of rejected ones"""
+        errors = []
+        self._start_loading()
+        results = streaming_bulk(
+            self.client,
+            actions,
+            chunk_size=app_settings.ES_BULK_CHUNK_SIZE,
+            max_chunk_bytes=app_settings.ES_BULK_MAX_BYTES,
+            raise_on_error=False,
+            yield_ok=False,
+        )
+        for _, item in results:
+            result = next(iter(item.values()))
+            error = result.get("error", result.get("status"))
+            if isinstance(error, dict):
+                error = error.get("reason", error)
+            errors.append((result.get("_id"), error))
+        return errors
+
     def index_feature(self, layer, feature):
-        record = self._get_formatted_record(layer.name, feature)
-        self.client.index(**record)
+        """Buffer a feature, indexed with the next bulk request"""
+        index = self.target if layer == self.layer else layer.name
+        self.buffer.append((index, feature.pk))
+        if len(self.buffer) >= app_settings.ES_BULK_CHUNK_SIZE:
+            self.flush()
 
-    def clean_index(self):
-        self.client.indices.delete(index=self.layer.name, ignore=[400, 404])
+    def index_features(self, features):
+        """Index a queryset of features, return the errors of rejected ones"""
+        try:
+            return self._bulk(self._get_actions(self.target, features))
+        except Exception as exc:
+            logger.exception("Bulk indexing failed for index %s", self.target)
+            self.failed = True
+            return [
+                (identifier, str(exc))
+                for identifier in features.values_list("identifier", flat=True)
+            ]
+
+    def flush(self):
+        """Index buffered features, return the errors collected so far"""
+        buffer, self.buffer = self.buffer, []
+        indexes = defaultdict(list)
+        for index, pk in buffer:
+            indexes[index].append(pk)
+        for index, pks in indexes.items():
+            features = Feature.objects.filter(pk__in=pks)
+            try:
+                self.errors += self._bulk(self._get_actions(index, features))
+            except Exception as exc:
+                logger.exception("Bulk indexing failed for index %s", index)
+                self.failed = True
+                self.errors += [
+                    (identifier, str(exc))
+                    for identifier in features.values_list("identifier", flat=True)
+                ]
+        errors, self.errors = self.errors, []
+        return errors
+
+    def _start_loading(self):
+        """
+        Disable refresh and replicas of a new index version until loading ends.
+        The live index, written to when no version is loaded, is left as it is.
+        """
+        if self.restore_settings is not None:
+            return
+        self.restore_settings = {}
+        name = self.index_name
+        if not name or not self.client.indices.exists(index=name):
+            return
+        settings = self.client.indices.get_settings(index=name)
+        current = next(iter(settings.values()))["settings"]["index"]
+        self.client.indices.put_settings(index=name, settings=LOADING_SETTINGS)
+        self.restore_settings = {
+            "refresh_interval": current.get("refresh_interval"),
+            "number_of_replicas": current.get("number_of_replicas"),
+        }
+
+    def end_loading(self):
+        """Restore index settings changed while loading, and refresh it"""
+        restore_settings, self.restore_settings = self.restore_settings, None
+        if not restore_settings:
+            return
+        try:
+            self.client.indices.put_settings(
+                index=self.target, settings=restore_settings
+            )
+            self.client.indices.refresh(index=self.target)
+        except Exception:
+            logger.exception("Failed to restore settings of index %s", self.target)
+
+    def delete_features(self, identifiers):
+        self.client.delete_by_query(
+            index=self.target,
+            query={"ids": {"values": identifiers}},
+            ignore=[404],
+        )
 
     def create_index(self):
         """
         Create ES index with specified type mapping from layer source
         If mapping not available, we switch on ES type guessing
         """
-        from project.geosource.models import FieldTypes, Source
+        from project.geosource.models import FieldTypes
 
-        try:
-            s = Source.objects.get(slug=self.layer.name)
-        except Source.DoesNotExist:
-            # If no source, we ignore it. Type will be guessed later.
+        s = self.source
+        if not s:
+            # If no source, types will be guessed when documents are indexed
+            self.client.indices.create(index=self.target)
             return
 
         logger.info("Index creation for layer %s", self.layer.name)
@@ -58,7 +309,7 @@ class LayerESIndex(ESMixin):
         # Get type from source field configuration. Ignore undefined types.
         field_conf = {}
         for field in s.fields.all():
-            if field.data_type != 5:
+            if field.data_type != 5 and field.searchable:
                 field_type = type_mapping[FieldTypes(field.data_type).name.lower()]
                 if field_type == "text":
                     # Exception for text field, we also want them to be keyword accessible
@@ -74,5 +325,9 @@ class LayerESIndex(ESMixin):
 
         # Create query body with mapping
         body = {"mappings": {"properties": field_conf}}
+        if not self.get_index_settings()["dynamic"]:
+            # Other properties are kept in documents, but not indexed
+            field_conf["_feature_id"] = {"type": "keyword"}
+            body["mappings"]["dynamic"] = False
 
-        self.client.indices.create(index=self.layer.name, body=body)
+        self.client.indices.create(index=self.target, body=body)
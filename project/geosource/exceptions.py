@@ -15,3 +15,9 @@ class GeoJSONSourceException(SourceException):
     """GeoJSONSource exception raised by the GeoJSONSourec model"""
 
     pass
+
+
+class RecordError(SourceException):
+    """Invalid source record, yielded by Source._iter_records instead of a record"""
+
+    pass
@@ -1,4 +1,3 @@
-from django.db.models import Func, IntegerField
 from django_filters import rest_framework as filters
 
 from .models import Source
@@ -9,19 +8,12 @@ class SourceOrderingFilter(filters.OrderingFilter):
         if value and any(v in ["status", "-status"] for v in value):
             # as status display in admin differ along with report__status, source type or number of errors
             # we should take in consideration
-            qs = qs.annotate(
-                num_errors=Func(
-                    "report__errors",
-                    function="jsonb_array_length",
-                    output_field=IntegerField(),
-                )
-            )
             if "-status" in value:
                 orders = [
                     "-status",
                     "-report__status",
                     "-polymorphic_ctype__model",
-                    "-num_errors",
+                    "-report__error_count",
                 ]
 
             else:
@@ -29,7 +21,7 @@ class SourceOrderingFilter(filters.OrderingFilter):
                     "status",
                     "report__status",
                     "polymorphic_ctype__model",
-                    "-num_errors",
+                    "-report__error_count",
                 ]
 
             qs = qs.order_by(*orders)
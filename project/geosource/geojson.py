@@ -0,0 +1,257 @@
+import codecs
+import json
+import re
+import struct
+from collections.abc import Mapping
+from itertools import chain
+
+from django.contrib.gis.geos import GEOSGeometry
+
+from .exceptions import GeoJSONSourceException
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACES = " \t\n\r"
+# Longest token that can be cut by the end of the buffer and still decode, or
+# fail to, as a shorter one: "-Infinity"
+TOKEN_MARGIN = 9
+# Text up to the next brace outside of strings, so that only braces are
+# looped over to find where an object ends. A quote instead is a string cut
+# by the end of the buffer.
+OBJECT_TOKEN = re.compile(r'[^"{}]*+(?:"[^"\\]*+(?:\\.[^"\\]*+)*+"[^"{}]*+)*+([{}"])')
+
+
+class FeatureStream:
+    """
+    Walk the top level object of a GeoJSON file and yield the items of its
+    ``features`` array one by one, so that only the feature being decoded is
+    held in memory. With ``raw``, features are yielded as their JSON text, to
+    be decoded elsewhere.
+    """
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE, raw=False):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.raw = raw
+        self.text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def __iter__(self):
+        has_features = False
+        self.expect("{")
+        while self.peek() != "}":
+            key = self.decode()
+            self.expect(":")
+            if key == "features":
+                has_features = True
+                yield from self.iter_array()
+            else:
+                self.decode()
+            if self.expect(",}") == "}":
+                break
+        else:
+            self.pos += 1
+        if not has_features or self.peek():
+            self.error()
+
+    def iter_array(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.scan() if self.raw else self.decode()
+            if self.expect(",]") == "]":
+                return
+
+    def read(self, size):
+        """Append the next chunk of the file to the buffer"""
+        chunk = ""
+        while not chunk:
+            data = self.file.read(size)
+            if isinstance(data, bytes):
+                # A multibyte character cut by the chunk decodes to nothing
+                chunk = self.text_decoder.decode(data, final=not data)
+            else:
+                chunk = data
+            if not data:
+                self.eof = True
+                break
+        # Drop what was already consumed, so the buffer stays small
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Return the next significant character, or an empty string at EOF"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACES:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos : self.pos + 1]
+            self.read(self.chunk_size)
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            self.error()
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """
+        Decode the next JSON value, reading the file until it is complete. It
+        fails as soon as the decoder stops before the end of the buffer.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as exc:
+                if self.eof or not self.truncated(exc):
+                    self.error()
+            else:
+                # A number may go on in the next chunk
+                if len(self.buffer) - end > TOKEN_MARGIN or self.eof:
+                    self.pos = end
+                    return value
+            # Read at least as much as what is buffered to keep decoding
+            # linear with large features
+            self.read(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def scan(self):
+        """
+        Return the text of the next JSON object without decoding it, only its
+        braces and strings are matched to find where it ends.
+        """
+        if self.peek() != "{":
+            self.error()
+        # Scanning resumes after the tokens matched before reading more
+        offset = 0
+        depth = 0
+        while True:
+            while match := OBJECT_TOKEN.match(self.buffer, self.pos + offset):
+                token = match.group(1)
+                if token == '"':
+                    break
+                depth += 1 if token == "{" else -1
+                if not depth:
+                    text = self.buffer[self.pos : match.end()]
+                    self.pos = match.end()
+                    return text
+                offset = match.end() - self.pos
+            if self.eof:
+                self.error()
+            self.read(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def truncated(self, exc):
+        """Tell whether a decoding error may come from the end of the buffer"""
+        return (
+            exc.msg.startswith("Unterminated string")
+            or exc.pos >= len(self.buffer) - TOKEN_MARGIN
+        )
+
+    def error(self):
+        msg = "Source's GeoJSON file is not valid"
+        raise GeoJSONSourceException(msg)
+
+
+def iter_features(file, chunk_size=CHUNK_SIZE, raw=False):
+    return iter(FeatureStream(file, chunk_size, raw))
+
+
+# Little endian WKB headers: byte order and geometry type, then items counts
+WKB_HEADER = struct.Struct("<BI")
+WKB_COUNT = struct.Struct("<I")
+# Flag of EWKB geometry types with a Z dimension
+WKB_Z = 0x80000000
+
+
+def _pack_positions(positions, dims):
+    if any(len(position) != dims for position in positions):
+        msg = "Inconsistent coordinates dimensions"
+        raise ValueError(msg)
+    return struct.pack(
+        f"<I{len(positions) * dims}d", len(positions), *chain.from_iterable(positions)
+    )
+
+
+def _pack_point(position, dims, z):
+    if len(position) != dims:
+        msg = "Inconsistent coordinates dimensions"
+        raise ValueError(msg)
+    return WKB_HEADER.pack(1, 1 | z) + struct.pack(f"<{dims}d", *position)
+
+
+def _pack_line_string(positions, dims, z):
+    return WKB_HEADER.pack(1, 2 | z) + _pack_positions(positions, dims)
+
+
+def _pack_polygon(rings, dims, z):
+    return (
+        WKB_HEADER.pack(1, 3 | z)
+        + WKB_COUNT.pack(len(rings))
+        + b"".join(_pack_positions(ring, dims) for ring in rings)
+    )
+
+
+def _multi(type_code, pack_part):
+    def pack(parts, dims, z):
+        return (
+            WKB_HEADER.pack(1, type_code | z)
+            + WKB_COUNT.pack(len(parts))
+            + b"".join(pack_part(part, dims, z) for part in parts)
+        )
+
+    return pack
+
+
+# GeoJSON types, with the nesting depth of their positions and their packer
+WKB_PACKERS = {
+    "Point": (0, _pack_point),
+    "LineString": (1, _pack_line_string),
+    "Polygon": (2, _pack_polygon),
+    "MultiPoint": (1, _multi(4, _pack_point)),
+    "MultiLineString": (2, _multi(5, _pack_line_string)),
+    "MultiPolygon": (3, _multi(6, _pack_polygon)),
+}
+
+
+def _pack_geometry(geometry):
+    if geometry["type"] == "GeometryCollection":
+        geometries = geometry["geometries"]
+        return (
+            WKB_HEADER.pack(1, 7)
+            + WKB_COUNT.pack(len(geometries))
+            + b"".join(_pack_geometry(geom) for geom in geometries)
+        )
+    depth, pack = WKB_PACKERS[geometry["type"]]
+    coordinates = geometry["coordinates"]
+    # Dimensions are given by the first position
+    position = coordinates
+    for _ in range(depth):
+        position = position[0]
+    dims = len(position)
+    if dims not in (2, 3):
+        msg = f"Unsupported coordinates dimensions: {dims}"
+        raise ValueError(msg)
+    return pack(coordinates, dims, WKB_Z if dims == 3 else 0)
+
+
+def geometry_from_geojson(geometry, srid=4326):
+    """
+    Build a GEOS geometry from a decoded GeoJSON geometry, packed as WKB rather
+    than serialized back to JSON. Raise ValueError (or a GEOS error) if it is
+    not a valid geometry.
+    """
+    if not isinstance(geometry, Mapping) or "crs" in geometry:
+        msg = "Unsupported GeoJSON geometry"
+        raise ValueError(msg)
+    try:
+        wkb = _pack_geometry(geometry)
+    except (KeyError, IndexError, TypeError, struct.error) as exc:
+        msg = f"Invalid GeoJSON geometry: {exc}"
+        raise ValueError(msg)
+    return GEOSGeometry(memoryview(wkb), srid=srid)
@@ -1,10 +1,69 @@
+import csv
+import json
 import logging
+from io import StringIO
 
-from django.contrib.gis.geos import GEOSGeometry
-from geostore.models import Layer, LayerGroup
+from django.contrib.gis.geos import GEOSGeometry, WKBWriter
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from geostore import settings as geostore_settings
+from geostore.helpers import execute_async_func
+from geostore.models import Feature, Layer, LayerGroup, LayerRelation
+from geostore.tasks import layer_relations_set_destinations
+
+from .reprojection import reproject, reproject_geometry
 
 logger = logging.getLogger(__name__)
 
+STAGING_TABLE = "geosource_feature_staging"
+
+# geostore_feature has no unique constraint on (layer_id, identifier), so the merge
+# can't rely on INSERT ... ON CONFLICT: existing features are updated first, then
+# the remaining ones are inserted.
+MERGE_UPDATE_QUERY = """
+    WITH updated AS (
+        UPDATE {table} AS feature
+        SET geom = staging.geom,
+            properties = staging.properties,
+            updated_at = %(now)s
+        FROM {staging} AS staging
+        WHERE feature.layer_id = %(layer_id)s
+          AND feature.identifier = staging.identifier
+        RETURNING feature.identifier
+    )
+    SELECT count(DISTINCT identifier) FROM updated
+"""
+
+MERGE_INSERT_QUERY = """
+    INSERT INTO {table} (layer_id, identifier, geom, properties, created_at, updated_at)
+    SELECT %(layer_id)s, staging.identifier, staging.geom, staging.properties,
+           %(now)s, %(now)s
+    FROM {staging} AS staging
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {table} AS feature
+        WHERE feature.layer_id = %(layer_id)s
+          AND feature.identifier = staging.identifier
+    )
+"""
+
+# Rows referring to a feature of the live layer move to the feature of the
+# rebuilt layer with the same identifier, before the live layer is dropped.
+REPOINT_FEATURE_QUERY = """
+    UPDATE {referrer} AS referrer
+    SET {column} = rebuilt.id
+    FROM {table} AS feature, {table} AS rebuilt
+    WHERE referrer.{column} = feature.id
+      AND feature.layer_id = %(layer_id)s
+      AND rebuilt.layer_id = %(shadow_id)s
+      AND rebuilt.identifier = feature.identifier
+"""
+
+# Suffixes of the layers a rebuild loads and retires next to the live one
+SHADOW_SUFFIX = ".shadow"
+RETIRED_SUFFIX = ".retired."
+
 
 def layer_callback(geosource):
     group_name = geosource.settings.pop("group", "reference")
@@ -30,9 +89,7 @@ def layer_callback(geosource):
 def feature_callback(geosource, layer, identifier, geometry, attributes):
     # Force converting geometry to 4326 projection
     try:
-        geom = GEOSGeometry(geometry)
-        if geom.srid != 4326:
-            geom.transform(4326)
+        geom = reproject_geometry(GEOSGeometry(geometry))
         return layer.features.update_or_create(
             identifier=identifier, defaults={"properties": attributes, "geom": geom}
         )
@@ -44,10 +101,181 @@ def feature_callback(geosource, layer, identifier, geometry, attributes):
         return None, None
 
 
+def bulk_feature_callback(geosource, layer, features):
+    """
+    Merge a batch of features into the layer with set-based statements.
+
+    ``features`` maps identifiers to ``(geometry, attributes)`` tuples. The batch is
+    copied into a temporary staging table, then merged into geostore_feature.
+    Returns the added and modified counts, and the ``(identifier, exception)`` list
+    of the rows that were rejected. Rows refused by the database constraints, such
+    as invalid geometries, make the merge raise a DatabaseError.
+    """
+    errors = []
+    ewkb_writer = WKBWriter()
+    ewkb_writer.srid = True
+
+    geometries = {}
+    for identifier, (geometry, _) in features.items():
+        try:
+            geometries[identifier] = (
+                geometry
+                if isinstance(geometry, GEOSGeometry)
+                else GEOSGeometry(geometry)
+            )
+        except Exception as exc:
+            errors.append((identifier, exc))
+    # Geometries of the batch are reprojected together
+    geometries, reprojection_errors = reproject(geometries)
+    errors.extend(reprojection_errors)
+
+    staged = StringIO()
+    writer = csv.writer(staged, quoting=csv.QUOTE_ALL, lineterminator="\n")
+    for identifier, geom in geometries.items():
+        attributes = features[identifier][1]
+        try:
+            # Validity is left to the database, as for update_or_create()
+            if geom.empty:
+                msg = "Empty geometry"
+                raise ValueError(msg)
+            row = (
+                identifier,
+                # Z dimension is dropped as Feature.save() does
+                ewkb_writer.write_hex(geom).decode(),
+                json.dumps(attributes, cls=DjangoJSONEncoder),
+            )
+        except Exception as exc:
+            errors.append((identifier, exc))
+            continue
+        writer.writerow(row)
+    staged.seek(0)
+
+    params = {"layer_id": layer.pk, "now": timezone.now()}
+    tables = {"table": Feature._meta.db_table, "staging": STAGING_TABLE}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} "
+            "(identifier varchar(255), geom geometry(Geometry, 4326), properties jsonb)"
+        )
+        cursor.execute(f"TRUNCATE {STAGING_TABLE}")
+        cursor.copy_expert(
+            f"COPY {STAGING_TABLE} (identifier, geom, properties) "
+            "FROM STDIN WITH (FORMAT csv)",
+            staged,
+        )
+        cursor.execute(MERGE_UPDATE_QUERY.format(**tables), params)
+        (modified,) = cursor.fetchone()
+        cursor.execute(MERGE_INSERT_QUERY.format(**tables), params)
+        added = cursor.rowcount
+
+    return added, modified, errors
+
+
+def touch_features(geosource, layer, identifiers):
+    return layer.features.filter(identifier__in=identifiers).update(
+        updated_at=timezone.now()
+    )
+
+
 def clear_features(geosource, layer, begin_date):
     return layer.features.filter(updated_at__lt=begin_date).delete()
 
 
+def delete_features(geosource, layer, identifiers):
+    return layer.features.filter(identifier__in=identifiers).delete()
+
+
+def sync_relations(geosource, layer):
+    """
+    Update the automatic relations of the layer features, as saving each of
+    them would. Features merged in bulk, or moved by a rebuild, don't go
+    through Feature.save().
+    """
+    relations = layer.relations_as_origin.exclude(relation_type__isnull=True)
+    for relation in relations:
+        if geostore_settings.GEOSTORE_RELATION_CELERY_ASYNC:
+            execute_async_func(layer_relations_set_destinations, (relation.pk,))
+        else:
+            for feature in layer.features.iterator():
+                feature.sync_relations(relation.pk)
+
+
+def shadow_layer_callback(geosource, layer):
+    """
+    Return an empty layer to rebuild the source in. It holds the live layer
+    settings but is out of its groups, so tiles don't serve it until published.
+    """
+    shadow, created = Layer.objects.get_or_create(
+        name=f"{layer.name}{SHADOW_SUFFIX}",
+        defaults={
+            "settings": layer.settings,
+            "schema": layer.schema,
+            "geom_type": layer.geom_type,
+        },
+    )
+    if not created:
+        # Left by an interrupted rebuild
+        shadow.features.all().delete()
+    return shadow
+
+
+@transaction.atomic
+def publish_layer(geosource, layer, shadow):
+    """
+    Swap the shadow layer in place of the live one. Names, groups, relations
+    and extra geometries move to it, and rows referring to live features are
+    pointed at the rebuilt ones: feature rows themselves are not rewritten.
+    """
+    table = Feature._meta.db_table
+    params = {"layer_id": layer.pk, "shadow_id": shadow.pk}
+    with connection.cursor() as cursor:
+        for rel in Feature._meta.related_objects:
+            if rel.many_to_many:
+                continue
+            cursor.execute(
+                REPOINT_FEATURE_QUERY.format(
+                    referrer=rel.related_model._meta.db_table,
+                    column=rel.field.column,
+                    table=table,
+                ),
+                params,
+            )
+    for relation in layer.relations_as_origin.all():
+        # Slugs of relations embed the id of their origin
+        LayerRelation.objects.filter(pk=relation.pk).update(
+            origin=shadow, slug=slugify(f"{shadow.pk}-{relation.name}")
+        )
+    layer.relations_as_destination.update(destination=shadow)
+    layer.extra_geometries.update(layer=shadow)
+
+    name = layer.name
+    layer.name = f"{name}{RETIRED_SUFFIX}{layer.pk}"
+    layer.save(update_fields=["name"])
+
+    shadow.name = name
+    shadow.settings = layer.settings
+    shadow.schema = layer.schema
+    shadow.save(update_fields=["name", "settings", "schema"])
+    shadow.authorized_groups.set(layer.authorized_groups.all())
+    shadow.layer_groups.set(layer.layer_groups.all())
+    layer.layer_groups.clear()
+    return shadow
+
+
+def exclude_rebuild_layers(queryset):
+    """Exclude the shadow and retired layers of rebuilds from a queryset of layers"""
+    return queryset.exclude(name__endswith=SHADOW_SUFFIX).exclude(
+        name__contains=RETIRED_SUFFIX
+    )
+
+
+def drop_layer(geosource, layer_id):
+    layer = Layer.objects.filter(pk=layer_id).first()
+    if layer is not None:
+        layer.features.all().delete()
+        layer.delete()
+
+
 def delete_layer(geosource):
     geosource.get_layer().features.all().delete()
     return geosource.get_layer().delete()
@@ -0,0 +1,108 @@
+from functools import lru_cache
+from uuid import uuid4
+
+import redis
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.redis import RedisCache
+
+from . import app_settings
+
+# Delete a key only if it still holds the given value, in a single step
+COMPARE_AND_DELETE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+@lru_cache
+def get_redis_client():
+    """
+    Client of the Redis server of the default cache, None with other backends.
+    Lock values are stored there as plain strings, so that the server compares
+    them: they are only read and written through the functions of this module.
+    """
+    if not isinstance(caches[DEFAULT_CACHE_ALIAS], RedisCache):
+        return None
+    location = settings.CACHES[DEFAULT_CACHE_ALIAS]["LOCATION"]
+    if isinstance(location, str):
+        location = location.split(",")
+    # The first server is the one the cache writes to
+    return redis.Redis.from_url(location[0], decode_responses=True)
+
+
+def add_lock(key, value, timeout):
+    """Set a lock key to ``value`` unless it is set, and tell whether it was"""
+    client = get_redis_client()
+    if client is None:
+        return cache.add(key, value, timeout)
+    return bool(
+        client.set(cache.make_and_validate_key(key), value, nx=True, ex=timeout)
+    )
+
+
+def get_lock(key):
+    client = get_redis_client()
+    if client is None:
+        return cache.get(key)
+    return client.get(cache.make_and_validate_key(key))
+
+
+def delete_lock(key):
+    client = get_redis_client()
+    if client is None:
+        cache.delete(key)
+    else:
+        client.delete(cache.make_and_validate_key(key))
+
+
+def delete_if_equal(key, value):
+    """
+    Delete a lock key if it holds ``value``, and tell whether it did. It is
+    atomic with the Redis backend, other backends get then delete the key.
+    """
+    client = get_redis_client()
+    if client is None:
+        if cache.get(key) == value:
+            return cache.delete(key)
+        return False
+    return bool(
+        client.eval(
+            COMPARE_AND_DELETE_SCRIPT, 1, cache.make_and_validate_key(key), value
+        )
+    )
+
+
+def get_lease_timeout():
+    """Seconds after which a lease is released, if its holder never does"""
+    return app_settings.MAX_TASK_RUNTIME * 60 * 60
+
+
+def get_refresh_lease_key(source_id):
+    return f"geosource-refresh-lease-{source_id}"
+
+
+def acquire_refresh_lease(source_id):
+    """
+    Take the refresh lease of a source, shared by all workers through the cache.
+    Return its token, or None if another refresh holds it.
+    """
+    token = uuid4().hex
+    if add_lock(get_refresh_lease_key(source_id), token, get_lease_timeout()):
+        return token
+    return None
+
+
+def release_refresh_lease(source_id, token):
+    """Release a lease, unless it expired and was taken by another refresh"""
+    delete_if_equal(get_refresh_lease_key(source_id), token)
+
+
+def claim_refresh_end(token):
+    """
+    Claim the end of the refresh holding a lease. Only one of the tasks racing
+    to finish or to expire a sharded refresh gets it.
+    """
+    return cache.add(f"geosource-refresh-end-{token}", True, get_lease_timeout())
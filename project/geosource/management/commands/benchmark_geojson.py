@@ -0,0 +1,81 @@
+import json
+import tempfile
+import time
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.management import BaseCommand
+
+from project.geosource.geojson import iter_features
+from project.geosource.models import GeoJSONSource
+
+
+def read_loaded(file):
+    """Former GeoJSONSource reader: load the whole file, round-trip geometries"""
+    for feature in json.load(file)["features"]:
+        yield GEOSGeometry(json.dumps(feature["geometry"]))
+
+
+def read_streamed(file):
+    source = GeoJSONSource()
+    for feature in iter_features(file):
+        yield source._get_geometry(feature["geometry"])
+
+
+class Command(BaseCommand):
+    help = "Compare GeoJSON readers throughput, in features per second"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file", help="GeoJSON file to read, a generated one if not provided"
+        )
+        parser.add_argument(
+            "--features",
+            type=int,
+            default=100000,
+            help="Number of features of the generated file",
+        )
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            self.run(options["file"])
+            return
+
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".geojson") as file:
+            self.generate(file, options["features"])
+            self.run(file.name)
+
+    def generate(self, file, count):
+        self.stdout.write(f"Generating {count} features...")
+        features = (
+            {
+                "type": "Feature",
+                "properties": {"id": i, "name": f"feature {i}"},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [
+                        [[i, 0], [i + 1, 0], [i + 1, 1], [i, 1], [i, 0]],
+                    ],
+                }
+                if i % 2
+                else {"type": "Point", "coordinates": [i, i / 2]},
+            }
+            for i in range(count)
+        )
+        file.write('{"type": "FeatureCollection", "features": [')
+        for i, feature in enumerate(features):
+            file.write(("," if i else "") + json.dumps(feature))
+        file.write("]}")
+        file.flush()
+
+    def run(self, path):
+        for name, reader in (("loaded", read_loaded), ("streamed", read_streamed)):
+            with open(path, "rb") as file:
+                start = time.perf_counter()
+                count = 0
+                for count, _ in enumerate(reader(file), 1):
+                    pass
+                duration = time.perf_counter() - start
+            self.stdout.write(
+                f"{name}: {count} features in {duration:.2f}s, "
+                f"{count / duration:.0f} features/s"
+            )
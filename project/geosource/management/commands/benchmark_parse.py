@@ -0,0 +1,138 @@
+import csv
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management import BaseCommand
+from django.test import override_settings
+
+from project.geosource import parallel
+from project.geosource.models import CSVSource, GeoJSONSource
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare sources parsing throughput from 1 to N processes. The CPU time "
+        "of the refresh process bounds how far parsing scales with more cores."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            choices=("csv", "geojson"),
+            default="csv",
+            help="Format of the generated file",
+        )
+        parser.add_argument(
+            "--features",
+            type=int,
+            default=200000,
+            help="Number of rows of the generated file",
+        )
+        parser.add_argument(
+            "--columns",
+            type=int,
+            default=20,
+            help="Number of property columns of the generated file",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=4, help="Maximum number of processes"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=5000, help="Rows parsed at once"
+        )
+
+    def handle(self, *args, **options):
+        # The generated file is stored as an uploaded one would be
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                generate = getattr(self, f"generate_{options['format']}")
+                get_source = generate(
+                    Path(media_root), options["features"], options["columns"]
+                )
+                for workers in range(1, options["workers"] + 1):
+                    self.run(get_source(), workers, options["chunk_size"])
+
+    def get_cells(self, i, columns):
+        # Text, integer, decimal and date columns in turn
+        cells = (
+            lambda i: f"feature {i}",
+            lambda i: i,
+            lambda i: i * 1.5,
+            lambda i: f"2024-01-{i % 28 + 1:02d}",
+        )
+        return [cells[j % len(cells)](i) for j in range(columns)]
+
+    def generate_csv(self, root, count, columns):
+        self.stdout.write(f"Generating {count} rows...")
+        with open(root / "benchmark.csv", "w", newline="") as file:
+            writer = csv.writer(file, delimiter=";")
+            writer.writerow(["id", "x", "y", *(f"field{j}" for j in range(columns))])
+            for i in range(count):
+                writer.writerow(
+                    [
+                        i,
+                        700000 + i % 1000,
+                        6600000 + i // 1000,
+                        *self.get_cells(i, columns),
+                    ]
+                )
+        return lambda: CSVSource(
+            name="benchmark",
+            file="benchmark.csv",
+            settings={
+                "encoding": "UTF-8",
+                "coordinate_reference_system": "EPSG_2154",
+                "char_delimiter": "doublequote",
+                "field_separator": "semicolon",
+                "decimal_separator": "point",
+                "use_header": True,
+                "coordinates_field": "two_columns",
+                "longitude_field": "x",
+                "latitude_field": "y",
+            },
+        )
+
+    def generate_geojson(self, root, count, columns):
+        self.stdout.write(f"Generating {count} features...")
+        with open(root / "benchmark.geojson", "w") as file:
+            file.write('{"type": "FeatureCollection", "features": [')
+            for i in range(count):
+                # Polygons of 20 positions
+                ring = [[i + k / 10, k % 2] for k in range(19)]
+                feature = {
+                    "type": "Feature",
+                    "properties": {
+                        "id": i,
+                        **{
+                            f"field{j}": cell
+                            for j, cell in enumerate(self.get_cells(i, columns))
+                        },
+                    },
+                    "geometry": {"type": "Polygon", "coordinates": [ring + ring[:1]]},
+                }
+                file.write(("," if i else "") + json.dumps(feature))
+            file.write("]}")
+        # Sources read their file once
+        return lambda: GeoJSONSource(name="benchmark", file="benchmark.geojson")
+
+    def run(self, source, workers, chunk_size):
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        if workers == 1:
+            records = source._iter_records()
+        else:
+            records = parallel.iter_parsed_records(
+                source, source._iter_chunks(chunk_size), workers
+            )
+        count = 0
+        for count, _ in enumerate(records, 1):
+            pass
+        duration = time.perf_counter() - start
+        cpu_duration = time.process_time() - cpu_start
+        self.stdout.write(
+            f"{workers} process(es): {count} records in {duration:.2f}s, "
+            f"{count / duration:.0f} records/s, "
+            f"refresh process CPU {cpu_duration:.2f}s"
+        )
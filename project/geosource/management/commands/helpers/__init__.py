@@ -1,13 +1,81 @@
+import time
+
 from django.contrib.gis.gdal import DataSource
 from django.core.management import BaseCommand
+from django.db import DatabaseError, transaction
 from geostore.models import Feature
 
+from project.geosource import app_settings
 from project.geosource.models import CommandSource, Field, FieldTypes
 
 
+class FeatureWriter:
+    """
+    Buffer the features of a command source and merge them into its layer by
+    batches, upserted on their identifier. Only their identifier, geometry and
+    properties are written. A batch refused by the database is written feature by
+    feature, so that only the refused features are reported.
+    """
+
+    def __init__(self, source, layer, batch_size=None):
+        self.source = source
+        self.layer = layer
+        self.batch_size = batch_size or app_settings.BULK_BATCH_SIZE
+        self.batch = {}
+        self.added = 0
+        self.modified = 0
+        self.errors = []
+
+    def write(self, feature):
+        identifier = str(feature.identifier)
+        # The last feature of an identifier wins, as successive saves would
+        if identifier in self.batch or len(self.batch) >= self.batch_size:
+            self.flush()
+        self.batch[identifier] = (feature.geom, feature.properties)
+
+    def flush(self):
+        if not self.batch:
+            return
+        try:
+            with transaction.atomic():
+                added, modified, errors = self.source.update_features(
+                    self.layer, self.batch
+                )
+        except DatabaseError:
+            added, modified, errors = self.write_features()
+        self.added += added
+        self.modified += modified
+        self.errors.extend(errors)
+        self.batch = {}
+
+    def write_features(self):
+        added = modified = 0
+        errors = []
+        for identifier, (geom, properties) in self.batch.items():
+            try:
+                with transaction.atomic():
+                    # The feature callback parses geometries from their EWKB
+                    feature, created = self.source.update_feature(
+                        self.layer, identifier, geom.hexewkb, properties
+                    )
+            except DatabaseError as exc:
+                errors.append((identifier, exc))
+                continue
+            if feature is None:
+                msg = "Invalid geometry"
+                errors.append((identifier, ValueError(msg)))
+            elif created:
+                added += 1
+            else:
+                modified += 1
+        return added, modified, errors
+
+
 class BaseCommandSource(BaseCommand):
     source = None
     geom_type = None
+    # Minimal interval between two progress lines, in seconds
+    progress_interval = 5
 
     def get_source(self, pk):
         return CommandSource.objects.get(pk=pk)
@@ -39,19 +107,29 @@ class BaseCommandSource(BaseCommand):
         self.source = self.get_source(options["source"])
         self.stdout.write(f"Start refresh {self.source.name}")
         layer = self.source.get_layer()
+        writer = FeatureWriter(self.source, layer)
         counter = 0
         data = self.get_data()
         if data:
+            try:
+                total = len(data)
+            except TypeError:
+                total = "?"
+            last_progress = time.monotonic()
             for element in data:
                 if counter == 0:
                     self.update_source_fields(element)
                 counter += 1
-                feature = self.parse_data_to_feature(element)
-                feature.layer = layer
-                feature.save()
-                self.stdout.write(
-                    f"{counter}/{len(data)} : Feature {feature.identifier} refreshed"
-                )
+                writer.write(self.parse_data_to_feature(element))
+                if time.monotonic() - last_progress >= self.progress_interval:
+                    last_progress = time.monotonic()
+                    self.stdout.write(f"{counter}/{total} features read")
+            writer.flush()
+            for identifier, error in writer.errors:
+                self.stderr.write(f"Feature {identifier} ignored: {error}")
+            self.stdout.write(
+                f"{writer.added} features added, {writer.modified} modified"
+            )
         self.stdout.write(f"End refresh {self.source.name}")
 
 
@@ -66,20 +144,25 @@ class DSCommandSource(BaseCommandSource):
         raise NotImplementedError
 
     def update_source_fields(self, data_element):
-        counter = -1
-        for prop in data_element:
-            counter += 1
-            data_type = FieldTypes.get_type_from_data(data_element.get(prop))
-            Field.objects.get_or_create(
-                source=self.source,
-                name=prop.name,
-                defaults={
-                    "label": prop.name.title(),
-                    "sample": [data_element.get(prop)],
-                    "data_type": data_type.value,
-                    "order": counter,
-                },
+        """Create the fields of the source that don't exist yet"""
+        existing = set(self.source.fields.values_list("name", flat=True))
+        fields = []
+        for counter, prop in enumerate(data_element):
+            if prop.name in existing:
+                continue
+            value = data_element.get(prop)
+            fields.append(
+                Field(
+                    source=self.source,
+                    name=prop.name,
+                    label=prop.name.title(),
+                    sample=[value],
+                    data_type=FieldTypes.get_type_from_data(value).value,
+                    order=counter,
+                )
             )
+        if fields:
+            Field.objects.bulk_create(fields)
 
     def parse_data_to_feature(self, data):
         properties = {}
@@ -1,13 +1,37 @@
+import datetime
+import time
+from argparse import ArgumentTypeError
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from geostore.models import Layer
 
 from project.geosource.elasticsearch import ESMixin
 from project.geosource.elasticsearch.index import LayerESIndex
+from project.geosource.geostore_callbacks import exclude_rebuild_layers
+from project.geosource.models import Source
 
 EXCLUDED_FIELDS = ()
 GEOMETRY_FIELD = "geom"
 
 
+def parse_since(value):
+    """Parse a date or a datetime, in the current timezone if not given"""
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            msg = f"Invalid date: {value}"
+            raise ArgumentTypeError(msg)
+        since = datetime.datetime.combine(date, datetime.time.min)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
 class Command(BaseCommand):
     """This is the ETL for indexing features in elasticsearch"""
 
@@ -18,6 +42,17 @@ class Command(BaseCommand):
         parser.add_argument(
             "--layer", type=int, help="Index only a layer with pk", required=False
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of layers indexed concurrently",
+        )
+        parser.add_argument(
+            "--since",
+            type=parse_since,
+            help="Index only layers of sources refreshed after this date",
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS("Indexing layers to ES..."))
@@ -26,9 +61,63 @@ class Command(BaseCommand):
             qs = Layer.objects.filter(pk=options["layer"])
         else:
             self.stdout.write("... Indexing all layers...")
-            qs = Layer.objects.all()
-        qs = qs.prefetch_related("features")
-        for layer in qs:
+            # Layers loaded or retired by rebuilds are not served
+            qs = exclude_rebuild_layers(Layer.objects.all())
+        if options["since"] is not None:
+            qs = qs.filter(
+                name__in=Source.objects.filter(
+                    last_refresh__gte=options["since"]
+                ).values("slug")
+            )
+        layers = list(qs.order_by("pk"))
+        for layer in layers:
             self.stdout.write(f"... Indexing layer {layer}")
-            layer_indexation = LayerESIndex(layer, client=client)
+
+        def index(layer):
+            return self.index_layer(LayerESIndex(layer, client=client))
+
+        if options["workers"] > 1:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                results = executor.map(self.run_in_thread(index), layers)
+                self.report(results)
+        else:
+            self.report(map(index, layers))
+
+    @staticmethod
+    def run_in_thread(func):
+        def run(*args):
+            try:
+                return func(*args)
+            finally:
+                # Each thread opens its own database connection
+                connections.close_all()
+
+        return run
+
+    def index_layer(self, layer_indexation):
+        """Load features of a layer in a new version of its index"""
+        layer = layer_indexation.layer
+        start = time.perf_counter()
+        try:
+            count = layer.features.count()
             layer_indexation.index()
+            errors = layer_indexation.index_features(layer.features.all())
+            layer_indexation.end_loading()
+            layer_indexation.publish()
+        except Exception as exc:
+            layer_indexation.discard()
+            return layer, None, str(exc), time.perf_counter() - start
+        return layer, count, errors, time.perf_counter() - start
+
+    def report(self, results):
+        for layer, count, errors, duration in results:
+            if count is None:
+                self.stderr.write(f"... Failed to index layer {layer}: {errors}")
+                continue
+            self.stdout.write(
+                f"... Indexed layer {layer}: {count - len(errors)}/{count} "
+                f"features in {duration:.2f}s, "
+                f"{count / duration if duration else 0:.0f} features/s"
+            )
+            for identifier, error in errors[:10]:
+                self.stderr.write(f"    {identifier}: {error}")
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.16 on 2026-10-18 19:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("geosource", "0017_alter_source_options"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sourcereporting",
+            name="unchanged_lines",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="FeatureDigest",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("identifier", models.CharField(max_length=255)),
+                ("digest", models.CharField(max_length=32)),
+                ("refreshed_at", models.DateTimeField()),
+                (
+                    "source",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="feature_digests",
+                        to="geosource.source",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("source", "identifier")},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.16 on 2026-10-18 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("geosource", "0018_featuredigest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="postgissource",
+            name="last_reconcile",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="postgissource",
+            name="last_watermark",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="postgissource",
+            name="reconcile_interval",
+            field=models.IntegerField(default=-1),
+        ),
+        migrations.AddField(
+            model_name="postgissource",
+            name="tombstone_predicate",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="postgissource",
+            name="watermark_field",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+    ]
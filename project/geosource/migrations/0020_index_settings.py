@@ -0,0 +1,22 @@
+# Generated by Django 5.2.16 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("geosource", "0019_postgissource_incremental_refresh"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="field",
+            name="searchable",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name="source",
+            name="index_settings",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
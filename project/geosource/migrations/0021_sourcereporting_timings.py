@@ -0,0 +1,27 @@
+# Generated by Django 5.2.16 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("geosource", "0020_index_settings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sourcereporting",
+            name="peak_memory",
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="sourcereporting",
+            name="rows_per_second",
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name="sourcereporting",
+            name="timings",
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.16 on 2026-10-18 20:21
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("geosource", "0021_sourcereporting_timings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="field",
+            name="profile",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                encoder=django.core.serializers.json.DjangoJSONEncoder,
+            ),
+        ),
+    ]
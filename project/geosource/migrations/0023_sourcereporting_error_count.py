@@ -0,0 +1,80 @@
+# Generated by Django 5.2.16 on 2026-10-18 20:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Examples kept in each bucket of errors when the migration was written
+ERROR_EXAMPLES = 10
+
+
+def aggregate_errors(apps, schema_editor):
+    SourceReporting = apps.get_model("geosource", "SourceReporting")
+    SourceReportingError = apps.get_model("geosource", "SourceReportingError")
+
+    for report in SourceReporting.objects.exclude(errors=[]).iterator():
+        messages = [str(error) for error in report.errors]
+        SourceReportingError.objects.bulk_create(
+            [
+                SourceReportingError(report=report, kind="Error", message=message)
+                for message in messages
+            ],
+            batch_size=1000,
+        )
+        report.errors = [
+            {
+                "kind": "Error",
+                "count": len(messages),
+                "examples": messages[:ERROR_EXAMPLES],
+            }
+        ]
+        report.error_count = len(messages)
+        report.save(update_fields=["errors", "error_count"])
+
+
+def expand_errors(apps, schema_editor):
+    SourceReporting = apps.get_model("geosource", "SourceReporting")
+
+    for report in SourceReporting.objects.filter(error_count__gt=0).iterator():
+        report.errors = list(
+            report.error_lines.order_by("pk").values_list("message", flat=True)
+        )
+        report.save(update_fields=["errors"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("geosource", "0022_field_profile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sourcereporting",
+            name="error_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="SourceReportingError",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("kind", models.CharField(max_length=255)),
+                ("message", models.TextField()),
+                (
+                    "report",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="error_lines",
+                        to="geosource.sourcereporting",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(aggregate_errors, expand_errors),
+    ]
@@ -1,8 +1,12 @@
 from celery import states
+from celery.result import AsyncResult
+from celery.utils import uuid
 from django.utils.timezone import now
 from rest_framework.exceptions import MethodNotAllowed
 
-from project.geosource.tasks import run_model_object_method
+from project.geosource import app_settings
+from project.geosource.locks import add_lock, delete_lock, get_lock
+from project.geosource.tasks import get_pending_task_key, run_model_object_method
 
 
 class CeleryCallMethodsMixin:
@@ -25,19 +29,33 @@ class CeleryCallMethodsMixin:
     ):
         """Schedule an async task that will be run by celery.
         Raises an error if a task is already running or scheduled, can be forced with
-        `force` argument.
+        `force` argument. A task of the method that didn't start yet is returned
+        instead of scheduling another one, even if forced.
         """
         if self.can_sync or force:
-            task_job = run_model_object_method.apply_async(
-                (
-                    self._meta.app_label,
-                    self.__class__.__name__,
-                    self.pk,
-                    method,
-                    success_state,
-                ),
-                countdown=countdown,
+            args = (
+                self._meta.app_label,
+                self.__class__.__name__,
+                self.pk,
+                method,
+                success_state,
             )
+            pending_key = get_pending_task_key(*args[:4])
+            task_id = uuid()
+            # Pending until the task starts, or expired if it was lost
+            timeout = (countdown or 0) + app_settings.PENDING_TASK_TIMEOUT
+            if not add_lock(pending_key, task_id, timeout):
+                pending_id = get_lock(pending_key)
+                if pending_id:
+                    return AsyncResult(pending_id)
+
+            try:
+                task_job = run_model_object_method.apply_async(
+                    args, countdown=countdown, task_id=task_id
+                )
+            except Exception:
+                delete_lock(pending_key)
+                raise
 
             self.update_status(task_job)
             return task_job
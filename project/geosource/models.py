@@ -1,38 +1,76 @@
+import hashlib
 import json
+import logging
+import struct
 import sys
-from datetime import date, timedelta
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, timedelta
 from enum import Enum, auto
+from functools import partial
 from io import BytesIO
+from itertools import chain, islice
 
 import fiona
 import psycopg2
 import pyexcel
+from celery import chord
 from celery.result import AsyncResult
 from celery.utils.log import LoggingProxy
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.contrib.gis.gdal.error import GDALException
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
+from django.core.cache import cache
 from django.core.management import call_command
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models, transaction
+from django.db import DatabaseError, models, transaction
+from django.db.models import Count
+from django.dispatch import receiver
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.utils.translation import gettext
 from django.utils.translation import gettext_lazy as _
 from fiona.crs import to_string
 from geostore import GeometryTypes
+from geostore.models import Layer
 from polymorphic.models import PolymorphicModel
 from psycopg2 import sql
+from pyexcel.sheet import make_names_unique
 from pyproj import CRS
 
+from . import app_settings, csv_reader, parallel
 from .callbacks import get_attr_from_path
 from .elasticsearch.index import LayerESIndex
-from .exceptions import CSVSourceException, GeoJSONSourceException, SourceException
+from .exceptions import (
+    CSVSourceException,
+    GeoJSONSourceException,
+    RecordError,
+    SourceException,
+)
 from .fields import LongURLField
+from .geojson import geometry_from_geojson, iter_features
+from .locks import acquire_refresh_lease, claim_refresh_end, release_refresh_lease
 from .mixins import CeleryCallMethodsMixin
+from .profile import SourceProfiler, get_profile_values
+from .progress import RefreshProgress, finish_progress
 from .signals import refresh_data_done
+from .tasks import (
+    run_drop_layer,
+    run_expire_refresh,
+    run_finish_refresh,
+    run_refresh_shard,
+)
+from .timing import StageTimer, get_peak_memory
+
+logger = logging.getLogger(__name__)
+
+# Little endian WKB of a 2D point
+WKB_POINT = struct.Struct("<BIdd")
 
 User = get_user_model()
 
@@ -87,12 +125,68 @@ class SourceReporting(models.Model):
     added_lines = models.PositiveIntegerField(default=0)
     deleted_lines = models.PositiveIntegerField(default=0)
     modified_lines = models.PositiveIntegerField(default=0)
+    unchanged_lines = models.PositiveIntegerField(default=0)
     total = models.PositiveIntegerField(default=0)
+    # Errors aggregated by kind, with their count and first examples. Every
+    # error is stored as a SourceReportingError, to be downloaded.
     errors = models.JSONField(default=list)
+    error_count = models.PositiveIntegerField(default=0)
+    # Seconds spent in each stage of the refresh
+    timings = models.JSONField(default=dict)
+    # Rows added or modified per second, unchanged rows are not written
+    rows_per_second = models.FloatField(null=True)
+    # Peak resident memory of the refreshing process, in KiB
+    peak_memory = models.PositiveBigIntegerField(null=True)
 
     def __str__(self):
         return f"{self.status}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.flush_errors()
+
+    def add_error(self, message, kind="Error"):
+        """Count an error in the bucket of its kind, its detail is stored by batches"""
+        self.error_count += 1
+        for bucket in self.errors:
+            if bucket["kind"] == kind:
+                break
+        else:
+            bucket = {"kind": kind, "count": 0, "examples": []}
+            self.errors.append(bucket)
+        bucket["count"] += 1
+        if len(bucket["examples"]) < app_settings.ERROR_EXAMPLES:
+            bucket["examples"].append(message)
+
+        if not hasattr(self, "_pending_errors"):
+            self._pending_errors = []
+        self._pending_errors.append(
+            SourceReportingError(report=self, kind=kind, message=message)
+        )
+        if len(self._pending_errors) >= app_settings.BULK_BATCH_SIZE:
+            self.flush_errors()
+
+    def merge_errors(self, buckets):
+        """Add buckets of errors whose detail was stored by another process"""
+        for other in buckets:
+            self.error_count += other["count"]
+            for bucket in self.errors:
+                if bucket["kind"] == other["kind"]:
+                    bucket["count"] += other["count"]
+                    examples = app_settings.ERROR_EXAMPLES - len(bucket["examples"])
+                    bucket["examples"] += other["examples"][: max(examples, 0)]
+                    break
+            else:
+                self.errors.append(other)
+
+    def flush_errors(self):
+        """Store the detail of the errors added since the last flush"""
+        pending = getattr(self, "_pending_errors", None)
+        if not pending or self.pk is None:
+            return
+        SourceReportingError.objects.bulk_create(pending)
+        self._pending_errors = []
+
     def reset(self):
         self.message = ""
         self.started = None
@@ -100,8 +194,27 @@ class SourceReporting(models.Model):
         self.added_lines = 0
         self.deleted_lines = 0
         self.modified_lines = 0
+        self.unchanged_lines = 0
         self.total = 0
         self.errors = []
+        self.error_count = 0
+        self._pending_errors = []
+        self.timings = {}
+        self.rows_per_second = None
+        self.peak_memory = None
+
+
+class SourceReportingError(models.Model):
+    """Error of a source refresh, aggregated into the errors of its report"""
+
+    report = models.ForeignKey(
+        SourceReporting, related_name="error_lines", on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=255)
+    message = models.TextField()
+
+    def __str__(self):
+        return self.message
 
 
 class Source(PolymorphicModel, CeleryCallMethodsMixin):
@@ -122,6 +235,8 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
     )
 
     settings = models.JSONField(default=dict, blank=True)
+    # Mapping and documents of the Elasticsearch index, see LayerESIndex
+    index_settings = models.JSONField(default=dict, blank=True)
     groups = models.ManyToManyField(Group, blank=True, related_name="geosources")
     report = models.OneToOneField(SourceReporting, on_delete=models.SET_NULL, null=True)
 
@@ -142,17 +257,59 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
     SOURCE_GEOM_ATTRIBUTE = "_geom_"
     MAX_SAMPLE_DATA = 5
 
+    # Timer and progress of the refresh in progress
+    _timer = None
+    _progress = None
+
     def get_layer(self):
         return get_attr_from_path(settings.GEOSOURCE_LAYER_CALLBACK)(self)
 
+    def get_property_values(self, property_name, search=None):
+        """
+        Distinct values of a property with the number of features holding them,
+        ordered by value, optionally filtered by a case-insensitive prefix.
+        """
+        return PropertyValues(self, property_name, search)
+
     def update_feature(self, *args):
         return get_attr_from_path(settings.GEOSOURCE_FEATURE_CALLBACK)(self, *args)
 
+    def update_features(self, *args):
+        return get_attr_from_path(settings.GEOSOURCE_BULK_FEATURE_CALLBACK)(self, *args)
+
+    def touch_features(self, layer, identifiers):
+        return get_attr_from_path(settings.GEOSOURCE_TOUCH_FEATURE_CALLBACK)(
+            self, layer, identifiers
+        )
+
     def clear_features(self, layer, begin_date):
         return get_attr_from_path(settings.GEOSOURCE_CLEAN_FEATURE_CALLBACK)(
             self, layer, begin_date
         )
 
+    def delete_features(self, layer, identifiers):
+        return get_attr_from_path(settings.GEOSOURCE_DELETE_FEATURE_CALLBACK)(
+            self, layer, identifiers
+        )
+
+    def sync_relations(self, layer):
+        return get_attr_from_path(settings.GEOSOURCE_SYNC_RELATIONS_CALLBACK)(
+            self, layer
+        )
+
+    def get_shadow_layer(self, layer):
+        return get_attr_from_path(settings.GEOSOURCE_SHADOW_LAYER_CALLBACK)(self, layer)
+
+    def publish_layer(self, layer, shadow):
+        return get_attr_from_path(settings.GEOSOURCE_PUBLISH_LAYER_CALLBACK)(
+            self, layer, shadow
+        )
+
+    def drop_layer(self, layer_id):
+        return get_attr_from_path(settings.GEOSOURCE_DROP_LAYER_CALLBACK)(
+            self, layer_id
+        )
+
     def delete(self, *args, **kwargs):
         get_attr_from_path(settings.GEOSOURCE_DELETE_LAYER_CALLBACK)(self)
         return super().delete(*args, **kwargs)
@@ -169,18 +326,52 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
         return next_run < now
 
     def refresh_data(self):
-        self.status = self.Status.IN_PROGRESS
-        self.save()
+        lease = acquire_refresh_lease(self.pk)
+        if lease is None:
+            # Refreshes of the same source would write the same features
+            logger.warning("Source %s is already being refreshed", self)
+            # Left pending by the request, while the refresh holding the lease
+            # is in progress and ends it
+            Source.objects.filter(pk=self.pk, status=self.Status.PENDING).update(
+                status=self.Status.IN_PROGRESS
+            )
+            return {"locked": True}
+
+        try:
+            self.status = self.Status.IN_PROGRESS
+            self.save()
 
+            shards = self._get_refresh_shards()
+            if shards:
+                response = self._refresh_shards(shards, lease)
+                # Released by the task finishing the refresh
+                lease = None
+                return response
+            return self._run_refresh()
+        finally:
+            if lease:
+                release_refresh_lease(self.pk, lease)
+
+    def _run_refresh(self):
         layer = self.get_layer()
+        es_index = LayerESIndex(layer)
         try:
-            es_index = LayerESIndex(layer)
-            es_index.index()
+            known_digests = self._get_known_digests()
+            # Unchanged features are not indexed again, so the index is only
+            # rebuilt when the last refresh didn't record their content
+            if not self._is_incremental_refresh() and (
+                known_digests is None or not known_digests.exists()
+            ):
+                es_index.index()
             response = self._refresh_data(es_index)
+            # A rebuilt layer replaces the one the refresh started with
+            layer = es_index.layer
+            self._end_index(es_index)
             self.status = self.Status.DONE.value
             return response
 
         except Exception as exc:
+            es_index.discard()
             self.report.status = self.report.Status.ERROR.value
             self.report.message = str(exc)
             self.report.ended = timezone.now()
@@ -188,6 +379,8 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
             self.status = self.Status.DONE
 
         finally:
+            if self._progress:
+                self._progress.finish()
             self.last_refresh = timezone.now()
             self.save()
             refresh_data_done.send_robust(
@@ -195,29 +388,462 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
                 layer=layer.pk,
             )
 
+    def _end_index(self, es_index):
+        """
+        Publish the index loaded by the refresh. It is discarded if the refresh
+        failed, or if a bulk request failed as a whole: the previous index then
+        stays live.
+        """
+        if es_index.failed:
+            logger.warning("Indexing failed for source %s, index not published", self)
+            es_index.discard()
+        elif self.report and self.report.status == SourceReporting.Status.ERROR:
+            es_index.discard()
+        else:
+            es_index.publish()
+
+    def _get_refresh_shards(self):
+        """Shards of a refresh split across workers, None if it is not split"""
+        if app_settings.REFRESH_SHARDS < 2 or self._is_incremental_refresh():
+            return None
+        try:
+            return self._get_shards(app_settings.REFRESH_SHARDS)
+        except Exception:
+            # Left to the refresh to report
+            logger.exception("Failed to split source %s in shards", self)
+            return None
+
+    def _refresh_shards(self, shards, lease):
+        """
+        Dispatch the shards of the refresh to workers, the refresh is finished by
+        finish_sharded_refresh once all of them are written, which releases the
+        refresh lease. It is expired by expire_sharded_refresh if that didn't
+        happen within SHARDED_REFRESH_TIMEOUT.
+        """
+        known_digests = self._get_known_digests()
+        # Digests recorded by the last refresh, before the report is reset
+        digests_since = self.report and self.report.started
+        expected = self.report and self.report.total
+        self._start_report()
+        layer = self.get_layer()
+        live_layer = None
+        if self._rebuilds_layer():
+            live_layer, layer = layer, self.get_shadow_layer(layer)
+        es_index = LayerESIndex(layer)
+        try:
+            if known_digests is None or not known_digests.exists():
+                es_index.index()
+            context = {
+                "layer": layer.pk,
+                "live_layer": live_layer and live_layer.pk,
+                "index": es_index.index_name,
+                "begin": timezone.now().isoformat(),
+                "lease": lease,
+                "digests_since": None
+                if known_digests is None
+                else (digests_since or self.report.started).isoformat(),
+            }
+            # Each shard publishes its progress as a part of the refresh one
+            RefreshProgress(self.pk, self.report, expected=expected).publish(
+                force=True, stage="shards", shards=len(shards)
+            )
+            timeout = app_settings.SHARDED_REFRESH_TIMEOUT * 60 * 60
+            chord(
+                [
+                    run_refresh_shard.s(self.pk, shard, {**context, "part": part}).set(
+                        expires=timeout
+                    )
+                    for part, shard in enumerate(shards)
+                ]
+            )(run_finish_refresh.s(self.pk, context))
+            run_expire_refresh.apply_async((self.pk, context), countdown=timeout)
+        except Exception as exc:
+            es_index.discard()
+            if live_layer:
+                transaction.on_commit(partial(run_drop_layer.delay, self.pk, layer.pk))
+            self.report.status = self.report.Status.ERROR.value
+            self.report.message = str(exc)
+            self.report.ended = timezone.now()
+            self.report.save(update_fields=["status", "message", "ended"])
+            self.status = self.Status.DONE
+            self.last_refresh = timezone.now()
+            self.save()
+            raise
+        return {"shards": len(shards)}
+
+    def _get_shard_layers(self, context):
+        layer = Layer.objects.get(pk=context["layer"])
+        es_index = LayerESIndex(layer)
+        es_index.index_name = context["index"]
+        return layer, es_index
+
+    def refresh_shard(self, shard, context):
+        """
+        Write the records of a shard of the refresh in progress, return their
+        counts, errors and stage timings.
+        """
+        layer, es_index = self._get_shard_layers(context)
+        # Concurrent shards would restore each other settings, they are left
+        # as they are
+        es_index.restore_settings = {}
+        known_digests = None
+        if context["digests_since"] is not None:
+            known_digests = self.feature_digests.filter(
+                refreshed_at__gte=datetime.fromisoformat(context["digests_since"])
+            )
+        # Errors are merged into the report once all shards are written, their
+        # detail is stored by each shard
+        self.report.errors = []
+        self.report.error_count = 0
+        self._timer = timer = StageTimer()
+        self._progress = progress = RefreshProgress(
+            self.pk, self.report, timer, part=context.get("part")
+        )
+        records = timer.iterate(
+            "read", progress.iterate(self._read_records(shard=shard))
+        )
+        try:
+            counts = self._write_records(layer, records, es_index, known_digests)
+        finally:
+            self.report.flush_errors()
+            progress.finish()
+        return {
+            "counts": counts,
+            "errors": self.report.errors,
+            "timings": timer.as_dict(),
+            "index_failed": es_index.failed,
+        }
+
+    def finish_sharded_refresh(self, results, context):
+        """
+        Merge the results of the shards into the report, then clear the features
+        that were not written and publish the index, as a refresh does.
+        """
+        if not claim_refresh_end(context["lease"]):
+            logger.warning("Sharded refresh of source %s finished once expired", self)
+            return {"expired": True}
+        layer, es_index = self._get_shard_layers(context)
+        counts = Counter()
+        timings = Counter()
+        failures = []
+        for result in results:
+            if "error" in result:
+                failures.append(result["error"])
+                continue
+            counts.update(result["counts"])
+            timings.update(result["timings"])
+            self.report.merge_errors(result["errors"])
+            es_index.failed |= result.get("index_failed", False)
+        # Layer whose features are left once the refresh is finished
+        final_layer = context["live_layer"] or layer.pk
+        self._timer = timer = StageTimer()
+        try:
+            deleted = 0
+            with timer.stage("clear"):
+                if failures:
+                    # Features of failed shards must not be cleared
+                    if context["live_layer"]:
+                        transaction.on_commit(
+                            partial(run_drop_layer.delay, self.pk, layer.pk)
+                        )
+                elif context["live_layer"]:
+                    live_layer = Layer.objects.get(pk=context["live_layer"])
+                    deleted = self._publish_rebuild(live_layer, layer, counts, es_index)
+                    if counts["rows"]:
+                        final_layer = layer.pk
+                else:
+                    begin_date = datetime.fromisoformat(context["begin"])
+                    deleted, _ = self.clear_features(layer, begin_date)
+                    if context["digests_since"] is not None:
+                        self._clear_digests(begin_date, es_index)
+            if counts["rows"] and final_layer == layer.pk:
+                self._sync_relations(layer, bool(context["live_layer"]))
+            if app_settings.FIELD_PROFILES:
+                # Shards don't profile the fields they read
+                self._store_profiles()
+
+            self._update_report(counts, deleted)
+            if failures:
+                for failure in failures:
+                    self.report.add_error(failure, "ShardError")
+                self.report.status = SourceReporting.Status.ERROR.value
+                self.report.message = gettext("Failed to refresh data")
+            timings.update(timer.as_dict())
+            self._report_timings(
+                {name: round(duration, 3) for name, duration in timings.items()},
+                (timezone.now() - self.report.started).total_seconds(),
+                counts,
+                peak_memory=False,
+            )
+            self._end_index(es_index)
+        except Exception as exc:
+            es_index.discard()
+            self.report.status = SourceReporting.Status.ERROR.value
+            self.report.message = str(exc)
+        finally:
+            self.report.ended = timezone.now()
+            self.report.save()
+            self.status = self.Status.DONE
+            self.last_refresh = timezone.now()
+            self.save()
+            finish_progress(self.pk)
+            release_refresh_lease(self.pk, context["lease"])
+            refresh_data_done.send_robust(sender=self.__class__, layer=final_layer)
+        return {"count": counts["rows"], "total": counts["total"]}
+
+    def expire_sharded_refresh(self, context):
+        """
+        Fail a sharded refresh that wasn't finished in time, as a shard was lost,
+        and release its lease. Features already written are kept, as when a shard
+        fails. Tell whether it was expired, rather than finished.
+        """
+        if not claim_refresh_end(context["lease"]):
+            return False
+        layer, es_index = self._get_shard_layers(context)
+        es_index.discard()
+        if context["live_layer"]:
+            transaction.on_commit(partial(run_drop_layer.delay, self.pk, layer.pk))
+        self.report.add_error(
+            "Refresh timed out before all shards were written", "ShardTimeout"
+        )
+        self.report.flush_errors()
+        self.report.status = SourceReporting.Status.ERROR.value
+        self.report.message = gettext("Failed to refresh data")
+        self.report.ended = timezone.now()
+        self.report.save()
+        self.status = self.Status.DONE
+        self.last_refresh = timezone.now()
+        self.save()
+        finish_progress(self.pk)
+        release_refresh_lease(self.pk, context["lease"])
+        refresh_data_done.send_robust(
+            sender=self.__class__, layer=context["live_layer"] or layer.pk
+        )
+        return True
+
     def _refresh_data(self, es_index=None):
+        known_digests = self._get_known_digests()
+        incremental = self._is_incremental_refresh()
+        # Records expected from the last refresh, to estimate the time left
+        expected = None if incremental or not self.report else self.report.total
+        self._start_report()
+
+        layer = self.get_layer()
+        rebuild = self._rebuilds_layer()
+        if rebuild:
+            live_layer, layer = layer, self.get_shadow_layer(layer)
+        begin_date = timezone.now()
+        self._timer = timer = StageTimer()
+        self._progress = progress = RefreshProgress(
+            self.pk, self.report, timer, expected
+        )
+        # Reading includes the parsing and reprojection of records
+        records = timer.iterate(
+            "read", progress.iterate(self._read_records(incremental=incremental))
+        )
+        profiler = None
+        if app_settings.FIELD_PROFILES and not incremental:
+            profiler = SourceProfiler(
+                app_settings.PROFILE_SKETCH_SIZE,
+                app_settings.PROFILE_MAX_VALUES,
+                exclude=(self.SOURCE_GEOM_ATTRIBUTE,),
+            )
+            records = self._profile_records(records, profiler)
+        counts = self._write_records(layer, records, es_index, known_digests)
+        row_count = counts["rows"]
+        with timer.stage("clear"):
+            if incremental:
+                # Features not read by the refresh are kept
+                deleted = self._delete_features(
+                    layer, self._get_removed_identifiers(), es_index
+                )
+            elif rebuild:
+                deleted = self._publish_rebuild(live_layer, layer, counts, es_index)
+            else:
+                deleted, _ = self.clear_features(layer, begin_date)
+                if known_digests is not None:
+                    self._clear_digests(begin_date, es_index)
+
+        if row_count:
+            self._sync_relations(layer, rebuild)
+
+        if app_settings.FIELD_PROFILES and (row_count or incremental):
+            self._store_profiles(profiler)
+
+        self._update_report(counts, deleted, incremental)
+        self._report_timings(timer.as_dict(), timer.elapsed, counts)
+        if self.id:
+            self.report.ended = timezone.now()
+            self.report.save()
+        return {"count": row_count, "total": counts["total"]}
+
+    def _start_report(self):
         if not self.report:
             self.report = SourceReporting.objects.create(started=timezone.now())
         else:
+            self.report.error_lines.all().delete()
             self.report.reset()
             self.report.started = timezone.now()
             self.report.save()
 
-        layer = self.get_layer()
-        begin_date = timezone.now()
-        row_count = 0
-        added_rows = 0
-        modified_rows = 0
-        total = 0
+    def _write_records(self, layer, records, es_index=None, known_digests=None):
+        """Write records into the layer, return the counts of the rows written"""
+        try:
+            with self._stage("write"):
+                if app_settings.BULK_INGESTION:
+                    return self._bulk_ingest_records(
+                        layer, records, es_index, known_digests
+                    )
+                return self._ingest_records(layer, records, es_index)
+        finally:
+            if es_index:
+                with self._stage("index"):
+                    for identifier, error in es_index.flush():
+                        self.report.add_error(
+                            f"{self.id_field} - {identifier}: {error}", "IndexingError"
+                        )
+                    es_index.end_loading()
+
+    def _update_report(self, counts, deleted, incremental=False):
+        row_count = counts["rows"]
+        self.report.added_lines = counts["added"]
+        self.report.modified_lines = counts["modified"]
+        self.report.unchanged_lines = counts["unchanged"]
+        self.report.deleted_lines = deleted
+        self.report.total = row_count
+        if not row_count and not incremental:
+            self.report.status = SourceReporting.Status.ERROR.value
+            self.report.message = gettext("Failed to refresh data")
+        elif row_count == counts["total"] and self.report.error_count == 0:
+            self.report.status = SourceReporting.Status.SUCCESS.value
+            self.report.message = gettext("Source refreshed successfully")
+        else:
+            self.report.status = SourceReporting.Status.WARNING.value
+            self.report.message = gettext("Source refreshed partially")
+
+    def _stage(self, name):
+        """Time a stage of the refresh in progress"""
+        if self._timer is None:
+            return nullcontext()
+        return self._timer.stage(name)
+
+    def _advance_progress(self, written):
+        if self._progress is not None:
+            self._progress.advance(written)
+
+    def _profile_records(self, records, profiler):
+        for record in records:
+            with self._stage("profile"):
+                profiler.add(record)
+            yield record
+
+    def _store_profiles(self, profiler=None):
+        """
+        Store the profiles of the fields read by a refresh. Incremental refreshes
+        don't read all the features, profiles are cleared.
+        """
+        profiles = profiler.as_dict() if profiler else {}
+        fields = list(self.fields.all())
+        for field in fields:
+            field.profile = profiles.get(field.name, {})
+        Field.objects.bulk_update(fields, ["profile"])
+
+    def _report_timings(self, timings, elapsed, counts, peak_memory=True):
+        written = counts["added"] + counts["modified"]
+        self.report.timings = timings
+        self.report.rows_per_second = round(written / elapsed, 1) if elapsed else None
+        # Only known for refreshes run by a single process
+        self.report.peak_memory = get_peak_memory() if peak_memory else None
+        logger.info(
+            "Source %s refreshed: %s rows read, %s written in %.2fs",
+            self,
+            counts["rows"],
+            written,
+            elapsed,
+            extra={
+                "source": self.pk,
+                "rows": counts["rows"],
+                "written": written,
+                "timings": self.report.timings,
+                "rows_per_second": self.report.rows_per_second,
+                "peak_memory": self.report.peak_memory,
+            },
+        )
+
+    def _rebuilds_layer(self):
+        """Whether the refresh loads a shadow layer, published once complete"""
+        return (
+            app_settings.REFRESH_STRATEGY == "rebuild"
+            and not self._is_incremental_refresh()
+        )
+
+    def _sync_relations(self, layer, rebuild=False):
+        """
+        Sync the relations of the written layer once, when its features were not
+        saved one by one, or were saved before the relations moved to it.
+        """
+        if app_settings.BULK_INGESTION or rebuild:
+            with self._timer.stage("relations"):
+                self.sync_relations(layer)
+
+    def _publish_rebuild(self, layer, shadow, counts, es_index=None):
+        """
+        Swap the rebuilt layer in place of the live one, which is then dropped in
+        the background. Added and modified counts are updated against the live
+        layer, and the deleted count is returned.
+        """
+        if not counts["rows"]:
+            # Nothing was read, the live layer is kept
+            transaction.on_commit(partial(run_drop_layer.delay, self.pk, shadow.pk))
+            return 0
+
+        added = shadow.features.exclude(
+            identifier__in=layer.features.values("identifier")
+        ).count()
+        deleted = layer.features.exclude(
+            identifier__in=shadow.features.values("identifier")
+        ).count()
+        counts["modified"] = counts["rows"] - added
+        counts["added"] = added
+
+        self.publish_layer(layer, shadow)
+        transaction.on_commit(partial(run_drop_layer.delay, self.pk, layer.pk))
+        if es_index:
+            es_index.layer = shadow
+        return deleted
+
+    def _read_records(self, limit=None, incremental=False, shard=None):
+        """Yield the source records, reporting the invalid ones as they come"""
         try:
-            records, records_errors = self._get_records()
+            if incremental:
+                records = self._iter_changed_records()
+            elif shard is not None:
+                records = self._iter_shard_records(shard)
+            elif limit is None and app_settings.PARSE_WORKERS > 1:
+                records = self._iter_parsed_records()
+            else:
+                records = self._iter_records(limit)
+            for record in records:
+                if isinstance(record, RecordError):
+                    self.report.add_error(record.message, "RecordError")
+                else:
+                    yield record
         except Exception as exc:
             # Possible Uncatched exception (i.e ValueError, Integer Error)
             raise SourceException(exc.args)
 
-        self.report.errors += records_errors
+    def _iter_parsed_records(self):
+        """Parse the records in a pool of processes, if the source is split in chunks"""
+        chunks = self._iter_chunks(app_settings.PARSE_CHUNK_SIZE)
+        if chunks is None:
+            return self._iter_records()
+        return parallel.iter_parsed_records(self, chunks, app_settings.PARSE_WORKERS)
+
+    def _ingest_records(self, layer, records, es_index=None):
+        """Write records one by one, each of them in its own savepoint"""
+        counts = Counter()
         for i, row in enumerate(records):
-            total += 1
+            counts["total"] += 1
             geometry = row.pop(self.SOURCE_GEOM_ATTRIBUTE)
             try:
                 identifier = row[self.id_field]
@@ -226,46 +852,238 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
                     feature, created = self.update_feature(
                         layer, identifier, geometry, row
                     )
-                    if es_index and feature:
-                        es_index.index_feature(layer, feature)
+                    if feature is None:
+                        # Rejected by the callback, nothing was written
+                        transaction.savepoint_rollback(sid)
+                        self.report.add_error(
+                            f"{self.id_field} - {identifier}: Invalid geometry",
+                            "InvalidGeometry",
+                        )
+                        continue
+                    if es_index:
+                        with self._stage("index"):
+                            es_index.index_feature(es_index.layer, feature)
                     transaction.savepoint_commit(sid)
                     if created:
-                        added_rows += 1
+                        counts["added"] += 1
                     else:
-                        modified_rows += 1
+                        counts["modified"] += 1
                 except Exception as exc:
                     transaction.savepoint_rollback(sid)
-                    self.report.errors.append(f"{self.id_field} - {identifier}: {exc}")
+                    self.report.add_error(
+                        f"{self.id_field} - {identifier}: {exc}", type(exc).__name__
+                    )
                     continue
             except KeyError:
-                self.report.errors.append(
-                    f"Line {i} - Can't find identifier '{self.id_field}'"
+                self.report.add_error(
+                    f"Line {i} - Can't find identifier '{self.id_field}'",
+                    "MissingIdentifier",
+                )
+                continue
+            counts["rows"] += 1
+            self._advance_progress(1)
+        return counts
+
+    def _bulk_ingest_records(self, layer, records, es_index=None, known_digests=None):
+        """
+        Write records by batches merged into the layer with set-based statements.
+        If ``known_digests`` is given, records whose content didn't change since
+        the last refresh are only touched.
+        """
+        counts = Counter()
+        batch = {}
+        for i, row in enumerate(records):
+            counts["total"] += 1
+            geometry = row.pop(self.SOURCE_GEOM_ATTRIBUTE)
+            try:
+                identifier = str(row[self.id_field])
+            except KeyError:
+                self.report.add_error(
+                    f"Line {i} - Can't find identifier '{self.id_field}'",
+                    "MissingIdentifier",
                 )
                 continue
-            row_count += 1
-        deleted, _ = self.clear_features(layer, begin_date)
+            # A batch can't hold the same identifier twice, flush it so the last
+            # record wins as it would with successive update_or_create calls
+            if identifier in batch or len(batch) >= app_settings.BULK_BATCH_SIZE:
+                counts.update(self._write_batch(layer, batch, es_index, known_digests))
+                batch = {}
+            batch[identifier] = (geometry, row)
+        if batch:
+            counts.update(self._write_batch(layer, batch, es_index, known_digests))
+        return counts
+
+    def _write_batch(self, layer, batch, es_index=None, known_digests=None):
+        unchanged = Counter()
+        if known_digests is not None:
+            with self._stage("detect"):
+                batch, digests, unchanged = self._skip_unchanged(
+                    layer, batch, known_digests
+                )
+            self._advance_progress(unchanged["rows"])
+            if not batch:
+                return unchanged
 
-        self.report.added_lines = added_rows
-        self.report.modified_lines = modified_rows
-        self.report.deleted_lines = deleted
-        self.report.total = row_count
-        if not row_count:
-            self.report.status = SourceReporting.Status.ERROR.value
-            self.report.message = gettext("Failed to refresh data")
-        elif row_count == total and len(self.report.errors) == 0:
-            self.report.status = SourceReporting.Status.SUCCESS.value
-            self.report.message = gettext("Source refreshed successfully")
-        else:
-            self.report.status = SourceReporting.Status.WARNING.value
-            self.report.message = gettext("Source refreshed partially")
-        if self.id:
-            self.report.ended = timezone.now()
-            self.report.save()
-        return {"count": row_count, "total": total}
+        try:
+            with transaction.atomic():
+                added, modified, errors = self.update_features(layer, batch)
+        except DatabaseError:
+            logger.warning(
+                "Bulk write failed for source %s, replaying batch row by row", self
+            )
+            counts = self._ingest_records(
+                layer,
+                (
+                    {**row, self.SOURCE_GEOM_ATTRIBUTE: geometry}
+                    for geometry, row in batch.values()
+                ),
+                es_index,
+            )
+            counts.pop("total", None)
+            return counts + unchanged
+
+        rejected = set()
+        for identifier, exc in errors:
+            rejected.add(identifier)
+            self.report.add_error(
+                f"{self.id_field} - {identifier}: {exc}", type(exc).__name__
+            )
+        if es_index:
+            features = layer.features.filter(identifier__in=batch.keys() - rejected)
+            with self._stage("index"):
+                errors = es_index.index_features(features)
+            for identifier, error in errors:
+                rejected.add(identifier)
+                self.report.add_error(
+                    f"{self.id_field} - {identifier}: {error}", "IndexingError"
+                )
+        if known_digests is not None:
+            with self._stage("detect"):
+                self._store_digests(
+                    {
+                        identifier: digest
+                        for identifier, digest in digests.items()
+                        if digest and identifier not in rejected
+                    }
+                )
+        self._advance_progress(added + modified)
+        return unchanged + Counter(
+            rows=added + modified, added=added, modified=modified
+        )
+
+    def _get_known_digests(self):
+        """
+        Return the content digests recorded by the last refresh, or None if
+        changes are not detected. Digests left by refreshes that didn't record
+        them are not trusted, as features may have been written since.
+        """
+        if not (app_settings.BULK_INGESTION and app_settings.CHANGE_DETECTION):
+            return None
+        if self._rebuilds_layer():
+            return None
+        if not self.pk:
+            return None
+        if not self.report or not self.report.started:
+            return self.feature_digests.none()
+        return self.feature_digests.filter(refreshed_at__gte=self.report.started)
+
+    def _get_digest(self, geometry, attributes):
+        try:
+            # Records parsed by other processes already hold EWKB
+            wkb = (
+                geometry
+                if isinstance(geometry, memoryview)
+                else GEOSGeometry(geometry).ewkb
+            )
+            content = json.dumps(
+                attributes, cls=DjangoJSONEncoder, sort_keys=True, separators=(",", ":")
+            )
+        except (GEOSException, TypeError, ValueError):
+            # Left to the feature callback to report
+            return None
+        return hashlib.blake2b(
+            bytes(wkb) + content.encode(), digest_size=16
+        ).hexdigest()
+
+    def _skip_unchanged(self, layer, batch, known_digests):
+        """
+        Split out of the batch the records that didn't change, and touch their
+        features so that they are not cleared. Return the remaining batch, the
+        digests of its records and the unchanged counts.
+        """
+        digests = {
+            identifier: self._get_digest(*record)
+            for identifier, record in batch.items()
+        }
+        known = dict(
+            known_digests.filter(identifier__in=batch.keys()).values_list(
+                "identifier", "digest"
+            )
+        )
+        unchanged = {
+            identifier
+            for identifier, digest in digests.items()
+            if digest and known.get(identifier) == digest
+        }
+        # Features removed by hand since the last refresh must be written again
+        if not unchanged or self.touch_features(layer, unchanged) < len(unchanged):
+            return batch, digests, Counter()
+
+        self.feature_digests.filter(identifier__in=unchanged).update(
+            refreshed_at=timezone.now()
+        )
+        batch = {
+            identifier: record
+            for identifier, record in batch.items()
+            if identifier not in unchanged
+        }
+        return batch, digests, Counter(rows=len(unchanged), unchanged=len(unchanged))
+
+    def _store_digests(self, digests):
+        now = timezone.now()
+        FeatureDigest.objects.bulk_create(
+            [
+                FeatureDigest(
+                    source=self, identifier=identifier, digest=digest, refreshed_at=now
+                )
+                for identifier, digest in digests.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["source", "identifier"],
+            update_fields=["digest", "refreshed_at"],
+        )
+
+    def _delete_features(self, layer, identifiers, es_index=None):
+        """Delete features by identifier, with their digests and documents"""
+        deleted = 0
+        identifiers = iter(identifiers)
+        while chunk := list(islice(identifiers, app_settings.BULK_BATCH_SIZE)):
+            count, _ = self.delete_features(layer, chunk)
+            deleted += count
+            self.feature_digests.filter(identifier__in=chunk).delete()
+            if es_index:
+                with self._stage("index"):
+                    es_index.delete_features(chunk)
+        return deleted
+
+    def _clear_digests(self, begin_date, es_index=None):
+        """Forget the features not seen by the refresh, and their documents"""
+        stale = self.feature_digests.filter(refreshed_at__lt=begin_date)
+        if es_index:
+            identifiers = stale.values_list("identifier", flat=True).iterator()
+            while chunk := list(islice(identifiers, app_settings.BULK_BATCH_SIZE)):
+                with self._stage("index"):
+                    es_index.delete_features(chunk)
+        stale.delete()
 
     @transaction.atomic
     def update_fields(self):
-        records, _ = self._get_records(50)
+        if app_settings.SAMPLING == "spread":
+            records, _ = self._get_records(
+                app_settings.SAMPLE_SIZE, chunks=app_settings.SAMPLE_CHUNKS
+            )
+        else:
+            records, _ = self._get_records(app_settings.SAMPLE_SIZE)
 
         fields = {}
         if records is None:
@@ -325,9 +1143,78 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
 
         return response
 
-    def _get_records(self, limit=None):
+    def _iter_records(self, limit=None):
+        """
+        Return an iterable over the source records, read lazily so that memory
+        doesn't depend on the source size. Invalid records are yielded as
+        RecordError instances.
+        """
+        raise NotImplementedError
+
+    def _iter_chunks(self, size):
+        """
+        Return an iterable over picklable chunks of about ``size`` records, to
+        be parsed by _parse_chunk in other processes, or None if the source
+        can't be split.
+        """
+        return None
+
+    def _parse_chunk(self, chunk):
+        """Return an iterable over the records of a chunk, as _iter_records does"""
+        raise NotImplementedError
+
+    def _get_shards(self, count):
+        """
+        Return up to ``count`` JSON serializable shards of the source, whose
+        records are read by _iter_shard_records, or None if it is not split.
+        Sources with less than SHARD_MIN_ROWS records are not.
+        """
+        return None
+
+    def _iter_shard_records(self, shard):
+        """Return an iterable over the records of a shard, as _iter_records does"""
         raise NotImplementedError
 
+    def _is_incremental_refresh(self):
+        """Whether the next refresh only reads the records changed since the last one"""
+        return False
+
+    def _iter_changed_records(self):
+        """
+        Return an iterable over the records changed since the last refresh, for
+        incremental refreshes.
+        """
+        raise NotImplementedError
+
+    def _get_removed_identifiers(self):
+        """
+        Return the identifiers of the records removed since the last refresh,
+        once changed records are read.
+        """
+        raise NotImplementedError
+
+    def _iter_sample(self, size, chunks):
+        """
+        Return an iterable over ``size`` records sampled by ``chunks`` evenly
+        spaced through the source. Sources that can't be read at a given
+        position yield their first records.
+        """
+        return self._iter_records(size)
+
+    def _get_records(self, limit=None, chunks=None):
+        records = []
+        errors = []
+        if chunks and chunks > 1 and limit:
+            iterable = self._iter_sample(limit, chunks)
+        else:
+            iterable = self._iter_records(limit)
+        for record in iterable:
+            if isinstance(record, RecordError):
+                errors.append(record.message)
+            else:
+                records.append(record)
+        return (records, errors)
+
     def __str__(self):
         return f"{self.name} - ({self.slug})"
 
@@ -340,6 +1227,113 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
         return self.status
 
 
+def get_identifier_shards(total, count):
+    """Split ``total`` records in ``count`` ``[part, count]`` identifier shards"""
+    if total < app_settings.SHARD_MIN_ROWS:
+        return None
+    return [[part, count] for part in range(count)]
+
+
+def in_identifier_shard(properties, id_field, shard):
+    """
+    Tell whether a record belongs to a ``[part, count]`` shard, given by the hash
+    of its identifier: records of the same identifier are written by the same
+    shard, in order. Records without identifier belong to the first one.
+    """
+    part, count = shard
+    if id_field not in properties:
+        return not part
+    return zlib.crc32(str(properties[id_field]).encode()) % count == part
+
+
+def get_property_values_cache_key(layer_id, property_name, *parts):
+    # Keys of a layer embed a version changed by each refresh of its source
+    version = cache.get_or_set(
+        f"geosource-property-values-{layer_id}", time.time_ns, None
+    )
+    digest = hashlib.md5(json.dumps([property_name, *parts]).encode()).hexdigest()
+    return f"geosource-property-values-{layer_id}-{version}-{digest}"
+
+
+class PropertyValues:
+    """
+    Distinct values of a property of a source layer as ``[value, count]`` pairs.
+    They are counted and sliced by the database only when requested, so that a
+    paginator queries a single page, and each of them is cached until the next
+    refresh of the source.
+    """
+
+    def __init__(self, source, property_name, search=None):
+        self.source = source
+        self.layer = source.get_layer()
+        self.property_name = property_name
+        self.search = search
+
+    def count(self):
+        return self._cached("count", self._count)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            msg = "Property values can only be sliced"
+            raise TypeError(msg)
+        start, stop = key.start or 0, key.stop
+        return self._cached([start, stop], partial(self._get_values, start, stop))
+
+    def _cached(self, part, compute):
+        return cache.get_or_set(
+            get_property_values_cache_key(
+                self.layer.pk, self.property_name, self.search, part
+            ),
+            compute,
+            app_settings.PROPERTY_VALUES_CACHE_TIMEOUT,
+        )
+
+    @cached_property
+    def profiled(self):
+        """Values profiled by the last refresh, if they are all known"""
+        if not app_settings.FIELD_PROFILES:
+            return None
+        profile = (
+            self.source.fields.filter(name=self.property_name)
+            .values_list("profile", flat=True)
+            .first()
+        )
+        values = get_profile_values(profile) if profile else None
+        if values is not None and self.search:
+            search = self.search.lower()
+            values = [
+                item
+                for item in values
+                if item[0] is not None and str(item[0]).lower().startswith(search)
+            ]
+        return values
+
+    def get_queryset(self):
+        lookup = f"properties__{self.property_name}"
+        features = self.layer.features.all()
+        if self.search:
+            features = features.filter(**{f"{lookup}__istartswith": self.search})
+        return features.values_list(lookup).annotate(count=Count("pk")).order_by(lookup)
+
+    def _count(self):
+        if self.profiled is not None:
+            return len(self.profiled)
+        return self.get_queryset().count()
+
+    def _get_values(self, start, stop):
+        if self.profiled is not None:
+            return self.profiled[start:stop]
+        return [list(row) for row in self.get_queryset()[start:stop]]
+
+
+@receiver(refresh_data_done)
+def clear_property_values_cache(sender, layer, **kwargs):
+    cache.delete(f"geosource-property-values-{layer}")
+
+
 class Field(models.Model):
     source = models.ForeignKey(Source, related_name="fields", on_delete=models.CASCADE)
     name = models.CharField(max_length=255, blank=False)
@@ -350,6 +1344,9 @@ class Field(models.Model):
     level = models.IntegerField(default=0)
     sample = models.JSONField(default=list, encoder=DjangoJSONEncoder, blank=True)
     order = models.IntegerField(default=0)
+    searchable = models.BooleanField(default=True)
+    # Statistics of the values written by the last refresh, see SourceProfiler
+    profile = models.JSONField(default=dict, encoder=DjangoJSONEncoder, blank=True)
 
     class Meta:
         unique_together = ["source", "name"]
@@ -359,6 +1356,23 @@ class Field(models.Model):
         return f"{self.name} ({self.source.name} - {self.data_type})"
 
 
+class FeatureDigest(models.Model):
+    """Content hash of a source feature, as written by the last refresh"""
+
+    source = models.ForeignKey(
+        Source, related_name="feature_digests", on_delete=models.CASCADE
+    )
+    identifier = models.CharField(max_length=255)
+    digest = models.CharField(max_length=32)
+    refreshed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ["source", "identifier"]
+
+    def __str__(self):
+        return f"{self.identifier} ({self.source.name})"
+
+
 class PostGISSource(Source):
     db_host = models.CharField(
         max_length=255,
@@ -374,14 +1388,50 @@ class PostGISSource(Source):
 
     refresh = models.IntegerField(default=-1)
 
+    # Incremental refresh: only rows whose watermark field reached the last
+    # recorded value are read, deletes come from the tombstone predicate or
+    # from full refreshes run every reconcile_interval minutes.
+    watermark_field = models.CharField(max_length=255, blank=True, default="")
+    tombstone_predicate = models.TextField(blank=True, default="")
+    reconcile_interval = models.IntegerField(default=-1)
+    last_watermark = models.CharField(max_length=255, blank=True, default="")
+    last_reconcile = models.DateTimeField(null=True, blank=True)
+
     @property
     def SOURCE_GEOM_ATTRIBUTE(self):
         return self.geom_field
 
-    @property
-    def _db_connection(self):
+    def _refresh_data(self, es_index=None):
+        incremental = self._is_incremental_refresh()
+        response = super()._refresh_data(es_index)
+        if self.watermark_field and self.report.status != SourceReporting.Status.ERROR:
+            if self._next_watermark is not None:
+                self.last_watermark = self._format_watermark(self._next_watermark)
+            if not incremental:
+                self.last_reconcile = self.report.started
+            self.save(update_fields=["last_watermark", "last_reconcile"])
+        return response
+
+    def _is_incremental_refresh(self):
+        if not self.watermark_field or not self.last_watermark:
+            return False
+        if self.reconcile_interval < 1:
+            return True
+        if not self.last_reconcile:
+            return False
+        next_reconcile = self.last_reconcile + timedelta(
+            minutes=self.reconcile_interval
+        )
+        return next_reconcile > timezone.now()
+
+    def _format_watermark(self, value):
+        if isinstance(value, date):
+            return value.isoformat()
+        return str(value)
+
+    def _connect(self):
         try:
-            conn = psycopg2.connect(
+            return psycopg2.connect(
                 user=self.db_username,
                 password=self.db_password,
                 host=self.db_host,
@@ -392,23 +1442,148 @@ class PostGISSource(Source):
             if not self.report:
                 self.report = SourceReporting(started=timezone.now())
             self.report.status = SourceReporting.Status.ERROR.value
-            self.report.errors.append(err.args[0])
+            self.report.add_error(err.args[0], type(err).__name__)
             self.report.save()
             raise
-        return conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-    def _get_records(self, limit=None):
-        cursor = self._db_connection
 
-        query = "SELECT * FROM ({}) q "
-        attrs = [sql.SQL(self.query)]
+    @property
+    def _db_connection(self):
+        return self._connect().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    def _iter_records(self, limit=None):
+        return self._query_records(limit=limit)
+
+    def _iter_changed_records(self):
+        self._removed_identifiers = []
+        return self._query_records(since=self.last_watermark)
+
+    def _get_removed_identifiers(self):
+        return self._removed_identifiers
+
+    def _get_shards(self, count):
+        if self.watermark_field:
+            # The next watermark is known once all records are read
+            return None
+        # Identifiers splitting the rows in shards of the same size, as text
+        # literals cast back to their type when compared
+        query = sql.SQL(
+            "SELECT count(*), percentile_disc({fractions}::float8[]) "
+            "WITHIN GROUP (ORDER BY q.{id})::text[] FROM ({query}) q"
+        ).format(
+            fractions=sql.Literal([k / count for k in range(1, count)]),
+            id=sql.Identifier(self.id_field),
+            query=sql.SQL(self.query),
+        )
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+                total, bounds = cursor.fetchone()
+        finally:
+            connection.close()
+        if total < app_settings.SHARD_MIN_ROWS or not bounds:
+            return None
+        bounds = [None, *dict.fromkeys(bounds), None]
+        return [[lower, upper] for lower, upper in zip(bounds, bounds[1:])]
+
+    def _iter_shard_records(self, shard):
+        return self._query_records(key_range=shard)
+
+    def _query_records(self, limit=None, since=None, key_range=None):
+        self._next_watermark = None
+        connection = self._connect()
+        # A named cursor is kept on the server side, rows are fetched by
+        # batches of itersize while iterating
+        cursor = connection.cursor(name="geosource_records")
+        cursor.itersize = app_settings.POSTGIS_ITERSIZE
+
+        # Geometries are reprojected and encoded by the remote server. Those
+        # without SRID can't be, they are reported instead of failing the query
+        query = (
+            "SELECT CASE WHEN ST_SRID(q.{geom}::geometry) = 0 THEN NULL "
+            "ELSE ST_AsBinary(ST_Force2D(ST_Transform(q.{geom}::geometry, 4326))) "
+            "END, "
+        )
+        attrs = {"geom": sql.Identifier(self.geom_field), "query": sql.SQL(self.query)}
+        if self.tombstone_predicate:
+            query += "({tombstone}) IS TRUE, "
+            attrs["tombstone"] = sql.SQL(self.tombstone_predicate)
+        query += "q.* FROM ({query}) q "
+        conditions = []
+        if since is not None:
+            # Rows at the watermark are read again, some may have been
+            # committed after the last refresh
+            conditions.append("q.{watermark} >= {since}")
+            attrs["watermark"] = sql.Identifier(self.watermark_field)
+            attrs["since"] = sql.Literal(since)
+        if key_range is not None:
+            lower, upper = key_range
+            attrs["id"] = sql.Identifier(self.id_field)
+            if lower is not None:
+                conditions.append("q.{id} >= {lower}")
+                attrs["lower"] = sql.Literal(lower)
+            if upper is not None:
+                # Rows without identifier are read by the first shard
+                conditions.append(
+                    "q.{id} < {upper}"
+                    if lower is not None
+                    else "(q.{id} < {upper} OR q.{id} IS NULL)"
+                )
+                attrs["upper"] = sql.Literal(upper)
+        if conditions:
+            query += "WHERE " + " AND ".join(conditions) + " "
         if limit:
-            query += "LIMIT {}"
-            attrs.append(sql.Literal(limit))
+            query += "LIMIT {limit}"
+            attrs["limit"] = sql.Literal(limit)
 
-        cursor.execute(sql.SQL(query).format(*attrs))
+        cursor.execute(sql.SQL(query).format(**attrs))
 
-        return (cursor, [])
+        return self._fetch_records(
+            connection, cursor, collect_removed=since is not None
+        )
+
+    def _fetch_records(self, connection, cursor, collect_removed=False):
+        try:
+            rows = iter(cursor)
+            first_row = next(rows, None)
+            if first_row is None:
+                return
+            # Columns positions are resolved once, the source geometry column is
+            # replaced by the transformed one
+            tombstone = 1 if self.tombstone_predicate else None
+            fields = [
+                (i, column.name)
+                for i, column in enumerate(cursor.description)
+                if i > (tombstone or 0) and column.name != self.geom_field
+            ]
+            positions = {name: index for index, name in fields}
+            watermark = positions.get(self.watermark_field)
+            if self.watermark_field and watermark is None:
+                msg = f"Watermark field '{self.watermark_field}' is not returned by the query"
+                raise SourceException(msg)
+            identifier = positions.get(self.id_field)
+
+            for i, row in enumerate(chain((first_row,), rows)):
+                if watermark is not None and row[watermark] is not None:
+                    if (
+                        self._next_watermark is None
+                        or row[watermark] > self._next_watermark
+                    ):
+                        self._next_watermark = row[watermark]
+                if tombstone and row[tombstone]:
+                    if collect_removed and identifier is not None:
+                        self._removed_identifiers.append(str(row[identifier]))
+                    continue
+                if row[0] is None:
+                    yield RecordError(f"Line {i} - Empty geometry or unknown SRID")
+                    continue
+                yield {
+                    self.geom_field: GEOSGeometry(row[0], srid=4326),
+                    **{name: row[index] for index, name in fields},
+                }
+        finally:
+            cursor.close()
+            connection.close()
 
     class Meta:
         verbose_name = _("PostGIS Source")
@@ -418,34 +1593,67 @@ class PostGISSource(Source):
 class GeoJSONSource(Source):
     file = models.FileField(upload_to="geosource/geojson/%Y/")
 
+    @contextmanager
+    def _open_file(self):
+        """
+        Open the file from its start, as a source is read more than once. Uploaded
+        files are left open until they are saved.
+        """
+        file = self.file.open("rb")
+        file.seek(0)
+        try:
+            yield file
+        finally:
+            if self.file._committed:
+                file.close()
+
     def get_file_as_dict(self):
         try:
-            return json.load(self.file)
+            with self._open_file() as file:
+                return json.load(file)
         except json.JSONDecodeError:
             msg = "Source's GeoJSON file is not valid"
             raise GeoJSONSourceException(msg)
 
-    def _get_records(self, limit=None):
-        geojson = self.get_file_as_dict()
-
-        limit = limit if limit else len(geojson["features"])
-
-        records = []
-        errors = []
-        for i, record in enumerate(geojson["features"][:limit]):
+    def _get_record(self, feature, i):
+        try:
+            geometry = self._get_geometry(feature["geometry"])
+        except (ValueError, GDALException) as exc:
+            feature_id = feature.get("properties", {}).get("id", i)
+            return RecordError(f"Feature id {feature_id}: {exc}")
+        return {self.SOURCE_GEOM_ATTRIBUTE: geometry, **feature["properties"]}
+
+    def _iter_records(self, limit=None):
+        with self._open_file() as file:
+            features = iter_features(file)
+            for i, feature in enumerate(islice(features, limit or None)):
+                yield self._get_record(feature, i)
+
+    def _iter_chunks(self, size):
+        # Features are only split here, workers decode them
+        with self._open_file() as file:
+            features = iter_features(file, raw=True)
+            start = 0
+            while chunk := list(islice(features, size)):
+                yield start, chunk
+                start += len(chunk)
+
+    def _parse_chunk(self, chunk):
+        start, features = chunk
+        for i, text in enumerate(features, start):
             try:
-                records.append(
-                    {
-                        self.SOURCE_GEOM_ATTRIBUTE: GEOSGeometry(
-                            json.dumps(record["geometry"])
-                        ),
-                        **record["properties"],
-                    }
-                )
-            except (ValueError, GDALException) as exc:
-                feature_id = record.get("properties", {}).get("id", i)
-                errors.append(f"Feature id {feature_id}: {exc}")
-        return (records, errors)
+                feature = json.loads(text)
+            except json.JSONDecodeError:
+                msg = "Source's GeoJSON file is not valid"
+                raise GeoJSONSourceException(msg)
+            yield self._get_record(feature, i)
+
+    def _get_geometry(self, geometry):
+        try:
+            return geometry_from_geojson(geometry)
+        except (ValueError, TypeError, GEOSException):
+            # Let GDAL parse what isn't handled, and raise its own error
+            return GEOSGeometry(json.dumps(geometry))
 
     class Meta:
         verbose_name = _("GeoJSON Source")
@@ -456,36 +1664,91 @@ class ShapefileSource(Source):
     # Zipped ShapeFile
     file = models.FileField(upload_to="geosource/shapefile/%Y/")
 
-    def _get_records(self, limit=None):
-        with fiona.BytesCollection(self.file.read()) as shapefile:
-            limit = limit if limit else len(shapefile)
-            # Detect the EPSG
-
-            ccs = CRS(to_string(shapefile.crs))
-            srid = ccs.to_epsg()
-            if not srid:
-                srid = 4326
-            # Return geometries with a hack to set the correct geometry srid
-            records = []
-            for feature in shapefile[:limit]:
-                geometry = GEOSGeometry(
-                    json.dumps(
-                        {
-                            "type": feature.get("geometry").get("type"),
-                            "coordinates": feature.get("geometry").get("coordinates"),
-                        }
-                    )
-                )
-                geometry.srid = srid
-                records.append(
-                    {
-                        self.SOURCE_GEOM_ATTRIBUTE: geometry,
-                        **feature.get("properties", {}),
-                    }
-                )
+    def _get_path(self):
+        try:
+            # Uploaded files not saved yet have no path
+            return self.file.path if self.file._committed else None
+        except NotImplementedError:
+            # Remote storages don't provide a local path
+            return None
+
+    def _open_collection(self):
+        """Open the stored zip by path, so that it is not read in memory"""
+        path = self._get_path()
+        if path:
+            return fiona.open(f"zip://{path}")
+        return fiona.BytesCollection(self.file.read())
+
+    def _get_collection_srid(self, shapefile):
+        """Detect the EPSG, once for the whole collection"""
+        ccs = CRS(to_string(shapefile.crs))
+        return ccs.to_epsg() or 4326
+
+    def _get_record(self, feature, i, srid):
+        try:
+            geometry = geometry_from_geojson(feature.geometry, srid=srid)
+        except (ValueError, GEOSException) as exc:
+            return RecordError(f"Feature {feature.id or i}: {exc}")
+        return {
+            self.SOURCE_GEOM_ATTRIBUTE: geometry,
+            **feature.get("properties", {}),
+        }
+
+    def _iter_records(self, limit=None):
+        with self._open_collection() as shapefile:
+            srid = self._get_collection_srid(shapefile)
+            for i, feature in enumerate(islice(shapefile, limit or None)):
+                yield self._get_record(feature, i, srid)
+
+    def _iter_chunks(self, size):
+        # Workers open the file by themselves, it has to be reachable by path
+        path = self._get_path()
+        if not path:
+            return None
+        with self._open_collection() as shapefile:
+            srid = self._get_collection_srid(shapefile)
+            count = len(shapefile)
+        return (
+            (path, start, min(start + size, count), srid)
+            for start in range(0, count, size)
+        )
 
-            # No errors caught for Shapefile
-            return records, []
+    def _parse_chunk(self, chunk):
+        path, start, stop, srid = chunk
+        with fiona.open(f"zip://{path}") as shapefile:
+            for i, (_, feature) in enumerate(shapefile.items(start, stop), start):
+                yield self._get_record(feature, i, srid)
+
+    def _get_shards(self, count):
+        with self._open_collection() as shapefile:
+            return get_identifier_shards(len(shapefile), count)
+
+    def _iter_shard_records(self, shard):
+        with self._open_collection() as shapefile:
+            srid = self._get_collection_srid(shapefile)
+            for i, feature in enumerate(shapefile):
+                if in_identifier_shard(
+                    feature.get("properties") or {}, self.id_field, shard
+                ):
+                    yield self._get_record(feature, i, srid)
+
+    def _iter_sample(self, size, chunks):
+        with self._open_collection() as shapefile:
+            srid = self._get_collection_srid(shapefile)
+            count = len(shapefile)
+            chunk_size = -(-size // chunks)
+            indexes = sorted(
+                {
+                    i
+                    for k in range(chunks)
+                    for i in range(
+                        count * k // chunks, count * k // chunks + chunk_size
+                    )
+                    if i < count
+                }
+            )
+            for i in indexes[:size]:
+                yield self._get_record(shapefile[i], i, srid)
 
     class Meta:
         verbose_name = _("Shapefile Source")
@@ -518,7 +1781,7 @@ class CommandSource(Source):
 
         return {"count": layer.features.count()}
 
-    def _get_records(self, limit=None):
+    def _get_records(self, limit=None, chunks=None):
         return [None, None]
 
     class Meta:
@@ -542,7 +1805,7 @@ class WMTSSource(Source):
     def refresh_data(self):
         return {}
 
-    def _get_records(self, limit=None):
+    def _get_records(self, limit=None, chunks=None):
         return [None, None]
 
     class Meta:
@@ -562,6 +1825,8 @@ class CSVSource(Source):
         "point": ".",
     }
     file = models.FileField(upload_to="geosource/csv/%Y")
+    # Number of rows converted together
+    CHUNK_SIZE = 1000
 
     def get_file_as_sheet(self):
         separator = self._get_separator(self.settings["field_separator"])
@@ -578,71 +1843,184 @@ class CSVSource(Source):
             msg = "Provided CSV file is invalid"
             raise CSVSourceException(msg)
 
-    def _get_records(self, limit=None):
-        sheet = self.get_file_as_sheet()
-        if self.settings.get("use_header"):
-            sheet.name_columns_by_row(0)
-
-        ignored_columns = []
-        if self.settings.get("ignore_columns"):
-            ignored_columns = self._get_null_columns_indexes(sheet)
-
-        limit = limit if limit else len(sheet)
-
-        records = []
-        errors = []
-        srid = self._get_srid()
+    def _iter_rows(self, chunks=None, chunk_size=None):
+        """
+        Stream the file rows as raw text, their cells are converted later. If
+        ``chunks`` is given, only rows of evenly spaced chunks are read.
+        """
+        separator = self._get_separator(self.settings["field_separator"])
+        quotechar = self._get_separator(self.settings["char_delimiter"])
+        try:
+            if self.file.name.rsplit(".", 1)[-1].lower() not in csv_reader.FILE_TYPES:
+                msg = f"{self.file.name} is not a CSV file"
+                raise CSVSourceException(msg)
+            if chunks:
+                yield from csv_reader.iter_spread_rows(
+                    self.file.path,
+                    encoding=self.settings["encoding"],
+                    delimiter=separator,
+                    quotechar=quotechar,
+                    chunks=chunks,
+                    chunk_size=chunk_size,
+                )
+                return
+            yield from csv_reader.iter_rows(
+                self.file.path,
+                encoding=self.settings["encoding"],
+                delimiter=separator,
+                quotechar=quotechar,
+            )
+        except Exception:
+            msg = "Provided CSV file is invalid"
+            raise CSVSourceException(msg)
 
-        for i, row in enumerate(sheet):
-            if self.settings["coordinates_field"] == "two_columns":
-                lat_field = self.settings["latitude_field"]
-                lng_field = self.settings["longitude_field"]
+    def _iter_sample(self, size, chunks):
+        return self._iter_records(size, chunks)
 
-                try:
-                    x, y = self._extract_coordinates(
-                        row, sheet.colnames, [lng_field, lat_field]
-                    )
-                except CSVSourceException as e:
-                    errors.append(f"Sheet row {i} - {e.message}")
-                    continue
+    def _iter_records(self, limit=None, chunks=None):
+        for chunk in self._iter_chunks(self.CHUNK_SIZE, limit, chunks):
+            yield from self._parse_chunk(chunk)
 
-                ignored_field = (row.index(x), row.index(y), *ignored_columns)
-            else:
-                lnglat_field = self.settings["latlong_field"]
-                try:
-                    x, y = self._extract_coordinates(
-                        row, sheet.colnames, [lnglat_field]
-                    )
-                except CSVSourceException as e:
-                    errors.append(f"Sheet row {i} - {e.message}")
-                    continue
+    def _get_shards(self, count):
+        rows = sum(1 for _ in self._iter_rows())
+        if self.settings.get("use_header"):
+            rows -= 1
+        return get_identifier_shards(rows, count)
+
+    def _iter_shard_records(self, shard):
+        for chunk in self._iter_chunks(self.CHUNK_SIZE):
+            yield from self._parse_chunk(chunk, shard)
+
+    def _iter_chunks(self, size, limit=None, chunks=None):
+        """
+        Yield the raw rows by chunks of ``size``, as ``(first row number, rows,
+        layout)`` tuples, the layout telling how their cells are converted.
+        """
+        use_header = self.settings.get("use_header")
+        # Sampled rows are spread in chunks, the header being in the first one
+        spread = {}
+        if chunks:
+            spread = {"chunks": chunks, "chunk_size": -(-limit // chunks)}
 
-                coord_fields = (
-                    (sheet.colnames.index(lnglat_field),)
-                    if self.settings.get("use_header")
-                    else (int(lnglat_field),)
+        ignored_columns = []
+        width = 0
+        if self.settings.get("ignore_columns") or not use_header:
+            # Needs its own pass over the rows read, as a column is only known
+            # to be empty, and the widest row only known, once every row was read
+            start = 1 if use_header else 0
+            width, ignored_columns = self._scan_columns(
+                islice(
+                    self._iter_rows(**spread),
+                    start,
+                    start + limit if limit else None,
                 )
-                ignored_field = (*coord_fields, *ignored_columns)
+            )
+            if not self.settings.get("ignore_columns"):
+                ignored_columns = []
+
+        srid = self._get_srid()
+        rows = self._iter_rows(**spread)
+        colnames = []
+        if use_header:
+            # Header cells are converted before naming columns, as pyexcel does
+            header = [cell and csv_reader.convert_cell(cell) for cell in next(rows, [])]
+            colnames = make_names_unique(header)
+        width = max(width, len(colnames))
+        # records names are the column index when no header was provided
+        # casting to str to avoid issue (e.i id_field)
+        names = colnames if use_header else [str(i) for i in range(width)]
+        rows = islice(rows, limit or None)
+
+        if self.settings["coordinates_field"] == "two_columns":
+            coord_fields = [
+                self.settings["longitude_field"],
+                self.settings["latitude_field"],
+            ]
+        else:
+            coord_fields = [self.settings["latlong_field"]]
+        try:
+            # Columns positions are resolved once for the whole file
+            coord_indexes = self._get_coordinates_indexes(colnames, coord_fields)
+        except CSVSourceException as e:
+            layout = {"error": e.message}
+        else:
+            ignored = {*coord_indexes, *ignored_columns}
+            layout = {
+                "fields": [
+                    (j, name) for j, name in enumerate(names) if j not in ignored
+                ],
+                "coord_indexes": coord_indexes,
+                "width": width,
+                "srid": srid,
+            }
 
-            cells = self._get_cells(sheet, row, ignored_field)
+        i = 0
+        while chunk := list(islice(rows, size)):
+            yield i, chunk, layout
+            i += len(chunk)
+
+    def _parse_chunk(self, chunk, shard=None):
+        """Parse the rows of a chunk, only those of a ``[part, count]`` shard if given"""
+        i, rows, layout = chunk
+        numbers = range(i, i + len(rows))
+        if shard is not None:
+            numbers, rows = self._select_shard_rows(numbers, rows, layout, shard)
+            if not rows:
+                return
+        if "error" in layout:
+            for number in numbers:
+                yield RecordError(f"Sheet row {number} - {layout['error']}")
+            return
+
+        width, srid = layout["width"], layout["srid"]
+        # Rows are converted column by column, short ones being padded as
+        # pyexcel does for a whole sheet
+        columns = list(zip(*(row + [""] * (width - len(row)) for row in rows)))
+        values = [
+            (name, list(map(self._format_cell_value, columns[j])))
+            for j, name in layout["fields"]
+        ]
+        coordinates = zip(*(columns[j] for j in layout["coord_indexes"]))
+        for k, coords in enumerate(coordinates):
             try:
-                records.append(
-                    {
-                        self.SOURCE_GEOM_ATTRIBUTE: GEOSGeometry(
-                            f"Point({x} {y})", srid=srid
-                        ),
-                        **cells,
-                    }
+                x, y = self._split_coordinates(coords)
+                geometry = GEOSGeometry(
+                    memoryview(WKB_POINT.pack(1, 1, float(x), float(y))),
+                    srid=srid,
                 )
+            except CSVSourceException as e:
+                yield RecordError(f"Sheet row {numbers[k]} - {e.message}")
             except (ValueError, GDALException):
-                errors.append(
-                    f"Sheet row {i} - One of source's record has invalid geometry: Point({x} {y}) srid={srid}"
+                yield RecordError(
+                    f"Sheet row {numbers[k]} - One of source's record has invalid geometry: Point({x} {y}) srid={srid}"
                 )
-                continue
-        return (records, errors)
+            else:
+                yield {
+                    self.SOURCE_GEOM_ATTRIBUTE: geometry,
+                    **{name: column[k] for name, column in values},
+                }
+
+    def _select_shard_rows(self, numbers, rows, layout, shard):
+        """Keep the rows of a shard, given by their identifier cell"""
+        index = next(
+            (j for j, name in layout.get("fields", ()) if name == self.id_field), None
+        )
+        selected = []
+        for number, row in zip(numbers, rows):
+            properties = {}
+            if index is not None:
+                cell = row[index] if index < len(row) else ""
+                properties[self.id_field] = self._format_cell_value(cell)
+            if in_identifier_shard(properties, self.id_field, shard):
+                selected.append((number, row))
+        return [number for number, _ in selected], [row for _, row in selected]
 
     def _extract_coordinates(self, row, colnames, coord_fields):
-        coords = []
+        indexes = self._get_coordinates_indexes(colnames, coord_fields)
+        return self._split_coordinates([row[index] for index in indexes])
+
+    def _get_coordinates_indexes(self, colnames, coord_fields):
+        indexes = []
         for field in coord_fields:
             # if no header, we expect index for the columns has been provided
             try:
@@ -654,9 +2032,10 @@ class CSVSource(Source):
             except ValueError:
                 msg = f"{field} is not a valid coordinate field"
                 raise CSVSourceException(msg)
+            indexes.append(field_index)
+        return indexes
 
-            c = row[field_index]
-            coords.append(c)
+    def _split_coordinates(self, coords):
         if len(coords) == 2:
             x, y = coords
         else:
@@ -677,31 +2056,17 @@ class CSVSource(Source):
 
         return (x, y)
 
-    def _get_null_columns_indexes(self, sheet):
-        null_columns_indexes = []
-        for i, column in enumerate(sheet.column):
-            non_empty_cells = [cell for cell in column if cell != ""]
-            (len(non_empty_cells) == 0) and null_columns_indexes.append(i)
-        return null_columns_indexes
-
-    def _get_cells(self, sheet, row, ingored_columns):
-        if not self.settings.get("use_header"):
-            # records names are the column index when no header was provided
-            # casting to str to avoid issue (e.i id_field)
-            return {
-                str(i): self._format_cell_value(value)
-                for i, value in enumerate(row)
-                if i not in ingored_columns
-            }
-
-        return {
-            name: self._format_cell_value(value)
-            for i, (name, value) in enumerate(zip(sheet.colnames, row))
-            if i not in ingored_columns
-        }
+    def _scan_columns(self, rows):
+        """Return the width of the widest row and the indexes of null columns"""
+        width = 0
+        non_empty_columns = set()
+        for row in rows:
+            width = max(width, len(row))
+            non_empty_columns.update(i for i, cell in enumerate(row) if cell != "")
+        return width, [i for i in range(width) if i not in non_empty_columns]
 
     def _format_cell_value(self, value):
-        return None if value == "" else value
+        return None if value == "" else csv_reader.convert_cell(value)
 
     def _get_separator(self, name):
         return self.SEPARATORS[name]
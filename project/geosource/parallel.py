@@ -0,0 +1,61 @@
+import pickle
+from collections import deque
+
+import billiard
+
+# Source parsing chunks in a worker process
+_source = None
+
+
+def _init_worker(state):
+    global _source
+    # Workers are spawned, so that they don't inherit connections or threads
+    import django
+
+    django.setup()
+    _source = pickle.loads(state)
+
+
+def _parse_chunk(chunk):
+    # Geometries are sent back as EWKB, GEOS geometries would be parsed again
+    # when unpickled
+    records = list(_source._parse_chunk(chunk))
+    for record in records:
+        if isinstance(record, dict):
+            geometry = record[_source.SOURCE_GEOM_ATTRIBUTE]
+            record[_source.SOURCE_GEOM_ATTRIBUTE] = bytes(geometry.ewkb)
+    return records
+
+
+def _load_records(records, geom_attribute):
+    for record in records:
+        if isinstance(record, dict):
+            record[geom_attribute] = memoryview(record[geom_attribute])
+        yield record
+
+
+def iter_parsed_records(source, chunks, workers):
+    """
+    Parse the chunks of a source in a pool of ``workers`` processes, and yield
+    their records in order, with EWKB geometries. Only twice as many chunks as
+    workers are parsed ahead of the records consumed, so that memory stays
+    bounded. The pool is billiard's, whose daemonic processes such as Celery
+    prefork workers can start processes.
+    """
+    pool = billiard.get_context("spawn").Pool(
+        workers,
+        initializer=_init_worker,
+        initargs=(pickle.dumps(source),),
+    )
+    geom_attribute = source.SOURCE_GEOM_ATTRIBUTE
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(_parse_chunk, (chunk,)))
+            if len(pending) >= workers * 2:
+                yield from _load_records(pending.popleft().get(), geom_attribute)
+        while pending:
+            yield from _load_records(pending.popleft().get(), geom_attribute)
+    finally:
+        pool.terminate()
+        pool.join()
@@ -1,18 +1,94 @@
+import heapq
 import logging
+from datetime import timedelta
 
-from project.geosource.models import Source
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, Q
+from django.utils import timezone
+
+from project.geosource import app_settings
+from project.geosource.models import PostGISSource, Source
 
 logger = logging.getLogger(__name__)
 
+# Estimated duration of a refresh, in seconds, when its source never reported one
+DEFAULT_COST = 60 * 3
+
+
+def get_due_sources():
+    """Sources whose refresh interval elapsed, selected by a single query"""
+    next_refresh = ExpressionWrapper(
+        F("last_refresh")
+        + ExpressionWrapper(
+            F("refresh") * timedelta(minutes=1), output_field=DurationField()
+        ),
+        output_field=DateTimeField(),
+    )
+    # Only PostGIS sources are refreshed periodically
+    return (
+        PostGISSource.objects.exclude(status=Source.Status.PENDING)
+        .filter(refresh__gte=1)
+        .alias(next_refresh=next_refresh)
+        .filter(Q(last_refresh__isnull=True) | Q(next_refresh__lt=timezone.now()))
+        .select_related("report")
+    )
+
+
+def get_cost(source, throughput=None):
+    """
+    Estimate the duration of a source refresh from its last report: its
+    duration, or its row count at the average throughput of all sources
+    """
+    report = source.report
+    if report is None:
+        return DEFAULT_COST
+    if report.started and report.ended and report.ended > report.started:
+        return (report.ended - report.started).total_seconds()
+    if report.total and throughput:
+        return report.total / throughput
+    return DEFAULT_COST
+
+
+def get_throughput(sources):
+    """Average rows per second of the last reported refreshes"""
+    rows = duration = 0
+    for source in sources:
+        report = source.report
+        if report and report.total and report.started and report.ended:
+            rows += report.total
+            duration += (report.ended - report.started).total_seconds()
+    return rows / duration if duration > 0 else None
+
+
+def plan_refreshes(sources, slots):
+    """
+    Pack refreshes on concurrent worker slots, shortest first so that small
+    sources don't wait behind large ones. Return (source, countdown) tuples,
+    the countdown being the estimated time the refresh's slot is free.
+    """
+    throughput = get_throughput(sources)
+    costs = sorted(
+        ((get_cost(source, throughput), source) for source in sources),
+        key=lambda item: item[0],
+    )
+    loads = [0.0] * max(slots, 1)
+    plan = []
+    for cost, source in costs:
+        load = heapq.heappop(loads)
+        plan.append((source, round(load)))
+        heapq.heappush(loads, load + cost)
+    return plan
+
 
 def auto_refresh_source():
-    countdown = 0
-    for source in Source.objects.exclude(status=Source.Status.PENDING):
-        if source.should_refresh():
-            logger.info("Schedule refresh for source %s<%s>...", source, source.id)
-            # Delay execution by some minutes to avoid struggling
-            try:
-                source.run_async_method("refresh_data", countdown=countdown, force=True)
-                countdown += 60 * 3
-            except Exception:
-                logger.exception("Failed to refresh source!")
+    sources = list(get_due_sources())
+    for source, countdown in plan_refreshes(sources, app_settings.REFRESH_SLOTS):
+        logger.info(
+            "Schedule refresh for source %s<%s> in %ss...",
+            source,
+            source.id,
+            countdown,
+        )
+        try:
+            source.run_async_method("refresh_data", countdown=countdown, force=True)
+        except Exception:
+            logger.exception("Failed to refresh source!")
@@ -0,0 +1,183 @@
+import json
+import numbers
+import random
+import re
+from collections import Counter
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Text values PostgreSQL casts to numeric, as styles do with
+# (properties->>field)::numeric
+NUMERIC_RE = re.compile(r"^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$")
+
+
+def to_number(value):
+    """Return the number a property value is cast to, None if it isn't numeric"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, numbers.Real):
+        return value
+    if isinstance(value, str) and NUMERIC_RE.match(value):
+        number = float(value)
+        return int(number) if number.is_integer() and "." not in value else number
+    return None
+
+
+class FieldProfile:
+    """Running statistics of the values of a field"""
+
+    def __init__(self, sketch_size, max_values, rng):
+        self.sketch_size = sketch_size
+        self.max_values = max_values
+        self.rng = rng
+        self.count = 0
+        # Numeric statistics are dropped as soon as a value can't be cast
+        self.numeric = True
+        self.numbers = 0
+        self.min = self.max = None
+        self.positive_min = self.positive_max = None
+        self.sketch = []
+        self.values = Counter()
+        self.complete = True
+
+    def add(self, value):
+        self.count += 1
+        self._add_value(value)
+        if self.numeric:
+            self._add_number(to_number(value))
+
+    def _add_value(self, value):
+        key = json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True)
+        if key not in self.values and len(self.values) >= self.max_values:
+            # Too many distinct values, only the ones already seen are counted
+            self.complete = False
+            return
+        self.values[key] += 1
+
+    def _add_number(self, number):
+        if number is None:
+            self.numeric = False
+            self.sketch = []
+            return
+        self.numbers += 1
+        if self.min is None or number < self.min:
+            self.min = number
+        if self.max is None or number > self.max:
+            self.max = number
+        if number > 0:
+            if self.positive_min is None or number < self.positive_min:
+                self.positive_min = number
+            if self.positive_max is None or number > self.positive_max:
+                self.positive_max = number
+        # Reservoir sampling keeps a uniform sample of a fixed size
+        if len(self.sketch) < self.sketch_size:
+            self.sketch.append(number)
+        else:
+            i = self.rng.randrange(self.numbers)
+            if i < self.sketch_size:
+                self.sketch[i] = number
+
+    def as_dict(self, total):
+        profile = {
+            "count": total,
+            "nulls": total - self.count,
+            "values": [
+                [json.loads(key), count] for key, count in self.values.most_common()
+            ],
+            "complete": self.complete,
+        }
+        if self.numeric and self.numbers:
+            profile["numeric"] = {
+                "count": self.numbers,
+                "min": self.min,
+                "max": self.max,
+                "positive_min": self.positive_min,
+                "positive_max": self.positive_max,
+                "sketch": sorted(self.sketch),
+            }
+        return profile
+
+
+class SourceProfiler:
+    """
+    Profile the fields of the records read by a refresh: the null count and the
+    most frequent values of each of them, with min and max, positive min and
+    max, and a quantile sketch of numeric ones.
+    """
+
+    def __init__(self, sketch_size, max_values, exclude=()):
+        self.sketch_size = sketch_size
+        self.max_values = max_values
+        self.exclude = set(exclude)
+        self.rng = random.Random(0)
+        self.total = 0
+        self.fields = {}
+
+    def add(self, record):
+        self.total += 1
+        for name, value in record.items():
+            if value is None or name in self.exclude:
+                continue
+            if name not in self.fields:
+                self.fields[name] = FieldProfile(
+                    self.sketch_size, self.max_values, self.rng
+                )
+            self.fields[name].add(value)
+
+    def as_dict(self):
+        return {
+            name: profile.as_dict(self.total) for name, profile in self.fields.items()
+        }
+
+
+def get_profile_quantiles(profile, class_count):
+    """
+    Class boundaries splitting features in ``class_count`` groups of the same
+    size, features without value being last, as ntile() does in SQL. The
+    numeric sketch stands for the values of all features.
+    """
+    numeric = profile["numeric"]
+    sketch = numeric["sketch"]
+    total = numeric["count"] + profile["nulls"]
+    size, extra = divmod(total, class_count)
+    boundaries = []
+    start = 0
+    for i in range(class_count):
+        end = start + size + (1 if i < extra else 0)
+        if start < numeric["count"] and end > start:
+            last = min(end, numeric["count"]) - 1
+            boundaries.append(
+                (
+                    sketch[start * len(sketch) // numeric["count"]],
+                    sketch[last * len(sketch) // numeric["count"]],
+                )
+            )
+        start = end
+    if not boundaries:
+        return []
+    # Each class start + last class end
+    return [boundary[0] for boundary in boundaries] + [boundaries[-1][1]]
+
+
+def get_profile_values(profile):
+    """
+    Distinct values of a field with their count, None if the profile doesn't
+    hold all of them
+    """
+    if not profile.get("complete"):
+        return None
+
+    def sort_key(value):
+        # Ordered by type first, as jsonb values are
+        if isinstance(value, str):
+            return (0, value)
+        if isinstance(value, bool):
+            return (2, value)
+        if isinstance(value, numbers.Number):
+            return (1, value)
+        return (3, json.dumps(value, sort_keys=True))
+
+    values = sorted(profile["values"], key=lambda item: sort_key(item[0]))
+    if profile["nulls"]:
+        values.append([None, profile["nulls"]])
+    return values
@@ -0,0 +1,138 @@
+import time
+
+from django.core.cache import cache
+
+from . import app_settings
+from .locks import get_lease_timeout
+from .renderers import format_event
+
+COUNTS = ("read", "written", "failed")
+
+
+def get_progress_key(source_id, part=None):
+    key = f"geosource-refresh-progress-{source_id}"
+    return key if part is None else f"{key}-{part}"
+
+
+class RefreshProgress:
+    """
+    Progress of a refresh, published to the cache at most every
+    PROGRESS_INTERVAL seconds so that it can be followed without querying
+    the database. Shards of a refresh publish their own ``part``.
+    """
+
+    def __init__(self, source_id, report, timer=None, expected=None, part=None):
+        self.key = get_progress_key(source_id, part)
+        # Report of the refresh, failed records are counted from its errors
+        self.report = report
+        self.timer = timer
+        self.expected = expected
+        self.started = time.time()
+        self.read = 0
+        self.written = 0
+        self.published = None
+
+    @property
+    def stage(self):
+        if self.timer is None or not self.timer.stack:
+            return None
+        return self.timer.stack[-1]
+
+    def iterate(self, records):
+        """Yield records, counting them as read"""
+        for record in records:
+            self.read += 1
+            self.publish()
+            yield record
+
+    def advance(self, written):
+        self.written += written
+        self.publish()
+
+    def publish(self, force=False, **extra):
+        if not app_settings.PROGRESS_INTERVAL:
+            return
+        now = time.monotonic()
+        if (
+            not force
+            and self.published is not None
+            and now - self.published < app_settings.PROGRESS_INTERVAL
+        ):
+            return
+        self.published = now
+        cache.set(
+            self.key,
+            {
+                "stage": self.stage,
+                "read": self.read,
+                "written": self.written,
+                "failed": self.report.error_count,
+                "expected": self.expected,
+                "started": self.started,
+                "updated": time.time(),
+                "finished": False,
+                **extra,
+            },
+            get_lease_timeout(),
+        )
+
+    def finish(self):
+        self.publish(force=True, stage=None, finished=True)
+
+
+def finish_progress(source_id):
+    """Mark the progress of a refresh split in shards as finished"""
+    key = get_progress_key(source_id)
+    progress = cache.get(key)
+    if progress is not None:
+        cache.set(
+            key,
+            {**progress, "stage": None, "finished": True, "updated": time.time()},
+            get_lease_timeout(),
+        )
+
+
+def get_progress(source_id):
+    """
+    Last progress published by the refresh of a source, with the estimated
+    number of seconds left, or None if it was not refreshed lately
+    """
+    progress = cache.get(get_progress_key(source_id))
+    if progress is None:
+        return None
+    if progress.get("shards"):
+        parts = cache.get_many(
+            [get_progress_key(source_id, part) for part in range(progress["shards"])]
+        ).values()
+        for name in COUNTS:
+            progress[name] = sum(part[name] for part in parts)
+        progress["updated"] = max(
+            [progress["updated"], *(part["updated"] for part in parts)]
+        )
+        if not progress["finished"]:
+            stages = {part["stage"] for part in parts if not part["finished"]}
+            progress["stage"] = stages.pop() if len(stages) == 1 else "shards"
+
+    progress["eta"] = None
+    elapsed = progress["updated"] - progress["started"]
+    if not progress["finished"] and progress["expected"] and progress["read"]:
+        left = max(progress["expected"] - progress["read"], 0)
+        progress["eta"] = round(left * elapsed / progress["read"])
+    return progress
+
+
+def iter_progress_events(source_id, duration=None):
+    """
+    Yield the progress of a refresh as server-sent events, until it is finished
+    or for ``duration`` seconds at most, clients reconnecting to follow it.
+    """
+    interval = max(app_settings.PROGRESS_INTERVAL, 1)
+    deadline = None if duration is None else time.monotonic() + duration
+    while True:
+        progress = get_progress(source_id)
+        yield format_event(progress)
+        if progress is None or progress["finished"]:
+            return
+        if deadline is not None and time.monotonic() + interval > deadline:
+            return
+        time.sleep(interval)
@@ -0,0 +1,35 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import renderers
+
+
+def format_event(data):
+    return f"data: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n".encode()
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """
+    Renderer of server-sent events, responses that are not streamed are sent as
+    a single event
+    """
+
+    media_type = "text/event-stream"
+    format = "event-stream"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event(data)
+
+
+class Echo:
+    """File-like object returning what is written to it, to stream CSV lines"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv_lines(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
@@ -0,0 +1,151 @@
+import math
+import threading
+from collections import defaultdict
+
+from pyproj import Transformer
+from pyproj.exceptions import CRSError
+
+from .geojson import WKB_PACKERS, geometry_from_geojson
+
+_local = threading.local()
+
+
+def get_transformer(srid, target=4326):
+    """
+    Transformer between two SRIDs. Building one is costly, so they are cached,
+    per thread as they can't be shared between threads.
+    """
+    transformers = _local.__dict__.setdefault("transformers", {})
+    key = (srid, target)
+    if key not in transformers:
+        transformers[key] = Transformer.from_crs(srid, target, always_xy=True)
+    return transformers[key]
+
+
+def _as_geojson(geom):
+    if geom.geom_type == "GeometryCollection":
+        return {"type": geom.geom_type, "geometries": [_as_geojson(g) for g in geom]}
+    if geom.geom_type not in WKB_PACKERS:
+        msg = f"Unsupported geometry type: {geom.geom_type}"
+        raise ValueError(msg)
+    return {"type": geom.geom_type, "coordinates": geom.coords}
+
+
+def _collect(shape, positions):
+    """Append the positions of a GeoJSON geometry to a flat list"""
+    if "geometries" in shape:
+        for geometry in shape["geometries"]:
+            _collect(geometry, positions)
+        return
+
+    def walk(coordinates, depth):
+        if depth == 0:
+            positions.append(coordinates)
+        else:
+            for item in coordinates:
+                walk(item, depth - 1)
+
+    walk(shape["coordinates"], WKB_PACKERS[shape["type"]][0])
+
+
+def _rebuild(shape, positions):
+    """Copy a GeoJSON geometry with positions taken from an iterator"""
+    if "geometries" in shape:
+        return {
+            "type": shape["type"],
+            "geometries": [
+                _rebuild(geometry, positions) for geometry in shape["geometries"]
+            ],
+        }
+
+    def walk(coordinates, depth):
+        if depth == 0:
+            return next(positions)
+        return [walk(item, depth - 1) for item in coordinates]
+
+    return {
+        "type": shape["type"],
+        "coordinates": walk(shape["coordinates"], WKB_PACKERS[shape["type"]][0]),
+    }
+
+
+def reproject(geometries, srid=4326):
+    """
+    Transform GEOS geometries, given by key, to ``srid``. They are grouped by
+    SRID so that the coordinates of each group are transformed by a single
+    call. Return the transformed geometries by key, and the ``(key, exception)``
+    list of the ones that couldn't be.
+    """
+    reprojected = {}
+    errors = []
+    groups = defaultdict(dict)
+    for key, geom in geometries.items():
+        if geom.srid == srid:
+            reprojected[key] = geom
+        elif geom.srid is None:
+            errors.append((key, ValueError("Geometry has no SRID")))
+        elif geom.empty:
+            reprojected[key] = geom.transform(srid, clone=True)
+        else:
+            groups[geom.srid][key] = geom
+
+    for source_srid, group in groups.items():
+        try:
+            transformer = get_transformer(source_srid, srid)
+        except CRSError as exc:
+            errors.extend((key, exc) for key in group)
+            continue
+
+        shapes = {}
+        positions = []
+        for key, geom in group.items():
+            try:
+                shape = _as_geojson(geom)
+            except ValueError:
+                # Left to GDAL
+                try:
+                    reprojected[key] = geom.transform(srid, clone=True)
+                except Exception as exc:
+                    errors.append((key, exc))
+                continue
+            start = len(positions)
+            _collect(shape, positions)
+            shapes[key] = (shape, start, len(positions))
+        if not positions:
+            continue
+
+        xs, ys = transformer.transform(
+            [position[0] for position in positions],
+            [position[1] for position in positions],
+        )
+        for key, (shape, start, end) in shapes.items():
+            if not all(
+                math.isfinite(x) and math.isfinite(y)
+                for x, y in zip(xs[start:end], ys[start:end])
+            ):
+                msg = f"Coordinates can't be transformed from SRID {source_srid}"
+                errors.append((key, ValueError(msg)))
+                continue
+            transformed = (
+                (x, y, *position[2:])
+                for x, y, position in zip(
+                    xs[start:end], ys[start:end], positions[start:end]
+                )
+            )
+            try:
+                reprojected[key] = geometry_from_geojson(
+                    _rebuild(shape, transformed), srid=srid
+                )
+            except Exception as exc:
+                errors.append((key, exc))
+    return reprojected, errors
+
+
+def reproject_geometry(geom, srid=4326):
+    """Transform a single GEOS geometry to ``srid``, raising if it can't be"""
+    if geom.srid == srid:
+        return geom
+    reprojected, errors = reproject({None: geom}, srid)
+    if errors:
+        raise errors[0][1]
+    return reprojected[None]
@@ -11,6 +11,7 @@ from psycopg2 import sql
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
+from .elasticsearch.index import DEFAULT_INDEX_SETTINGS, GEOMETRY_MODES
 from .models import (
     CommandSource,
     CSVSource,
@@ -98,7 +99,7 @@ class PolymorphicModelSerializer(serializers.ModelSerializer):
 class FieldSerializer(serializers.ModelSerializer):
     class Meta:
         model = Field
-        exclude = ("source",)
+        exclude = ("source", "profile")
         read_only_fields = ("name", "sample", "source")
 
 
@@ -108,6 +109,13 @@ class SourceReportingSerializer(serializers.ModelSerializer):
         model = SourceReporting
 
 
+class IndexSettingsSerializer(serializers.Serializer):
+    dynamic = serializers.BooleanField(required=False)
+    geometry = serializers.ChoiceField(choices=GEOMETRY_MODES, required=False)
+    simplify = serializers.FloatField(min_value=0, required=False, allow_null=True)
+    precision = serializers.IntegerField(min_value=0, max_value=15, required=False)
+
+
 class SourceSerializer(PolymorphicModelSerializer):
     fields = FieldSerializer(many=True, required=False)
     slug = serializers.SlugField(max_length=255, read_only=True)
@@ -119,6 +127,11 @@ class SourceSerializer(PolymorphicModelSerializer):
         model = Source
         extras = {"read_only": {"status": True}}
 
+    def validate_index_settings(self, value):
+        serializer = IndexSettingsSerializer(data=value)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
     def _update_fields(self, source):
         if source.run_sync_method("update_fields", success_state="NEED_SYNC").result:
             return source
@@ -132,9 +145,15 @@ class SourceSerializer(PolymorphicModelSerializer):
         source = super().create(validated_data)
         return self._update_fields(source)
 
+    def _get_index_config(self, source):
+        index_settings = {**DEFAULT_INDEX_SETTINGS, **source.index_settings}
+        excluded = source.fields.filter(searchable=False).values_list("name")
+        return index_settings, set(excluded)
+
     @transaction.atomic
     def update(self, instance, validated_data):
         validated_data.pop("fields")
+        index_config = self._get_index_config(instance)
 
         source = super().update(
             instance, {**validated_data, "status": Source.Status.NEED_SYNC}
@@ -154,6 +173,10 @@ class SourceSerializer(PolymorphicModelSerializer):
             except Field.DoesNotExist:
                 pass
 
+        if self._get_index_config(source) != index_config:
+            # Index every feature again on next refresh
+            source.feature_digests.all().delete()
+
         return source
 
 
@@ -240,16 +263,30 @@ class PostGISSourceSerializer(SourceSerializer):
             msg = "Connection informations or query are not valid"
             raise ValidationError(msg)
 
+    def _validate_watermark(self, data):
+        """Read the whole query again on next refresh if rows may differ"""
+        if self.instance and any(
+            data.get(name, getattr(self.instance, name)) != getattr(self.instance, name)
+            for name in ("query", "watermark_field", "tombstone_predicate")
+        ):
+            data["last_watermark"] = ""
+        return data
+
     def validate(self, data):
         self._validate_query_connection(data)
         data = self._validate_geom(data)
+        data = self._validate_watermark(data)
 
         return super().validate(data)
 
     class Meta:
         model = PostGISSource
         fields = "__all__"
-        extra_kwargs = {"db_password": {"write_only": True}}
+        extra_kwargs = {
+            "db_password": {"write_only": True},
+            "last_watermark": {"read_only": True},
+            "last_reconcile": {"read_only": True},
+        }
 
 
 class FileSourceSerializer(SourceSerializer):
@@ -9,11 +9,17 @@ from django.template.loader import get_template
 from django.utils import timezone
 from django.utils.translation import gettext as _
 
+from project.geosource.locks import delete_if_equal
 from project.visu.utils import get_emails_recipients, get_logo_url
 
 logger = logging.getLogger(__name__)
 
 
+def get_pending_task_key(app, model, pk, method):
+    """Cache key of the task scheduled to call a method, until it starts"""
+    return f"geosource-pending-task-{app}-{model}-{pk}-{method}"
+
+
 def set_failure_state(task, method, message, instance=None):
     # Failure messaging needs to be formed as expected by celery API
     logger.warning(message)
@@ -39,15 +45,62 @@ def set_failure_state(task, method, message, instance=None):
         instance.report.save(update_fields=["status", "started", "ended", "message"])
 
 
+def send_refresh_email(obj):
+    """Mail the report of a source refresh to the instance recipients"""
+    if config.INSTANCE_EMAIL_SOURCE_TYPE == "periodic":
+        return
+    email_recipients = get_emails_recipients()
+    if email_recipients:
+        obj.refresh_from_db()
+        mail_level = config.INSTANCE_EMAIL_SOURCE_REFRESH_LEVEL
+        if (
+            mail_level == "success"
+            or (mail_level == "warning" and obj.report.status in (1, 2))
+            or (mail_level == "error" and obj.report.status == 1)
+        ):
+            logger.info("send mail")
+            logo_url = f"{config.INSTANCE_EMAIL_MEDIA_BASE_URL}{get_logo_url()}"
+            context = {
+                "title": config.INSTANCE_TITLE,
+                "obj": obj,
+                "logo_url": logo_url,
+            }
+            txt_template = get_template("emails/source_refresh/email.txt")
+            txt_message = txt_template.render(context=context)
+            html_template = get_template("emails/source_refresh/email.html")
+            html_message = html_template.render(context)
+            send_mail(
+                _(
+                    "%(title)s : Data source %(obj)s refresh ended with state %(success_state)s"
+                )
+                % {
+                    "title": config.INSTANCE_TITLE,
+                    "obj": obj,
+                    "success_state": obj.report.get_status_display(),
+                },
+                txt_message,
+                None,
+                recipient_list=email_recipients,
+                html_message=html_message,
+                fail_silently=True,
+            )
+
+
 @shared_task(bind=True)
 def run_model_object_method(self, app, model, pk, method, success_state=states.SUCCESS):
     self.update_state(state=states.STARTED)
 
+    # Duplicates can be scheduled again once the task started
+    pending_key = get_pending_task_key(app, model, pk, method)
+    delete_if_equal(pending_key, self.request.id)
+
     Model = apps.get_app_config(app).get_model(model)
+    deferred = False
     try:
         obj = Model.objects.get(pk=pk)
         logger.info("Call method %s on %s", method, obj)
         state = {"action": method, **getattr(obj, method)()}
+        deferred = "shards" in state or "locked" in state
         logger.info("Method %s on %s ended", method, obj)
 
         self.update_state(state=success_state, meta=state)
@@ -71,46 +124,51 @@ def run_model_object_method(self, app, model, pk, method, success_state=states.S
         set_failure_state(self, method, message, obj)
         logger.exception(e)
 
-    if config.INSTANCE_EMAIL_SOURCE_TYPE != "periodic":
-        email_recipients = get_emails_recipients()
-        if email_recipients:
-            obj.refresh_from_db()
-            mail_level = config.INSTANCE_EMAIL_SOURCE_REFRESH_LEVEL
-            if (
-                mail_level == "success"
-                or (mail_level == "warning" and obj.report.status in (1, 2))
-                or (mail_level == "error" and obj.report.status == 1)
-            ):
-                logger.info("send mail")
-                logo_url = f"{config.INSTANCE_EMAIL_MEDIA_BASE_URL}{get_logo_url()}"
-                context = {
-                    "title": config.INSTANCE_TITLE,
-                    "obj": obj,
-                    "logo_url": logo_url,
-                }
-                txt_template = get_template("emails/source_refresh/email.txt")
-                txt_message = txt_template.render(context=context)
-                html_template = get_template("emails/source_refresh/email.html")
-                html_message = html_template.render(context)
-                send_mail(
-                    _(
-                        "%(title)s : Data source %(obj)s refresh ended with state %(success_state)s"
-                    )
-                    % {
-                        "title": config.INSTANCE_TITLE,
-                        "obj": obj,
-                        "success_state": obj.report.get_status_display(),
-                    },
-                    txt_message,
-                    None,
-                    recipient_list=email_recipients,
-                    html_message=html_message,
-                    fail_silently=True,
-                )
+    # Refreshes split in shards are mailed once finished, skipped ones by the
+    # refresh in progress
+    if not deferred:
+        send_refresh_email(obj)
 
     raise Ignore()
 
 
+@shared_task
+def run_drop_layer(source_id, layer_id):
+    """Drop a layer replaced by a rebuild, out of the refresh transaction"""
+    Source = apps.get_app_config("geosource").get_model("Source")
+    Source.objects.get(pk=source_id).drop_layer(layer_id)
+
+
+@shared_task
+def run_refresh_shard(source_id, shard, context):
+    """Write a shard of a source refresh, failures are reported by the last task"""
+    Source = apps.get_app_config("geosource").get_model("Source")
+    try:
+        return Source.objects.get(pk=source_id).refresh_shard(shard, context)
+    except Exception as e:
+        logger.exception(e)
+        return {"error": getattr(e, "message", f"{e}")}
+
+
+@shared_task
+def run_finish_refresh(results, source_id, context):
+    """Finish a source refresh once all its shards are written"""
+    Source = apps.get_app_config("geosource").get_model("Source")
+    source = Source.objects.get(pk=source_id)
+    response = source.finish_sharded_refresh(results, context)
+    send_refresh_email(source)
+    return response
+
+
+@shared_task
+def run_expire_refresh(source_id, context):
+    """Fail a sharded refresh whose last task didn't run in time"""
+    Source = apps.get_app_config("geosource").get_model("Source")
+    source = Source.objects.get(pk=source_id)
+    if source.expire_sharded_refresh(context):
+        send_refresh_email(source)
+
+
 @shared_task(bind=True)
 def run_auto_refresh_source(*args, **kwargs):
     from project.geosource.periodics import auto_refresh_source
@@ -1,8 +1,12 @@
+import json
 import logging
 from unittest.mock import MagicMock, patch
 
 from django.contrib.auth import get_user_model
 from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from geostore import GeometryTypes
 from rest_framework import status
@@ -18,6 +22,12 @@ from project.geosource.models import (
     Source,
     SourceReporting,
 )
+from project.geosource.progress import (
+    RefreshProgress,
+    get_progress_key,
+    iter_progress_events,
+)
+from project.geosource.signals import refresh_data_done
 from project.geosource.tests.factories import WMTSSourceFactory
 from project.geosource.tests.helpers import get_file
 
@@ -424,36 +434,110 @@ class SourceViewsetTestCase(APITestCase):
             name="foo",
             geom_type=GeometryTypes.Point,
         )
+        layer = source.get_layer()
+        for country in ("list", "fake", "list", None):
+            layer.features.create(
+                geom=GEOSGeometry("POINT (0 0)"),
+                properties={"country": country} if country else {},
+            )
 
-        class FakeLayer:
-            def get_property_values(self, property):
-                return ["fake", "list"]
+        url = reverse("geosource:geosource-property-values", args=[source.pk])
+        response = self.client.get(url, {"property": "country"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), ["fake", "list", None])
 
-        with patch(
-            "project.geosource.geostore_callbacks.layer_callback",
-            MagicMock(return_value=FakeLayer()),
-        ):
-            response = self.client.get(
-                reverse(
-                    "geosource:geosource-property-values",
-                    args=[
-                        source.pk,
-                    ],
-                ),
-                {"property": "country"},
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_property_values_are_paginated(self):
+        source = GeoJSONSource.objects.create(
+            name="foo",
+            geom_type=GeometryTypes.Point,
+        )
+        layer = source.get_layer()
+        for i in range(15):
+            layer.features.create(
+                geom=GEOSGeometry("POINT (0 0)"),
+                properties={"name": f"name {i:02}", "kind": "a" if i % 2 else "B"},
             )
-            self.assertEqual(response.status_code, status.HTTP_200_OK)
-            self.assertEqual(response.json(), ["fake", "list"])
 
-            response = self.client.get(
-                reverse(
-                    "geosource:geosource-property-values",
-                    args=[
-                        source.pk,
-                    ],
-                ),
+        url = reverse("geosource:geosource-property-values", args=[source.pk])
+        response = self.client.get(url, {"property": "name", "page": 2})
+        data = response.json()
+        self.assertEqual(data["count"], 15)
+        self.assertEqual(
+            data["results"][0], {"value": "name 10", "count": 1}, data["results"]
+        )
+
+        response = self.client.get(
+            url, {"property": "kind", "page_size": 1, "search": "b"}
+        )
+        self.assertEqual(response.json()["results"], [{"value": "B", "count": 8}])
+
+    def test_property_values_page_is_queried(self):
+        source = GeoJSONSource.objects.create(
+            name="foo",
+            geom_type=GeometryTypes.Point,
+        )
+        layer = source.get_layer()
+        for i in range(15):
+            layer.features.create(
+                geom=GEOSGeometry("POINT (0 0)"), properties={"name": f"name {i:02}"}
             )
-            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        values = source.get_property_values("name", "NAME 1")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(values[2:4], [["name 12", 1], ["name 13", 1]])
+        self.assertIn("LIMIT 2 OFFSET 2", queries[-1]["sql"])
+        self.assertIn("LIKE", queries[-1]["sql"])
+        self.assertEqual(values.count(), 5)
+
+    @patch("project.geosource.app_settings.PROPERTY_VALUES_LIMIT", 1)
+    def test_property_values_are_cached_until_refresh(self):
+        source = GeoJSONSource.objects.create(
+            name="foo",
+            geom_type=GeometryTypes.Point,
+        )
+        layer = source.get_layer()
+        layer.features.create(geom=GEOSGeometry("POINT (0 0)"), properties={"a": 2})
+        url = reverse("geosource:geosource-property-values", args=[source.pk])
+        self.assertEqual(self.client.get(url, {"property": "a"}).json(), [2])
+
+        layer.features.create(geom=GEOSGeometry("POINT (0 0)"), properties={"a": 1})
+        self.assertEqual(self.client.get(url, {"property": "a"}).json(), [2])
+
+        refresh_data_done.send_robust(sender=GeoJSONSource, layer=layer.pk)
+        # Values beyond the limit are only listed by pages
+        self.assertEqual(self.client.get(url, {"property": "a"}).json(), [1])
+
+    @patch("project.geosource.app_settings.FIELD_PROFILES", True)
+    def test_property_values_from_field_profile(self):
+        source = GeoJSONSource.objects.create(
+            name="foo",
+            geom_type=GeometryTypes.Point,
+        )
+        source.fields.create(
+            name="country",
+            profile={
+                "count": 4,
+                "nulls": 1,
+                "values": [["France", 2], ["Belgium", 1]],
+                "complete": True,
+            },
+        )
+        response = self.client.get(
+            reverse("geosource:geosource-property-values", args=[source.pk]),
+            {"property": "country", "page": 1},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {"value": "Belgium", "count": 1},
+                {"value": "France", "count": 2},
+                {"value": None, "count": 1},
+            ],
+        )
 
     def test_q_params_filter_source_on_name(self):
         GeoJSONSource.objects.create(
@@ -473,3 +557,92 @@ class SourceViewsetTestCase(APITestCase):
         data = response.json()
         self.assertEqual(len(data["results"]), 1)
         self.assertEqual(data["results"][0]["id"], source_2.id)
+
+    def test_refresh_errors_are_downloaded(self):
+        source = GeoJSONSource.objects.create(
+            name="errors",
+            geom_type=GeometryTypes.Point,
+            report=SourceReporting.objects.create(),
+        )
+        source.report.add_error(
+            "Line 0 - Can't find identifier 'id'", "MissingIdentifier"
+        )
+        source.report.add_error("id - 1: invalid geometry", "ValueError")
+        source.report.save()
+
+        response = self.client.get(
+            reverse("geosource:geosource-errors", args=[source.pk])
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(
+            b"".join(response.streaming_content).decode().splitlines(),
+            [
+                "kind,message",
+                "MissingIdentifier,Line 0 - Can't find identifier 'id'",
+                "ValueError,id - 1: invalid geometry",
+            ],
+        )
+
+    def test_refresh_progress_is_read_from_cache(self):
+        url = reverse("geosource:geosource-progress", args=[self.source_geojson.pk])
+        cache.delete(get_progress_key(self.source_geojson.pk))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        progress = RefreshProgress(
+            self.source_geojson.pk, SourceReporting(), expected=10
+        )
+        list(progress.iterate(range(4)))
+        progress.advance(3)
+        progress.publish(force=True)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(
+            (data["read"], data["written"], data["expected"], data["finished"]),
+            (4, 3, 10, False),
+        )
+        self.assertIsNotNone(data["eta"])
+
+    def test_refresh_progress_stream(self):
+        url = reverse(
+            "geosource:geosource-progress-stream", args=[self.source_geojson.pk]
+        )
+        response = self.client.get(url, HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        RefreshProgress(self.source_geojson.pk, SourceReporting()).finish()
+        with patch("project.geosource.app_settings.PROGRESS_STREAM", True):
+            response = self.client.get(url, HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = b"".join(response.streaming_content).decode().split("\n\n")
+        self.assertEqual(len(events), 2)
+        self.assertTrue(json.loads(events[0][len("data: ") :])["finished"])
+
+    def test_refresh_progress_of_unknown_source_is_not_found(self):
+        pk = Source.objects.order_by("pk").last().pk + 1
+        RefreshProgress(pk, SourceReporting()).finish()
+        response = self.client.get(reverse("geosource:geosource-progress", args=[pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        with patch("project.geosource.app_settings.PROGRESS_STREAM", True):
+            response = self.client.get(
+                reverse("geosource:geosource-progress-stream", args=[pk]),
+                HTTP_ACCEPT="text/event-stream",
+            )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch("project.geosource.app_settings.PROGRESS_INTERVAL", 1)
+    @patch("project.geosource.progress.time.sleep")
+    def test_refresh_progress_stream_is_bounded(self, mock_sleep):
+        RefreshProgress(self.source_geojson.pk, SourceReporting()).publish(force=True)
+        clock = iter(range(0, 100, 10))
+        with patch(
+            "project.geosource.progress.time.monotonic",
+            side_effect=lambda: next(clock),
+        ):
+            events = list(iter_progress_events(self.source_geojson.pk, duration=25))
+        # Until the next event would come after the duration
+        self.assertEqual(len(events), 3)
+        self.assertEqual(mock_sleep.call_count, 2)
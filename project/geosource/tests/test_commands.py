@@ -1,12 +1,16 @@
+from datetime import UTC, datetime
 from io import StringIO
 from unittest import mock
 
+from django.contrib.gis.geos import GEOSGeometry, Point
 from django.core.management import call_command
+from django.db import IntegrityError
 from django.test import TestCase
-from geostore.models import Layer
+from geostore.models import Feature, Layer
 from rest_framework.exceptions import MethodNotAllowed
 
-from project.geosource.models import GeoJSONSource, GeometryTypes
+from project.geosource.management.commands.helpers import FeatureWriter
+from project.geosource.models import CommandSource, GeoJSONSource, GeometryTypes
 from project.geosource.tests.helpers import get_file
 
 
@@ -103,22 +107,154 @@ class ResyncAllSourcesTestCase(TestCase):
         mocked.assert_called_once()
 
 
+@mock.patch("project.geosource.elasticsearch.index.LayerESIndex.publish")
+@mock.patch(
+    "project.geosource.elasticsearch.index.LayerESIndex.index_features",
+    return_value=[],
+)
+@mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
 class IndexToESTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
         cls.layer_1 = Layer.objects.create(name="layer_1")
         Layer.objects.create(name="layer_2")
+        cls.layer_1.features.create(
+            identifier="1", geom="POINT(2 42)", properties={"name": "feature"}
+        )
 
-    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
-    def test_index_single_layer(self, mock_index):
+    def test_index_single_layer(self, mock_index, mock_index_features, mock_publish):
         mock_index.return_value = True
         out = StringIO()
         call_command("index_to_es", layer=self.layer_1.pk, stdout=out)
         self.assertIn("Indexing layer layer_1", out.getvalue())
+        self.assertIn("Indexed layer layer_1: 1/1 features", out.getvalue())
+        indexed = mock_index_features.call_args.args[0]
+        self.assertEqual(list(indexed.values_list("identifier", flat=True)), ["1"])
+        mock_publish.assert_called_once()
 
-    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
-    def test_index_all_layers(self, mock_index):
+    def test_index_all_layers(self, mock_index, mock_index_features, mock_publish):
         mock_index.return_value = True
         out = StringIO()
-        call_command("index_to_es", stdout=out)
+        call_command("index_to_es", "--workers", "2", stdout=out)
         self.assertIn("Indexing all layers", out.getvalue())
+        self.assertIn("Indexed layer layer_1", out.getvalue())
+        self.assertIn("Indexed layer layer_2", out.getvalue())
+        self.assertEqual(mock_publish.call_count, 2)
+
+    def test_rebuild_layers_are_not_indexed(
+        self, mock_index, mock_index_features, mock_publish
+    ):
+        Layer.objects.create(name="layer_1.shadow")
+        Layer.objects.create(name=f"layer_2.retired.{self.layer_1.pk}")
+        out = StringIO()
+        call_command("index_to_es", stdout=out)
+        self.assertNotIn(".shadow", out.getvalue())
+        self.assertNotIn(".retired", out.getvalue())
+        self.assertEqual(mock_publish.call_count, 2)
+
+    def test_index_layers_refreshed_since(
+        self, mock_index, mock_index_features, mock_publish
+    ):
+        GeoJSONSource.objects.create(
+            name="layer_2",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+        )
+        GeoJSONSource.objects.filter(name="layer_2").update(
+            last_refresh=datetime(2025, 2, 1, tzinfo=UTC)
+        )
+        out = StringIO()
+        call_command("index_to_es", "--since", "2025-01-01", stdout=out)
+        self.assertIn("Indexed layer layer_2", out.getvalue())
+        self.assertNotIn("layer_1", out.getvalue())
+
+        out = StringIO()
+        call_command("index_to_es", "--since", "2025-03-01T12:00:00", stdout=out)
+        self.assertNotIn("Indexed layer", out.getvalue())
+
+
+class BenchmarkGeoJSONTestCase(TestCase):
+    def test_benchmark_generated_file(self):
+        out = StringIO()
+        call_command("benchmark_geojson", features=10, stdout=out)
+        self.assertIn("loaded: 10 features", out.getvalue())
+        self.assertIn("streamed: 10 features", out.getvalue())
+
+
+class BenchmarkParseTestCase(TestCase):
+    def test_benchmark_generated_file(self):
+        for file_format in ("csv", "geojson"):
+            with self.subTest(file_format=file_format):
+                out = StringIO()
+                call_command(
+                    "benchmark_parse",
+                    format=file_format,
+                    features=10,
+                    workers=2,
+                    stdout=out,
+                )
+                self.assertIn("1 process(es): 10 records", out.getvalue())
+                self.assertIn("2 process(es): 10 records", out.getvalue())
+
+
+class FeatureWriterTestCase(TestCase):
+    def setUp(self):
+        self.source = CommandSource.objects.create(
+            name="command", geom_type=GeometryTypes.Point, command="command_test"
+        )
+        self.layer = self.source.get_layer()
+        self.layer.features.create(
+            identifier="1", geom=Point(0, 0, srid=4326), properties={"a": 0}
+        )
+
+    def test_features_are_upserted_by_batches(self):
+        writer = FeatureWriter(self.source, self.layer, batch_size=2)
+        for identifier, a in (("1", 1), ("2", 2), ("2", 3), ("3", 4)):
+            writer.write(
+                Feature(
+                    identifier=identifier,
+                    geom=Point(1, 1, srid=4326),
+                    properties={"a": a},
+                )
+            )
+        self.assertEqual(self.layer.features.count(), 2)
+        writer.flush()
+
+        self.assertEqual((writer.added, writer.modified, writer.errors), (2, 2, []))
+        self.assertEqual(
+            dict(self.layer.features.values_list("identifier", "properties__a")),
+            {"1": 1, "2": 3, "3": 4},
+        )
+
+    def test_refused_features_are_reported(self):
+        writer = FeatureWriter(self.source, self.layer)
+        writer.write(
+            Feature(identifier="1", geom=Point(1, 1, srid=4326), properties={"a": 1})
+        )
+        # Self-intersecting, parsed but refused by the geom_is_valid constraint
+        writer.write(
+            Feature(
+                identifier="2",
+                geom=GEOSGeometry("POLYGON ((0 0, 1 1, 1 0, 0 1, 0 0))", srid=4326),
+                properties={"a": 2},
+            )
+        )
+        writer.flush()
+
+        self.assertEqual((writer.added, writer.modified), (0, 1))
+        self.assertEqual([identifier for identifier, _ in writer.errors], ["2"])
+        self.assertIsInstance(writer.errors[0][1], IntegrityError)
+        self.assertEqual(
+            dict(self.layer.features.values_list("identifier", "properties__a")),
+            {"1": 1},
+        )
+
+    def test_command_fields_are_created_once(self):
+        self.source.fields.create(name="id", label="Identifier")
+        with mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+            call_command("command_test", source=self.source.pk)
+        self.assertIn("1 features added", stdout.getvalue())
+        self.assertEqual(
+            list(self.source.fields.values_list("name", "label")),
+            [("id", "Identifier"), ("test", "Test")],
+        )
@@ -0,0 +1,88 @@
+import csv
+import tempfile
+
+import pyexcel
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from project.geosource.csv_reader import convert_cell, iter_rows, iter_spread_rows
+
+DATA_DIR = settings.BASE_DIR / "geosource" / "tests" / "data"
+
+
+class CSVReaderTestCase(SimpleTestCase):
+    def test_rows_are_read_as_pyexcel_does(self):
+        for file_name in ("source.csv", "source_xy.csv", "source_noheader.csv"):
+            with self.subTest(file_name=file_name):
+                path = DATA_DIR / file_name
+                expected = list(
+                    pyexcel.iget_array(
+                        file_name=str(path), delimiter=";", quotechar='"'
+                    )
+                )
+                pyexcel.free_resources()
+                rows = [
+                    [cell and convert_cell(cell) for cell in row]
+                    for row in iter_rows(path, "UTF-8", ";", '"')
+                ]
+                self.assertEqual(rows, expected)
+
+    def test_quoted_line_endings_are_kept(self):
+        with tempfile.NamedTemporaryFile("wb", suffix=".csv") as file:
+            file.write(b'1;"multi\r\nline"\r\n2;"carriage\rreturn"\r\n')
+            file.flush()
+            self.assertEqual(
+                list(iter_rows(file.name, "UTF-8", ";", '"')),
+                [["1", "multi\r\nline"], ["2", "carriage\rreturn"]],
+            )
+
+    def test_spread_rows_are_read_from_evenly_spaced_chunks(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as file:
+            file.write("".join(f"{i};row {i};\n" for i in range(100)))
+            file.write('100;"multi\nline";\n')
+            file.flush()
+            rows = list(iter_spread_rows(file.name, "UTF-8", ";", '"', 4, 3))
+            self.assertEqual(len(rows), 12)
+            self.assertEqual(rows[:3], [["0", "row 0"], ["1", "row 1"], ["2", "row 2"]])
+            identifiers = [int(row[0]) for row in rows]
+            self.assertEqual(identifiers, sorted(identifiers))
+            self.assertGreater(identifiers[-1], 70)
+            # Small chunks of the whole file don't overlap
+            rows = list(iter_spread_rows(file.name, "UTF-8", ";", '"', 4, 50))
+            self.assertEqual(len(rows), 101)
+            self.assertEqual(rows[-1], ["100", "multi\nline"])
+
+    def test_convert_cell(self):
+        for text, expected in (
+            ("42", 42),
+            ("1,000", 1000),
+            ("007", "007"),
+            ("1_000", "1_000"),
+            ("0.5", 0.5),
+            ("inf", "inf"),
+            ("nan", "nan"),
+            ("2,5", 25),
+            ("text", "text"),
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(convert_cell(text), expected)
+
+    def test_cells_are_converted_as_pyexcel_does(self):
+        cells = [
+            *("42", "-7", "1,000", "2,5", "007", "0", "1_000", "1_0005"),
+            *("0.5", "-1.5e3", ".5", "1_000.5", "1_000x5", "1.5_0", "00.5"),
+            *("inf", "-inf", "nan", "NaN", "true", "False", "TRUE", "yes"),
+            *("2024-01-31", "2024-02-30", "2024-01-31 12:30:00"),
+            *("2024-01-31 12:30:00.123456", "31/01/2024", "text"),
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="") as file:
+            csv.writer(file, delimiter=";").writerows([cell] for cell in cells)
+            file.flush()
+            expected = [
+                row[0]
+                for row in pyexcel.iget_array(
+                    file_name=file.name, delimiter=";", quotechar='"'
+                )
+            ]
+            pyexcel.free_resources()
+        self.assertEqual([convert_cell(cell) for cell in cells], expected)
@@ -0,0 +1,228 @@
+from unittest import mock
+
+from django.contrib.gis.geos import LineString, Point
+from django.test import TestCase
+from geostore.models import Layer
+
+from project.geosource.elasticsearch.index import LOADING_SETTINGS, LayerESIndex
+from project.geosource.models import FieldTypes, GeoJSONSource, GeometryTypes
+from project.geosource.tests.helpers import get_file
+
+
+@mock.patch("project.geosource.elasticsearch.index.streaming_bulk")
+class LayerESIndexTestCase(TestCase):
+    def setUp(self):
+        self.layer = Layer.objects.create(name="layer")
+        for i in range(3):
+            self.layer.features.create(
+                identifier=str(i), geom=Point(2, 42 + i, srid=4326), properties={"i": i}
+            )
+        self.client = mock.MagicMock()
+        self.client.indices.get_settings.return_value = {
+            "layer": {
+                "settings": {
+                    "index": {"refresh_interval": "1s", "number_of_replicas": "1"}
+                }
+            }
+        }
+        self.es_index = LayerESIndex(self.layer, client=self.client)
+        self.actions = []
+
+    def consume(self, failed=()):
+        def streaming_bulk(client, actions, **kwargs):
+            for action in actions:
+                self.actions.append(action)
+                if action["_id"] in failed:
+                    yield (
+                        False,
+                        {"index": {"_id": action["_id"], "error": {"reason": "bad"}}},
+                    )
+
+        return streaming_bulk
+
+    def test_features_are_indexed_by_bulk_requests(self, mock_streaming_bulk):
+        mock_streaming_bulk.side_effect = self.consume(failed=["1"])
+        errors = self.es_index.index_features(self.layer.features.all())
+        self.assertEqual(errors, [("1", "bad")])
+        # Rejected documents don't fail the index
+        self.assertFalse(self.es_index.failed)
+        action = next(action for action in self.actions if action["_id"] == "0")
+        self.assertEqual(action["_index"], "layer")
+        self.assertEqual(
+            action["_source"],
+            {
+                "_feature_id": "0",
+                "geom": {"type": "Point", "coordinates": [2, 42]},
+                "i": 0,
+            },
+        )
+
+    def test_failed_bulk_request_fails_the_index(self, mock_streaming_bulk):
+        mock_streaming_bulk.side_effect = ConnectionError("Unreachable")
+        with self.assertLogs("project.geosource.elasticsearch.index", "ERROR"):
+            errors = self.es_index.index_features(self.layer.features.all())
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(self.es_index.failed)
+
+    def test_index_settings_are_restored_after_loading(self, mock_streaming_bulk):
+        mock_streaming_bulk.side_effect = self.consume()
+        self.es_index.index_name = "layer.20250101000000000000"
+        self.es_index.index_features(self.layer.features.all())
+        self.es_index.index_features(self.layer.features.all())
+        self.client.indices.put_settings.assert_called_once_with(
+            index="layer.20250101000000000000", settings=LOADING_SETTINGS
+        )
+
+        self.es_index.end_loading()
+        self.client.indices.put_settings.assert_called_with(
+            index="layer.20250101000000000000",
+            settings={"refresh_interval": "1s", "number_of_replicas": "1"},
+        )
+        self.client.indices.refresh.assert_called_once_with(
+            index="layer.20250101000000000000"
+        )
+
+    def test_live_index_settings_are_left_unchanged(self, mock_streaming_bulk):
+        mock_streaming_bulk.side_effect = self.consume()
+        self.es_index.index_features(self.layer.features.all())
+        self.es_index.end_loading()
+        self.client.indices.put_settings.assert_not_called()
+        self.assertEqual(self.actions[0]["_index"], "layer")
+
+    @mock.patch("project.geosource.app_settings.ES_BULK_CHUNK_SIZE", 2)
+    def test_buffered_features_are_flushed(self, mock_streaming_bulk):
+        mock_streaming_bulk.side_effect = self.consume(failed=["0"])
+        for feature in self.layer.features.order_by("identifier"):
+            self.es_index.index_feature(self.layer, feature)
+        self.assertEqual(len(self.actions), 2)
+
+        self.assertEqual(self.es_index.flush(), [("0", "bad")])
+        self.assertEqual(len(self.actions), 3)
+        self.assertEqual(self.es_index.flush(), [])
+
+
+class LayerESIndexVersionsTestCase(TestCase):
+    def setUp(self):
+        self.layer = Layer.objects.create(name="layer")
+        self.client = mock.MagicMock()
+        self.es_index = LayerESIndex(self.layer, client=self.client)
+
+    def test_new_version_is_published_under_layer_name(self):
+        self.client.indices.get_alias.return_value = {
+            "layer.20250101000000000000": {"aliases": {"layer": {}}},
+            "layer.20250102000000000000": {"aliases": {}},
+            "layer-other": {"aliases": {}},
+        }
+        self.es_index.index()
+        index_name = self.es_index.index_name
+        self.assertRegex(index_name, r"^layer\.\d{20}$")
+        self.assertEqual(self.es_index.target, index_name)
+        self.assertEqual(
+            self.client.indices.create.call_args.kwargs["index"], index_name
+        )
+
+        self.es_index.publish()
+        self.client.indices.update_aliases.assert_called_once_with(
+            actions=[
+                {"remove": {"index": "layer.20250101000000000000", "alias": "layer"}},
+                {"add": {"index": index_name, "alias": "layer"}},
+            ]
+        )
+        self.client.indices.delete.assert_called_once_with(
+            index="layer.20250101000000000000,layer.20250102000000000000",
+            ignore=[400, 404],
+        )
+        self.assertEqual(self.es_index.target, "layer")
+
+    def test_legacy_index_is_replaced(self):
+        self.client.indices.get_alias.return_value = {"layer": {"aliases": {}}}
+        self.es_index.index()
+        index_name = self.es_index.index_name
+        self.es_index.publish()
+        self.client.indices.update_aliases.assert_called_once_with(
+            actions=[
+                {"remove_index": {"index": "layer"}},
+                {"add": {"index": index_name, "alias": "layer"}},
+            ]
+        )
+        self.client.indices.delete.assert_not_called()
+
+    def test_failed_publication_keeps_previous_version(self):
+        self.client.indices.update_aliases.side_effect = Exception("Failure")
+        self.client.indices.get_alias.return_value = {}
+        self.es_index.index()
+        index_name = self.es_index.index_name
+        with self.assertLogs("project.geosource.elasticsearch.index", "ERROR"):
+            self.es_index.publish()
+        self.client.indices.delete.assert_called_once_with(
+            index=index_name, ignore=[400, 404]
+        )
+
+
+@mock.patch("project.geosource.elasticsearch.index.streaming_bulk")
+class LayerESIndexSettingsTestCase(TestCase):
+    def setUp(self):
+        self.source = GeoJSONSource.objects.create(
+            name="source",
+            file=get_file("test.geojson"),
+            geom_type=GeometryTypes.LineString,
+        )
+        self.source.fields.create(
+            name="name", label="Name", data_type=FieldTypes.String.value
+        )
+        self.source.fields.create(
+            name="comment",
+            label="Comment",
+            data_type=FieldTypes.String.value,
+            searchable=False,
+        )
+        self.layer = Layer.objects.create(name=self.source.slug)
+        self.layer.features.create(
+            identifier="1",
+            geom=LineString((0, 0), (0.5, 0.0001), (1, 0), srid=4326),
+            properties={"name": "line", "comment": "long text", "other": 1},
+        )
+        self.client = mock.MagicMock()
+        self.client.indices.exists.return_value = False
+
+    def test_mapping_follows_index_settings(self, mock_streaming_bulk):
+        self.source.index_settings = {"dynamic": False}
+        self.source.save()
+        LayerESIndex(self.layer, client=self.client).create_index()
+        mappings = self.client.indices.create.call_args.kwargs["body"]["mappings"]
+        self.assertIs(mappings["dynamic"], False)
+        self.assertEqual(
+            sorted(mappings["properties"]), ["_feature_id", "geom", "name"]
+        )
+
+    def test_documents_follow_index_settings(self, mock_streaming_bulk):
+        self.source.index_settings = {"simplify": 0.001, "precision": 3}
+        self.source.save()
+        actions = []
+        mock_streaming_bulk.side_effect = lambda client, items, **kwargs: (
+            actions.extend(items) or []
+        )
+        LayerESIndex(self.layer, client=self.client).index_features(
+            self.layer.features.all()
+        )
+        self.assertEqual(
+            actions[0]["_source"],
+            {
+                "_feature_id": "1",
+                "geom": {"type": "LineString", "coordinates": [[0, 0], [1, 0]]},
+                "name": "line",
+                "other": 1,
+            },
+        )
+
+    def test_centroid_is_indexed(self, mock_streaming_bulk):
+        self.source.index_settings = {"geometry": "centroid"}
+        self.source.save()
+        actions = []
+        mock_streaming_bulk.side_effect = lambda client, items, **kwargs: (
+            actions.extend(items) or []
+        )
+        LayerESIndex(self.layer, client=self.client).index_features(
+            self.layer.features.all()
+        )
+        self.assertEqual(actions[0]["_source"]["geom"]["type"], "Point")
@@ -0,0 +1,127 @@
+import json
+from io import BytesIO
+from itertools import islice
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import SimpleTestCase
+
+from project.geosource.exceptions import GeoJSONSourceException
+from project.geosource.geojson import geometry_from_geojson, iter_features
+
+FEATURE_COLLECTION = {
+    "type": "FeatureCollection",
+    "name": "test",
+    "features": [
+        {
+            "type": "Feature",
+            "properties": {"id": i, "name": f"feature {i}"},
+            "geometry": {"type": "Point", "coordinates": [i, i + 0.123456789]},
+        }
+        for i in range(20)
+    ],
+    "bbox": [0, 0, 19, 20],
+}
+
+
+class IterFeaturesTestCase(SimpleTestCase):
+    def test_features_are_read_whatever_the_chunk_size(self):
+        content = json.dumps(FEATURE_COLLECTION, indent=2).encode()
+        for chunk_size in (1, 7, 1024):
+            with self.subTest(chunk_size=chunk_size):
+                features = list(iter_features(BytesIO(content), chunk_size))
+                self.assertEqual(features, FEATURE_COLLECTION["features"])
+
+    def test_only_needed_features_are_read(self):
+        # The file is truncated after the first features, which is only
+        # detected when reading further
+        content = json.dumps(FEATURE_COLLECTION).encode()[:300]
+        features = list(islice(iter_features(BytesIO(content), 16), 1))
+        self.assertEqual(features, FEATURE_COLLECTION["features"][:1])
+        with self.assertRaises(GeoJSONSourceException):
+            list(iter_features(BytesIO(content), 16))
+
+    def test_invalid_files_raise(self):
+        for content in (b'{"Wrong_geojson":}', b"[]", b'{"type": "Feature"}', b""):
+            with self.subTest(content=content):
+                with self.assertRaises(GeoJSONSourceException):
+                    list(iter_features(BytesIO(content)))
+
+    def test_invalid_json_raises_before_the_end(self):
+        content = json.dumps(FEATURE_COLLECTION).encode()
+        # Between two features, early in the file
+        cut = content.index(b"}}, {", 400) + 2
+        invalid = BytesIO(content[:cut] + b"!" + content[cut:])
+        with self.assertRaises(GeoJSONSourceException):
+            list(iter_features(invalid, 16))
+        self.assertLess(invalid.tell(), len(content) // 2)
+
+    def test_tokens_cut_by_chunks_are_read(self):
+        content = b'{"version": -1.5e+10, "features": [{"a": [-Infinity, null]}]}'
+        for chunk_size in range(1, len(content)):
+            with self.subTest(chunk_size=chunk_size):
+                features = list(iter_features(BytesIO(content), chunk_size))
+                self.assertEqual(features, [{"a": [float("-inf"), None]}])
+
+    def test_raw_features_are_read_whatever_the_chunk_size(self):
+        collection = {
+            **FEATURE_COLLECTION,
+            "features": [
+                *FEATURE_COLLECTION["features"],
+                {"type": "Feature", "properties": {"name": 'br{ace"s} \\"}'}},
+            ],
+        }
+        content = json.dumps(collection, indent=2).encode()
+        for chunk_size in (1, 7, 1024):
+            with self.subTest(chunk_size=chunk_size):
+                features = iter_features(BytesIO(content), chunk_size, raw=True)
+                self.assertEqual(
+                    [json.loads(feature) for feature in features],
+                    collection["features"],
+                )
+
+    def test_invalid_raw_features_raise(self):
+        for content in (b'{"features": [1]}', b'{"features": [{"a": "}]}'):
+            with self.subTest(content=content):
+                with self.assertRaises(GeoJSONSourceException):
+                    list(iter_features(BytesIO(content), raw=True))
+
+
+class GeometryFromGeoJSONTestCase(SimpleTestCase):
+    def test_geometries_match_gdal_parsing(self):
+        geometries = [
+            {"type": "Point", "coordinates": [1, 2, 3]},
+            {"type": "LineString", "coordinates": [[0, 0], [1, 1]]},
+            {
+                "type": "Polygon",
+                "coordinates": [
+                    [[0, 0], [4, 0], [4, 4], [0, 0]],
+                    [[1, 1], [2, 1], [2, 2], [1, 1]],
+                ],
+            },
+            {"type": "MultiPoint", "coordinates": [[0, 0], [1, 1]]},
+            {"type": "MultiLineString", "coordinates": [[[0, 0], [1, 1]]]},
+            {
+                "type": "MultiPolygon",
+                "coordinates": [[[[0, 0], [1, 0], [1, 1], [0, 0]]]],
+            },
+            {
+                "type": "GeometryCollection",
+                "geometries": [{"type": "Point", "coordinates": [1, 2]}],
+            },
+        ]
+        for geometry in geometries:
+            with self.subTest(geometry=geometry["type"]):
+                self.assertEqual(
+                    geometry_from_geojson(geometry).ewkt,
+                    GEOSGeometry(json.dumps(geometry)).ewkt,
+                )
+
+    def test_invalid_geometries_raise(self):
+        for geometry in (
+            None,
+            {"type": "Unknown", "coordinates": [0, 0]},
+            {"type": "Point", "coordinates": []},
+        ):
+            with self.subTest(geometry=geometry):
+                with self.assertRaises(ValueError):
+                    geometry_from_geojson(geometry)
@@ -2,8 +2,10 @@ from unittest import mock
 
 from django.contrib.auth.models import Group
 from django.contrib.gis.geos import GEOSGeometry
+from django.db import IntegrityError, transaction
 from django.test import TestCase
-from geostore.models import Feature, Layer
+from django.utils import timezone
+from geostore.models import Feature, Layer, LayerGroup
 
 from project.geosource import geostore_callbacks
 from project.geosource.models import GeoJSONSource, GeometryTypes
@@ -104,3 +106,97 @@ class GeostoreCallBacksTestCase(TestCase):
         )
         self.assertIsNone(feature)
         self.assertIsNone(created)
+
+    def test_bulk_feature_callback(self):
+        source = GeoJSONSource.objects.create(
+            name="test",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+        )
+        layer = Layer.objects.create(name="test")
+        Feature.objects.create(
+            layer=layer, identifier="1", geom=GEOSGeometry("POINT (0 0)", srid=4326)
+        )
+
+        added, modified, errors = geostore_callbacks.bulk_feature_callback(
+            source,
+            layer,
+            {
+                "1": (GEOSGeometry("POINT (1 1)", srid=4326), {"name": "updated"}),
+                "2": (GEOSGeometry("POINT (0 0)", srid=3857), {"name": "new"}),
+                "3": ("Not a Point", {"name": "invalid"}),
+            },
+        )
+
+        self.assertEqual((added, modified), (1, 1))
+        self.assertEqual([identifier for identifier, _ in errors], ["3"])
+        self.assertEqual(layer.features.count(), 2)
+        self.assertEqual(
+            layer.features.get(identifier="1").properties, {"name": "updated"}
+        )
+        self.assertEqual(layer.features.get(identifier="2").geom.srid, 4326)
+
+    def test_bulk_feature_callback_leaves_validity_to_database(self):
+        layer = Layer.objects.create(name="test")
+        bowtie = GEOSGeometry("POLYGON ((0 0, 1 1, 1 0, 0 1, 0 0))", srid=4326)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            geostore_callbacks.bulk_feature_callback(
+                None, layer, {"1": (bowtie, {"name": "bowtie"})}
+            )
+        self.assertFalse(layer.features.exists())
+
+        added, modified, errors = geostore_callbacks.bulk_feature_callback(
+            None, layer, {"1": (GEOSGeometry("POINT EMPTY", srid=4326), {})}
+        )
+        self.assertEqual((added, modified), (0, 0))
+        self.assertEqual([identifier for identifier, _ in errors], ["1"])
+
+    def test_touch_features(self):
+        layer = Layer.objects.create(name="test")
+        feature = Feature.objects.create(
+            layer=layer, identifier="1", geom=GEOSGeometry("POINT (0 0)", srid=4326)
+        )
+        Feature.objects.filter(pk=feature.pk).update(updated_at=timezone.now())
+        begin_date = timezone.now()
+
+        touched = geostore_callbacks.touch_features(None, layer, ["1", "2"])
+
+        self.assertEqual(touched, 1)
+        feature.refresh_from_db()
+        self.assertGreater(feature.updated_at, begin_date)
+
+    def test_rebuilt_layer_is_published(self):
+        source = GeoJSONSource.objects.create(
+            name="test",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+        )
+        group = Group.objects.create(name="Group")
+        layer = Layer.objects.create(name="test", settings={"tiles": {"minzoom": 4}})
+        layer.authorized_groups.add(group)
+        layer_group = LayerGroup.objects.create(name="reference")
+        layer_group.layers.add(layer)
+        Feature.objects.create(
+            layer=layer, identifier="old", geom=GEOSGeometry("POINT (0 0)", srid=4326)
+        )
+
+        shadow = geostore_callbacks.shadow_layer_callback(source, layer)
+        self.assertEqual(shadow.settings, layer.settings)
+        self.assertFalse(shadow.layer_groups.exists())
+        Feature.objects.create(
+            layer=shadow, identifier="new", geom=GEOSGeometry("POINT (1 1)", srid=4326)
+        )
+
+        geostore_callbacks.publish_layer(source, layer, shadow)
+        live = Layer.objects.get(name="test")
+        self.assertEqual(live.pk, shadow.pk)
+        self.assertEqual(
+            list(live.features.values_list("identifier", flat=True)), ["new"]
+        )
+        self.assertEqual(list(live.layer_groups.all()), [layer_group])
+        self.assertEqual(list(live.authorized_groups.all()), [group])
+
+        geostore_callbacks.drop_layer(source, layer.pk)
+        self.assertFalse(Layer.objects.filter(pk=layer.pk).exists())
+        self.assertEqual(Feature.objects.count(), 1)
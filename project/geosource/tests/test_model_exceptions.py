@@ -214,7 +214,7 @@ class CSVSourceExceptionsTestCase(TestCase):
         )
         msg = "Line 0 - Can't find identifier 'identifier'"
         source.refresh_data()
-        self.assertIn(msg, source.report.errors)
+        self.assertIn(msg, source.report.error_lines.values_list("message", flat=True))
 
     @patch("project.geosource.models.GEOSGeometry", side_effect=GDALException())
     def test_gdal_exception_set_report_to_warning(
@@ -334,7 +334,7 @@ class GeoJSONSourceExceptionsTestCase(TestCase):
         )
         msg = "Line 0 - Can't find identifier 'gid'"
         source.refresh_data()
-        self.assertIn(msg, source.report.errors)
+        self.assertIn(msg, source.report.error_lines.values_list("message", flat=True))
 
 
 @patch("elasticsearch.client.IndicesClient.create")
@@ -372,7 +372,7 @@ class ShapefileSourceExceptionsTestCase(TestCase):
         )
         msg = "Line 0 - Can't find identifier 'wrongid'"
         source.refresh_data()
-        self.assertIn(msg, source.report.errors)
+        self.assertIn(msg, source.report.error_lines.values_list("message", flat=True))
 
 
 @patch("elasticsearch.client.IndicesClient.create")
@@ -1,15 +1,42 @@
+import tracemalloc
+from collections import deque
+from datetime import timedelta
 from io import StringIO
+from types import SimpleNamespace
 from unittest import mock
 
+import fiona
+from django.contrib.gis.geos import Polygon
 from django.contrib.gis.geos.point import Point
-from django.test import TestCase
-from geostore.models import Layer
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from geostore.models import (
+    Feature,
+    FeatureExtraGeom,
+    FeatureRelation,
+    Layer,
+    LayerExtraGeom,
+    LayerRelation,
+)
 
+from project.geosource import app_settings
+from project.geosource.elasticsearch.index import LayerESIndex
 from project.geosource.exceptions import GeoJSONSourceException
+from project.geosource.locks import (
+    COMPARE_AND_DELETE_SCRIPT,
+    acquire_refresh_lease,
+    get_lease_timeout,
+    get_redis_client,
+    get_refresh_lease_key,
+    release_refresh_lease,
+)
 from project.geosource.models import (
     CommandSource,
     CSVSource,
     Field,
+    FieldTypes,
     GeoJSONSource,
     GeometryTypes,
     PostGISSource,
@@ -18,6 +45,7 @@ from project.geosource.models import (
     SourceReporting,
     WMTSSource,
 )
+from project.geosource.progress import get_progress
 from project.geosource.tests.helpers import get_file
 
 
@@ -112,7 +140,10 @@ class ModelSourceTestCase(TestCase):
         self.geojson_source.save()
         self.geojson_source.refresh_data()
         msg = "Line 0 - Can't find identifier 'wrong_identifier'"
-        self.assertIn(msg, self.geojson_source.report.errors)
+        self.assertIn(
+            msg,
+            self.geojson_source.report.error_lines.values_list("message", flat=True),
+        )
 
     @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
     def test_delete(self, mock_index):
@@ -122,6 +153,69 @@ class ModelSourceTestCase(TestCase):
         self.geojson_source.delete()
         self.assertEqual(Layer.objects.count(), 0)
 
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
+    def test_refresh_is_skipped_while_leased(self, mock_index):
+        lease = acquire_refresh_lease(self.geojson_source.pk)
+        self.assertIsNone(acquire_refresh_lease(self.geojson_source.pk))
+        # As the request scheduling the refresh leaves it
+        self.geojson_source.status = Source.Status.PENDING
+        self.geojson_source.save()
+        with self.assertLogs("project.geosource.models", "WARNING"):
+            self.assertEqual(self.geojson_source.refresh_data(), {"locked": True})
+        self.assertEqual(Layer.objects.count(), 0)
+        self.geojson_source.refresh_from_db()
+        self.assertEqual(self.geojson_source.status, Source.Status.IN_PROGRESS)
+
+        release_refresh_lease(self.geojson_source.pk, lease)
+        self.assertEqual(self.geojson_source.refresh_data(), {"count": 1, "total": 1})
+        # Released once the refresh ended
+        lease = acquire_refresh_lease(self.geojson_source.pk)
+        self.assertIsNotNone(lease)
+        release_refresh_lease(self.geojson_source.pk, lease)
+
+    def test_lease_of_another_refresh_is_kept(self):
+        lease = acquire_refresh_lease(self.geojson_source.pk)
+        release_refresh_lease(self.geojson_source.pk, "expired")
+        self.assertIsNone(acquire_refresh_lease(self.geojson_source.pk))
+        release_refresh_lease(self.geojson_source.pk, lease)
+        self.assertIsNotNone(acquire_refresh_lease(self.geojson_source.pk))
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.redis.RedisCache",
+                "LOCATION": "redis://redis:6379/1,redis://replica:6379/1",
+            }
+        }
+    )
+    @mock.patch("project.geosource.locks.redis.Redis.from_url")
+    def test_leases_are_kept_by_redis(self, mock_from_url):
+        get_redis_client.cache_clear()
+        self.addCleanup(get_redis_client.cache_clear)
+        client = mock_from_url.return_value
+        key = cache.make_and_validate_key(get_refresh_lease_key(self.geojson_source.pk))
+
+        client.set.return_value = True
+        lease = acquire_refresh_lease(self.geojson_source.pk)
+        mock_from_url.assert_called_once_with(
+            "redis://redis:6379/1", decode_responses=True
+        )
+        client.set.assert_called_once_with(key, lease, nx=True, ex=get_lease_timeout())
+        client.set.return_value = None
+        self.assertIsNone(acquire_refresh_lease(self.geojson_source.pk))
+
+        release_refresh_lease(self.geojson_source.pk, lease)
+        client.eval.assert_called_once_with(COMPARE_AND_DELETE_SCRIPT, 1, key, lease)
+
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
+    def test_refresh_publishes_its_progress(self, mock_index):
+        self.geojson_source.refresh_data()
+        progress = get_progress(self.geojson_source.pk)
+        self.assertEqual(
+            (progress["read"], progress["written"], progress["finished"]),
+            (1, 1, True),
+        )
+
     @mock.patch("project.geosource.models.AsyncResult", new=MockAsyncResultSuccess)
     def test_get_status(self):
         self.geojson_source.task_id = 1
@@ -159,11 +253,51 @@ class ModelPostGISSourceTestCase(TestCase):
     def test_source_geom_attribute(self):
         self.assertEqual(self.geom_field, self.source.SOURCE_GEOM_ATTRIBUTE)
 
-    @mock.patch("psycopg2.connect", return_value=mock.Mock())
+    @mock.patch("psycopg2.connect")
+    def test_update_fields_skips_invalid_records(self, mock_connect):
+        cursor = mock_connect.return_value.cursor.return_value
+        cursor.description = [
+            SimpleNamespace(name=name) for name in ("st_asbinary", "geom", "name")
+        ]
+        cursor.__iter__.return_value = iter(
+            [(None, None, "a"), (Point(2, 42).wkb, "0101000020E6100000", "b")]
+        )
+        self.assertEqual(self.source.update_fields(), {"count": 1})
+        self.assertEqual(self.source.fields.get().name, "name")
+
+    @mock.patch("psycopg2.connect", return_value=mock.MagicMock())
     def test_test_get_records(self, mock_con):
         self.source._get_records(1)
         mock_con.assert_called_once()
 
+    @mock.patch("psycopg2.connect")
+    def test_get_records_streams_from_named_cursor(self, mock_connect):
+        connection = mock_connect.return_value
+        cursor = connection.cursor.return_value
+        cursor.description = [
+            SimpleNamespace(name=name) for name in ("st_asbinary", "id", "geom", "name")
+        ]
+        cursor.__iter__.return_value = iter(
+            [(Point(2, 42).wkb, 1, "0101000020E6100000", "a"), (None, 2, None, "b")]
+        )
+
+        records, errors = self.source._get_records(10)
+
+        connection.cursor.assert_called_once_with(name="geosource_records")
+        self.assertEqual(cursor.itersize, app_settings.POSTGIS_ITERSIZE)
+        query = repr(cursor.execute.call_args[0][0])
+        self.assertIn("ST_Transform", query)
+        # Geometries without SRID are not transformed
+        self.assertIn("ST_SRID", query)
+        self.assertIn("LIMIT", query)
+        self.assertEqual(len(records), 1)
+        geometry = records[0].pop("geom")
+        self.assertEqual((geometry.coords, geometry.srid), ((2, 42), 4326))
+        self.assertEqual(records[0], {"id": 1, "name": "a"})
+        self.assertEqual(errors, ["Line 1 - Empty geometry or unknown SRID"])
+        cursor.close.assert_called_once()
+        connection.close.assert_called_once()
+
 
 class ModelGeoJSONSourceTestCase(TestCase):
     def test_get_file_as_dict(self):
@@ -190,6 +324,31 @@ class ModelGeoJSONSourceTestCase(TestCase):
             },
         )
 
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index_feature")
+    def test_file_is_read_again_by_refresh(self, mock_index_feature, mock_index):
+        source = GeoJSONSource.objects.create(
+            name="Titi",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+        )
+        source.update_fields()
+        self.assertTrue(source.fields.filter(name="test").exists())
+        self.assertEqual(source.refresh_data(), {"count": 1, "total": 1})
+        self.assertEqual(source.get_layer().features.count(), 1)
+        self.assertEqual(len(source.get_file_as_dict()["features"]), 1)
+
+    def test_uploaded_file_is_kept_open_until_saved(self):
+        # As the serializer validates it before saving
+        source = GeoJSONSource(
+            name="Titi", geom_type=GeometryTypes.Point, file=get_file("test.geojson")
+        )
+        for _ in range(2):
+            records, _ = source._get_records(1)
+            self.assertEqual(len(records), 1)
+        source.save()
+        self.assertEqual(len(source.get_file_as_dict()["features"]), 1)
+
     def test_get_file_as_dict_wrong_file(self):
         source = GeoJSONSource.objects.create(
             name="Titi",
@@ -228,6 +387,126 @@ class ModelShapeFileSourceTestCase(TestCase):
         self.assertEqual(records[0]["Insee"], 99999)
         self.assertEqual(records[0]["_geom_"].geom_typeid, GeometryTypes.Polygon)
 
+    def test_get_records_opens_stored_file_by_path(self):
+        source = ShapefileSource.objects.create(
+            name="Titi",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.zip"),
+        )
+
+        with mock.patch(
+            "project.geosource.models.fiona.open", wraps=fiona.open
+        ) as mock_open:
+            records, errors = source._get_records()
+        mock_open.assert_called_once_with(f"zip://{source.file.path}")
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["_geom_"].srid, 2154)
+
+    def test_get_records_of_unsaved_file(self):
+        source = ShapefileSource(
+            name="Titi",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.zip"),
+        )
+
+        records, errors = source._get_records(1)
+        self.assertEqual(records[0]["NOM"], "Trifouilli-les-Oies")
+
+
+@mock.patch("psycopg2.connect")
+class PostGISIncrementalRefreshTestCase(TestCase):
+    def setUp(self):
+        self.source = PostGISSource.objects.create(
+            name="Toto",
+            geom_type=GeometryTypes.Point,
+            geom_field="geom",
+            query="SELECT * FROM places",
+            watermark_field="updated",
+            tombstone_predicate="deleted",
+            last_watermark="3",
+            last_reconcile=timezone.now(),
+        )
+        self.layer = self.source.get_layer()
+        for identifier in ("1", "2", "3"):
+            Feature.objects.create(
+                layer=self.layer, identifier=identifier, geom=Point(0, 0, srid=4326)
+            )
+
+    def set_rows(self, mock_connect, rows):
+        cursor = mock_connect.return_value.cursor.return_value
+        cursor.description = [
+            SimpleNamespace(name=name)
+            for name in ("st_asbinary", "?column?", "id", "geom", "updated")
+        ]
+        cursor.__iter__.return_value = iter(rows)
+        return cursor
+
+    def test_is_incremental_refresh(self, mock_connect):
+        self.assertTrue(self.source._is_incremental_refresh())
+        self.source.reconcile_interval = 60
+        self.assertTrue(self.source._is_incremental_refresh())
+        self.source.last_reconcile = timezone.now() - timedelta(hours=2)
+        self.assertFalse(self.source._is_incremental_refresh())
+        self.source.last_watermark = ""
+        self.source.reconcile_interval = -1
+        self.assertFalse(self.source._is_incremental_refresh())
+
+    def test_refresh_reads_rows_since_watermark(self, mock_connect):
+        cursor = self.set_rows(
+            mock_connect,
+            [
+                (Point(2, 42).wkb, False, 1, None, 5),
+                (None, True, 2, None, 8),
+            ],
+        )
+
+        self.source._refresh_data()
+
+        query = repr(cursor.execute.call_args[0][0])
+        self.assertIn("Identifier('updated'), SQL(' >= '), Literal('3')", query)
+        self.assertIn("SQL('deleted')", query)
+        # Features not read are kept, tombstoned ones are deleted
+        self.assertEqual(
+            sorted(self.layer.features.values_list("identifier", flat=True)),
+            ["1", "3"],
+        )
+        self.assertEqual(self.layer.features.get(identifier="1").geom.coords, (2, 42))
+        report = self.source.report
+        self.assertEqual((report.modified_lines, report.deleted_lines), (1, 1))
+        self.assertEqual(report.status, SourceReporting.Status.SUCCESS.value)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.last_watermark, "8")
+
+    def test_refresh_without_changes_succeeds(self, mock_connect):
+        self.set_rows(mock_connect, [])
+
+        self.source._refresh_data()
+
+        self.assertEqual(self.source.report.status, SourceReporting.Status.SUCCESS)
+        self.assertEqual(self.layer.features.count(), 3)
+        self.assertEqual(self.source.last_watermark, "3")
+
+    def test_reconcile_reads_the_whole_query(self, mock_connect):
+        self.source.reconcile_interval = 60
+        self.source.last_reconcile = timezone.now() - timedelta(hours=2)
+        cursor = self.set_rows(
+            mock_connect,
+            [
+                (Point(2, 42).wkb, False, 1, None, 1),
+                (Point(2, 42).wkb, True, 2, None, 2),
+            ],
+        )
+
+        self.source._refresh_data()
+
+        self.assertNotIn("WHERE", repr(cursor.execute.call_args[0][0]))
+        self.assertEqual(
+            list(self.layer.features.values_list("identifier", flat=True)), ["1"]
+        )
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.last_watermark, "2")
+        self.assertEqual(self.source.last_reconcile, self.source.report.started)
+
 
 class ModelCommandSourceTestCase(TestCase):
     def setUp(self):
@@ -239,7 +518,7 @@ class ModelCommandSourceTestCase(TestCase):
     @mock.patch("sys.stdout", new_callable=StringIO)
     def test_refresh_data(self, mocked_stdout, mock_index):
         mock_index.return_value = True
-        with self.assertNumQueries(36):
+        with self.assertNumQueries(33):
             self.source.refresh_data()
         self.assertIn("Start refresh", mocked_stdout.getvalue())
 
@@ -306,6 +585,31 @@ class ModelCSVSourceTestCase(TestCase):
             row_count = source.refresh_data()
         self.assertEqual(row_count["count"], len(records), row_count)
 
+    @mock.patch("project.geosource.app_settings.SAMPLING", "spread")
+    @mock.patch("project.geosource.app_settings.SAMPLE_SIZE", 4)
+    @mock.patch("project.geosource.app_settings.SAMPLE_CHUNKS", 2)
+    def test_update_fields_reads_spread_sample(self):
+        source = CSVSource.objects.create(
+            name="source",
+            file=get_file("source.csv"),
+            geom_type=GeometryTypes.Point,
+            id_field="ID",
+            settings={
+                **self.base_settings,
+                "coordinates_field": "two_columns",
+                "longitude_field": "XCOORD",
+                "latitude_field": "YCOORD",
+                "ignore_columns": True,
+            },
+        )
+        records, _ = source._get_records(4, chunks=2)
+        identifiers = [record["ID"] for record in records]
+        self.assertLessEqual(len(identifiers), 4)
+        self.assertEqual(identifiers[0], 1)
+        self.assertGreater(identifiers[-1], 2)
+
+        self.assertEqual(source.update_fields(), {"count": 35})
+
     @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
     @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index_feature")
     def test_get_records_with_one_column_coordinates(
@@ -445,6 +749,25 @@ class ModelCSVSourceTestCase(TestCase):
             row_count = source.refresh_data()
         self.assertEqual(row_count["count"], len(records), row_count)
 
+    def test_get_records_with_decimal_comma_in_two_columns(self):
+        source = CSVSource.objects.create(
+            name="source",
+            file=ContentFile(b"ID;X;Y;name\n1;2,5;42,1;a\n", name="comma.csv"),
+            geom_type=GeometryTypes.Point,
+            id_field="ID",
+            settings={
+                **self.base_settings,
+                "decimal_separator": "comma",
+                "coordinates_field": "two_columns",
+                "longitude_field": "X",
+                "latitude_field": "Y",
+            },
+        )
+        records, errors = source._get_records()
+        self.assertEqual(errors, [])
+        self.assertEqual(records[0].pop("_geom_").coords, (2.5, 42.1))
+        self.assertEqual(records[0], {"ID": 1, "name": "a"})
+
     def test_update_fields_keep_order(self):
         source = CSVSource.objects.create(
             name="source",
@@ -502,6 +825,23 @@ class SourceReportingTestCase(TestCase):
         self.source.refresh_data()
         self.assertIsNotNone(self.source.report)
 
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex._start_loading")
+    @mock.patch(
+        "project.geosource.elasticsearch.index.streaming_bulk",
+        side_effect=ConnectionError("Unreachable"),
+    )
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.publish")
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.discard")
+    def test_failed_indexing_keeps_previous_index(
+        self, mock_discard, mock_publish, mock_index, mock_bulk, mock_start_loading
+    ):
+        with self.assertLogs("project.geosource", "WARNING"):
+            self.source.refresh_data()
+        mock_publish.assert_not_called()
+        mock_discard.assert_called_once()
+        self.assertEqual(self.source.report.errors[0]["kind"], "IndexingError")
+
     @mock.patch("elasticsearch.client.IndicesClient.create")
     @mock.patch("elasticsearch.client.IndicesClient.delete")
     @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
@@ -545,7 +885,8 @@ class SourceReportingTestCase(TestCase):
             added_lines=42,
             modified_lines=42,
             deleted_lines=42,
-            errors=["error 1", "error 2", "error 3"],
+            errors=[{"kind": "Error", "count": 3, "examples": ["error 1"]}],
+            error_count=3,
         )
         report.reset()
         self.assertEqual(report.message, "")
@@ -553,6 +894,52 @@ class SourceReportingTestCase(TestCase):
         self.assertEqual(report.modified_lines, 0)
         self.assertEqual(report.deleted_lines, 0)
         self.assertEqual(report.errors, [])
+        self.assertEqual(report.error_count, 0)
+
+    @mock.patch("project.geosource.app_settings.ERROR_EXAMPLES", 2)
+    @mock.patch("project.geosource.app_settings.BULK_BATCH_SIZE", 3)
+    def test_report_errors_are_aggregated(self):
+        report = SourceReporting.objects.create()
+        for i in range(4):
+            report.add_error(
+                f"Line {i} - Can't find identifier 'ID'", "MissingIdentifier"
+            )
+        report.add_error("ID - 5: invalid geometry", "ValueError")
+        self.assertEqual(report.error_count, 5)
+        self.assertEqual(
+            report.errors,
+            [
+                {
+                    "kind": "MissingIdentifier",
+                    "count": 4,
+                    "examples": [
+                        "Line 0 - Can't find identifier 'ID'",
+                        "Line 1 - Can't find identifier 'ID'",
+                    ],
+                },
+                {
+                    "kind": "ValueError",
+                    "count": 1,
+                    "examples": ["ID - 5: invalid geometry"],
+                },
+            ],
+        )
+        # Stored by batches, then once the report is saved
+        self.assertEqual(report.error_lines.count(), 3)
+        report.save()
+        self.assertEqual(report.error_lines.count(), 5)
+
+        report.merge_errors(
+            [
+                {"kind": "ValueError", "count": 3, "examples": ["a", "b", "c"]},
+                {"kind": "ShardError", "count": 1, "examples": ["d"]},
+            ]
+        )
+        self.assertEqual(report.error_count, 9)
+        self.assertEqual(
+            [(bucket["count"], bucket["examples"]) for bucket in report.errors[1:]],
+            [(4, ["ID - 5: invalid geometry", "a"]), (1, ["d"])],
+        )
 
     @mock.patch("elasticsearch.client.IndicesClient.create")
     @mock.patch("elasticsearch.client.IndicesClient.delete")
@@ -565,15 +952,14 @@ class SourceReportingTestCase(TestCase):
         to have less row being refresh than the total row count (partial refresh).
         The report Status shoule be WARNING"""
 
-        # Mocking _get_records to return some incorret row
-        mocked_rows = (
+        # Mocking _iter_records to return some incorret row
+        mocked_rows = iter(
             [
                 {"_geom_": Point(2, 42, srid=4326), "id": 1, "test": 5},
                 {"_geom_": "wrong geom"},
-            ],
-            [],
+            ]
         )
-        self.source._get_records = mock.MagicMock(return_value=mocked_rows)
+        self.source._iter_records = mock.MagicMock(return_value=mocked_rows)
         self.source.refresh_data()
         self.source.refresh_from_db()
         self.assertEqual(
@@ -581,3 +967,585 @@ class SourceReportingTestCase(TestCase):
             SourceReporting.Status.WARNING.value,
             self.source.report.get_status_display(),
         )
+
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index_feature")
+    def test_geometry_rejected_by_callback_is_reported(
+        self, mock_es_index_feature, mock_es_index
+    ):
+        self.source._iter_records = mock.MagicMock(
+            return_value=iter(
+                [
+                    {"_geom_": Point(2, 42, srid=4326), "id": 1},
+                    # Can't be reprojected without SRID
+                    {"_geom_": Point(2, 43), "id": 2},
+                ]
+            )
+        )
+        self.assertEqual(self.source.refresh_data(), {"count": 1, "total": 2})
+        report = self.source.report
+        self.assertEqual((report.added_lines, report.modified_lines), (1, 0))
+        self.assertEqual(report.errors[0]["kind"], "InvalidGeometry")
+        self.assertEqual(mock_es_index_feature.call_count, 1)
+
+
+@mock.patch("project.geosource.app_settings.BULK_INGESTION", True)
+@mock.patch("project.geosource.app_settings.BULK_BATCH_SIZE", 2)
+@mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
+@mock.patch(
+    "project.geosource.elasticsearch.index.LayerESIndex.index_features",
+    return_value=[],
+)
+class BulkIngestionTestCase(TestCase):
+    def setUp(self):
+        self.source = CSVSource.objects.create(
+            name="source",
+            file=get_file("source.csv"),
+            geom_type=GeometryTypes.Point,
+            id_field="ID",
+            settings={
+                "encoding": "UTF-8",
+                "coordinate_reference_system": "EPSG_4326",
+                "char_delimiter": "doublequote",
+                "field_separator": "semicolon",
+                "decimal_separator": "point",
+                "use_header": True,
+                "coordinates_field": "two_columns",
+                "longitude_field": "XCOORD",
+                "latitude_field": "YCOORD",
+            },
+        )
+
+    @mock.patch("project.geosource.app_settings.CHANGE_DETECTION", False)
+    def test_refresh_data_reports_added_and_modified_lines(
+        self, mock_index_features, mock_index
+    ):
+        row_count = self.source.refresh_data()
+        self.assertEqual(row_count, {"count": 6, "total": 6})
+        self.assertEqual(self.source.report.added_lines, 6)
+        self.assertEqual(self.source.report.modified_lines, 0)
+        self.assertEqual(
+            sum(call.args[0].count() for call in mock_index_features.call_args_list),
+            6,
+        )
+
+        self.source.refresh_data()
+        self.assertEqual(self.source.report.added_lines, 0)
+        self.assertEqual(self.source.report.modified_lines, 6)
+        self.assertEqual(self.source.report.deleted_lines, 0)
+        self.assertEqual(
+            self.source.report.status, SourceReporting.Status.SUCCESS.value
+        )
+        self.assertEqual(self.source.get_layer().features.count(), 6)
+
+    def test_refresh_data_syncs_relations(self, mock_index_features, mock_index):
+        area = Layer.objects.create(name="area")
+        area_feature = area.features.create(
+            geom=Polygon.from_bbox((0, 0, 1e7, 1e7)), identifier="area"
+        )
+        relation = LayerRelation.objects.create(
+            name="in",
+            origin=self.source.get_layer(),
+            destination=area,
+            relation_type="intersects",
+        )
+        self.source.refresh_data()
+        self.assertEqual(
+            FeatureRelation.objects.filter(
+                relation=relation, destination=area_feature
+            ).count(),
+            6,
+        )
+        self.assertIn("relations", self.source.report.timings)
+
+    @mock.patch("geostore.settings.GEOSTORE_RELATION_CELERY_ASYNC", True)
+    @mock.patch("project.geosource.geostore_callbacks.layer_relations_set_destinations")
+    def test_refresh_data_syncs_relations_in_background(
+        self, mock_set_destinations, mock_index_features, mock_index
+    ):
+        relation = LayerRelation.objects.create(
+            name="in",
+            origin=self.source.get_layer(),
+            destination=Layer.objects.create(name="area"),
+            relation_type="intersects",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.source.refresh_data()
+        # Once for the layer, rather than once per merged feature
+        mock_set_destinations.delay.assert_called_once_with(relation.pk)
+
+    def test_refresh_data_reports_timings(self, mock_index_features, mock_index):
+        self.source.refresh_data()
+        report = self.source.report
+        self.assertTrue({"read", "write", "index", "clear"} <= report.timings.keys())
+        self.assertGreater(report.rows_per_second, 0)
+        self.assertGreater(report.peak_memory, 0)
+
+    @mock.patch("project.geosource.app_settings.FIELD_PROFILES", True)
+    def test_refresh_data_profiles_fields(self, mock_index_features, mock_index):
+        field = self.source.fields.create(
+            name="numeroVoieEtablissement", data_type=FieldTypes.Integer.value
+        )
+        self.source.refresh_data()
+        field.refresh_from_db()
+        self.assertEqual(field.profile["nulls"], 0)
+        self.assertEqual(field.profile["values"][0], [3, 2])
+        self.assertEqual(
+            field.profile["numeric"],
+            {
+                "count": 6,
+                "min": 1,
+                "max": 10,
+                "positive_min": 1,
+                "positive_max": 10,
+                "sketch": [1, 3, 3, 5, 9, 10],
+            },
+        )
+        self.assertIn("profile", self.source.report.timings)
+
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.delete_features")
+    def test_refresh_data_skips_unchanged_records(
+        self, mock_delete_features, mock_index_features, mock_index
+    ):
+        def refresh(records):
+            self.source._iter_records = mock.MagicMock(return_value=iter(records))
+            self.source.refresh_data()
+
+        refresh(
+            [
+                {"_geom_": Point(2, 42, srid=4326), "ID": i, "name": f"name {i}"}
+                for i in range(3)
+            ]
+        )
+        self.assertEqual(mock_index.call_count, 1)
+        self.assertEqual(self.source.feature_digests.count(), 3)
+
+        mock_index_features.reset_mock()
+        refresh(
+            [
+                {"_geom_": Point(2, 42, srid=4326), "ID": 0, "name": "name 0"},
+                {"_geom_": Point(2, 43, srid=4326), "ID": 1, "name": "name 1"},
+            ]
+        )
+        report = self.source.report
+        self.assertEqual(
+            (report.added_lines, report.modified_lines, report.unchanged_lines),
+            (0, 1, 1),
+        )
+        self.assertEqual(report.deleted_lines, 1)
+        self.assertEqual(report.total, 2)
+        self.assertEqual(report.status, SourceReporting.Status.SUCCESS.value)
+        # The index is kept, only the changed feature is indexed again
+        self.assertEqual(mock_index.call_count, 1)
+        self.assertEqual(
+            [
+                identifier
+                for call in mock_index_features.call_args_list
+                for identifier in call.args[0].values_list("identifier", flat=True)
+            ],
+            ["1"],
+        )
+        mock_delete_features.assert_called_once_with(["2"])
+        layer = self.source.get_layer()
+        self.assertEqual(
+            sorted(layer.features.values_list("identifier", flat=True)), ["0", "1"]
+        )
+        self.assertEqual(
+            sorted(self.source.feature_digests.values_list("identifier", flat=True)),
+            ["0", "1"],
+        )
+
+    def test_removed_features_are_written_again(self, mock_index_features, mock_index):
+        self.source.refresh_data()
+        self.source.get_layer().features.filter(identifier="1").delete()
+
+        self.source.refresh_data()
+        self.assertEqual(self.source.report.unchanged_lines, 4)
+        self.assertEqual(self.source.report.modified_lines, 1)
+        self.assertEqual(self.source.report.added_lines, 1)
+        self.assertEqual(self.source.get_layer().features.count(), 6)
+
+    def test_unchanged_rows_are_not_counted_as_written(
+        self, mock_index_features, mock_index
+    ):
+        self.source.refresh_data()
+        self.assertGreater(self.source.report.rows_per_second, 0)
+
+        self.source.refresh_data()
+        self.assertEqual(self.source.report.unchanged_lines, 6)
+        self.assertEqual(self.source.report.rows_per_second, 0)
+
+    def test_duplicated_identifiers_keep_last_record(
+        self, mock_index_features, mock_index
+    ):
+        self.source._iter_records = mock.MagicMock(
+            return_value=iter(
+                [
+                    {"_geom_": Point(2, 42, srid=4326), "ID": 1, "name": "first"},
+                    {"_geom_": Point(2, 43, srid=4326), "ID": 1, "name": "last"},
+                ]
+            )
+        )
+        self.source.refresh_data()
+        self.assertEqual(self.source.report.added_lines, 1)
+        self.assertEqual(self.source.report.modified_lines, 1)
+        feature = self.source.get_layer().features.get()
+        self.assertEqual(feature.properties["name"], "last")
+
+    def test_bad_rows_are_reported(self, mock_index_features, mock_index):
+        self.source._iter_records = mock.MagicMock(
+            return_value=iter(
+                [
+                    {"_geom_": Point(2, 42, srid=4326), "ID": 1},
+                    {"_geom_": "wrong geom", "ID": 2},
+                    {"_geom_": Point(2, 43, srid=4326)},
+                ]
+            )
+        )
+        row_count = self.source.refresh_data()
+        self.assertEqual(row_count, {"count": 1, "total": 3})
+        self.assertEqual(self.source.report.error_count, 2)
+        self.assertIn(
+            "Line 2 - Can't find identifier 'ID'",
+            self.source.report.error_lines.values_list("message", flat=True),
+        )
+        self.assertEqual(
+            self.source.report.status, SourceReporting.Status.WARNING.value
+        )
+
+
+@mock.patch("project.geosource.app_settings.REFRESH_STRATEGY", "rebuild")
+@mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
+@mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index_feature")
+@mock.patch("project.geosource.models.run_drop_layer.delay")
+class RebuildRefreshTestCase(TestCase):
+    def setUp(self):
+        self.source = GeoJSONSource.objects.create(
+            name="source",
+            file=get_file("test.geojson"),
+            geom_type=GeometryTypes.Point,
+        )
+
+    def refresh(self, identifiers):
+        self.source._iter_records = mock.MagicMock(
+            return_value=iter(
+                [
+                    {"_geom_": Point(2, 42, srid=4326), "id": identifier}
+                    for identifier in identifiers
+                ]
+            )
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.source.refresh_data()
+
+    def test_refresh_publishes_rebuilt_layer(
+        self, mock_drop_layer, mock_index_feature, mock_index
+    ):
+        indexed_in = set()
+        mock_index_feature.side_effect = lambda layer, feature: indexed_in.add(
+            layer.name
+        )
+        self.refresh([1, 2])
+        first_layer = self.source.get_layer()
+        self.assertEqual(first_layer.features.count(), 2)
+
+        self.refresh([2, 3, 4])
+        layer = self.source.get_layer()
+        self.assertNotEqual(layer.pk, first_layer.pk)
+        self.assertEqual(
+            sorted(layer.features.values_list("identifier", flat=True)),
+            ["2", "3", "4"],
+        )
+        report = self.source.report
+        self.assertEqual(
+            (report.added_lines, report.modified_lines, report.deleted_lines),
+            (2, 1, 1),
+        )
+        mock_drop_layer.assert_called_with(self.source.pk, first_layer.pk)
+        # Documents are indexed under the live layer name
+        self.assertEqual(indexed_in, {"source"})
+
+    def test_rebuild_moves_relations_and_extra_geometries(
+        self, mock_drop_layer, mock_index_feature, mock_index
+    ):
+        self.refresh([1, 2])
+        first_layer = self.source.get_layer()
+        other = Layer.objects.create(name="other")
+        relation = LayerRelation.objects.create(
+            name="near", origin=first_layer, destination=other
+        )
+        reverse_relation = LayerRelation.objects.create(
+            name="far", origin=other, destination=first_layer
+        )
+        extra_geom = LayerExtraGeom.objects.create(layer=first_layer, title="Area")
+        old_feature = first_layer.features.get(identifier="2")
+        feature_extra_geom = FeatureExtraGeom.objects.create(
+            feature=old_feature,
+            layer_extra_geom=extra_geom,
+            geom=Point(2, 42, srid=4326),
+        )
+        feature_relation = FeatureRelation.objects.create(
+            origin=old_feature,
+            destination=other.features.create(geom=Point(0, 0, srid=4326)),
+            relation=relation,
+        )
+
+        self.refresh([2, 3])
+        layer = self.source.get_layer()
+        feature = layer.features.get(identifier="2")
+        relation.refresh_from_db()
+        reverse_relation.refresh_from_db()
+        extra_geom.refresh_from_db()
+        feature_extra_geom.refresh_from_db()
+        feature_relation.refresh_from_db()
+        self.assertEqual(relation.origin, layer)
+        self.assertEqual(relation.slug, f"{layer.pk}-near")
+        self.assertEqual(reverse_relation.destination, layer)
+        self.assertEqual(extra_geom.layer, layer)
+        self.assertEqual(feature_extra_geom.feature, feature)
+        self.assertEqual(feature_relation.origin, feature)
+
+        # Nothing protects or cascades from the retired layer anymore
+        self.source.drop_layer(first_layer.pk)
+        self.assertFalse(Layer.objects.filter(pk=first_layer.pk).exists())
+        self.assertTrue(
+            FeatureExtraGeom.objects.filter(pk=feature_extra_geom.pk).exists()
+        )
+        self.assertTrue(FeatureRelation.objects.filter(pk=feature_relation.pk).exists())
+
+    def test_rebuild_syncs_moved_relations(
+        self, mock_drop_layer, mock_index_feature, mock_index
+    ):
+        self.refresh([1, 2])
+        area = Layer.objects.create(name="area")
+        area.features.create(geom=Polygon.from_bbox((0, 40, 4, 44)))
+        relation = LayerRelation.objects.create(
+            name="in",
+            origin=self.source.get_layer(),
+            destination=area,
+            relation_type="intersects",
+        )
+
+        self.refresh([2, 3])
+        # Features were saved in the rebuilt layer before the relation moved to it
+        self.assertEqual(
+            sorted(
+                relation.related_features.values_list("origin__identifier", flat=True)
+            ),
+            ["2", "3"],
+        )
+
+    def test_failed_rebuild_keeps_live_layer(
+        self, mock_drop_layer, mock_index_feature, mock_index
+    ):
+        self.refresh([1, 2])
+        layer = self.source.get_layer()
+
+        self.refresh([])
+        self.assertEqual(self.source.get_layer().pk, layer.pk)
+        self.assertEqual(layer.features.count(), 2)
+        self.assertEqual(self.source.report.status, SourceReporting.Status.ERROR)
+
+
+@mock.patch("project.geosource.app_settings.REFRESH_SHARDS", 2)
+@mock.patch("project.geosource.app_settings.SHARD_MIN_ROWS", 1)
+@mock.patch("project.geosource.app_settings.BULK_INGESTION", True)
+@mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
+@mock.patch(
+    "project.geosource.elasticsearch.index.LayerESIndex.index_features",
+    return_value=[],
+)
+class ShardedRefreshTestCase(TestCase):
+    def setUp(self):
+        self.source = CSVSource.objects.create(
+            name="source",
+            file=get_file("source.csv"),
+            geom_type=GeometryTypes.Point,
+            id_field="ID",
+            settings={
+                "encoding": "UTF-8",
+                "coordinate_reference_system": "EPSG_4326",
+                "char_delimiter": "doublequote",
+                "field_separator": "semicolon",
+                "decimal_separator": "point",
+                "use_header": True,
+                "coordinates_field": "two_columns",
+                "longitude_field": "XCOORD",
+                "latitude_field": "YCOORD",
+            },
+        )
+        self.layer = self.source.get_layer()
+        self.layer.features.create(
+            identifier="stale", geom=Point(0, 0, srid=4326), properties={}
+        )
+
+    def test_shards_are_merged_into_report(self, mock_index_features, mock_index):
+        self.assertEqual(self.source._get_shards(2), [[0, 2], [1, 2]])
+        self.assertEqual(self.source.refresh_data(), {"shards": 2})
+
+        self.source.refresh_from_db()
+        report = self.source.report
+        self.assertEqual(self.source.status, Source.Status.DONE)
+        self.assertEqual(report.status, SourceReporting.Status.SUCCESS)
+        self.assertEqual((report.total, report.added_lines), (6, 6))
+        self.assertEqual(report.deleted_lines, 1)
+        self.assertIn("clear", report.timings)
+        self.assertEqual(
+            sorted(self.layer.features.values_list("identifier", flat=True)),
+            ["1", "2", "3", "4", "5", "6"],
+        )
+        # Progress of the shards is summed
+        progress = get_progress(self.source.pk)
+        self.assertEqual(
+            (progress["read"], progress["written"], progress["finished"]),
+            (6, 6, True),
+        )
+
+    def test_failed_shard_keeps_features(self, mock_index_features, mock_index):
+        iter_shard_records = self.source._iter_shard_records
+
+        def fail_second_shard(shard):
+            if shard[0]:
+                msg = "Shard failed"
+                raise ValueError(msg)
+            return iter_shard_records(shard)
+
+        with mock.patch.object(
+            CSVSource, "_iter_shard_records", side_effect=fail_second_shard
+        ):
+            self.source.refresh_data()
+
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.report.status, SourceReporting.Status.ERROR)
+        self.assertEqual(self.source.report.added_lines, 3)
+        self.assertEqual(self.source.report.errors[0]["kind"], "ShardError")
+        self.assertEqual(self.source.report.error_lines.get().message, "Shard failed")
+        self.assertTrue(self.layer.features.filter(identifier="stale").exists())
+
+    def test_records_of_an_identifier_are_written_by_one_shard(
+        self, mock_index_features, mock_index
+    ):
+        rows = [(i, f"name {i}") for i in range(1, 9)] + [(1, "last")]
+        self.source.file = ContentFile(
+            "ID;XCOORD;YCOORD;name\n"
+            + "".join(f"{i};2.{i};42.{i};{name}\n" for i, name in rows),
+            name="duplicates.csv",
+        )
+        self.source.save()
+        shard_records = [
+            [record["ID"] for record in self.source._iter_shard_records(shard)]
+            for shard in self.source._get_shards(2)
+        ]
+        self.assertEqual(sorted(sum(shard_records, [])), [1, 1, *range(2, 9)])
+        self.assertTrue(all(shard_records))
+
+        self.source.refresh_data()
+        self.assertEqual(self.layer.features.filter(identifier="1").count(), 1)
+        self.assertEqual(
+            self.layer.features.get(identifier="1").properties["name"], "last"
+        )
+        self.assertEqual(self.layer.features.count(), 8)
+
+    @mock.patch("project.geosource.models.chord")
+    def test_lost_shard_expires_refresh(
+        self, mock_chord, mock_index_features, mock_index
+    ):
+        # Shards are never run, the refresh is expired by the next task
+        self.assertEqual(self.source.refresh_data(), {"shards": 2})
+        context = mock_chord.return_value.call_args.args[0].args[1]
+
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.status, Source.Status.DONE)
+        self.assertEqual(self.source.report.status, SourceReporting.Status.ERROR)
+        self.assertEqual(self.source.report.errors[0]["kind"], "ShardTimeout")
+        self.assertIsNotNone(self.source.report.ended)
+        self.assertTrue(self.layer.features.filter(identifier="stale").exists())
+        self.assertIsNotNone(acquire_refresh_lease(self.source.pk))
+
+        # The last task, if it ever runs, leaves the report as it is
+        self.assertEqual(
+            self.source.finish_sharded_refresh([], context), {"expired": True}
+        )
+        self.assertFalse(self.source.expire_sharded_refresh(context))
+
+    def test_finished_refresh_is_not_expired(self, mock_index_features, mock_index):
+        with mock.patch(
+            "project.geosource.models.run_expire_refresh.apply_async"
+        ) as mock_expire:
+            self.source.refresh_data()
+        _, context = mock_expire.call_args.args[0]
+        self.assertEqual(mock_expire.call_args.kwargs["countdown"], 6 * 60 * 60)
+
+        self.assertFalse(self.source.expire_sharded_refresh(context))
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.report.status, SourceReporting.Status.SUCCESS)
+
+    @mock.patch("project.geosource.app_settings.SHARD_MIN_ROWS", 10)
+    def test_small_sources_are_not_split(self, mock_index_features, mock_index):
+        self.assertEqual(self.source.refresh_data(), {"count": 6, "total": 6})
+        self.assertEqual(self.source.report.deleted_lines, 1)
+
+
+class StreamingRecordsTestCase(TestCase):
+    settings = {
+        "encoding": "UTF-8",
+        "coordinate_reference_system": "EPSG_4326",
+        "char_delimiter": "doublequote",
+        "field_separator": "semicolon",
+        "decimal_separator": "point",
+        "use_header": True,
+        "coordinates_field": "two_columns",
+        "longitude_field": "XCOORD",
+        "latitude_field": "YCOORD",
+    }
+
+    def get_csv_source(self, rows):
+        content = "ID;XCOORD;YCOORD;name\n" + "".join(
+            f"{i};2.{i};42.{i};name {i}\n" for i in range(rows)
+        )
+        return CSVSource.objects.create(
+            name=f"source-{rows}",
+            file=ContentFile(content.encode(), name=f"source-{rows}.csv"),
+            geom_type=GeometryTypes.Point,
+            id_field="ID",
+            settings=self.settings,
+        )
+
+    def get_peak_memory(self, func):
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_records_are_read_with_flat_memory(self):
+        def consume(source):
+            return lambda: deque(source._iter_records(), maxlen=0)
+
+        # Warm up imports and parser caches before measuring
+        consume(self.get_csv_source(10))()
+        small = self.get_peak_memory(consume(self.get_csv_source(1000)))
+        large = self.get_peak_memory(consume(self.get_csv_source(8000)))
+        self.assertLess(large, small * 2, (small, large))
+
+    @mock.patch("project.geosource.app_settings.BULK_INGESTION", True)
+    @mock.patch("project.geosource.app_settings.BULK_BATCH_SIZE", 100)
+    @mock.patch("project.geosource.elasticsearch.index.LayerESIndex.index")
+    @mock.patch.object(LayerESIndex, "index_features", lambda *args, **kwargs: [])
+    def test_refresh_data_ingests_with_flat_memory(self, mock_index):
+        source = self.get_csv_source(0)
+
+        def refresh(rows):
+            records = (
+                {"_geom_": Point(2, 42, srid=4326), "ID": i, "name": f"name {i}"}
+                for i in range(rows)
+            )
+            source._iter_records = mock.MagicMock(return_value=records)
+            return source._refresh_data
+
+        refresh(10)()
+        small = self.get_peak_memory(refresh(500))
+        large = self.get_peak_memory(refresh(4000))
+        self.assertLess(large, small * 2, (small, large))
+        self.assertEqual(source.get_layer().features.count(), 4000)
@@ -0,0 +1,104 @@
+import json
+import multiprocessing
+from unittest import mock
+
+import billiard
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from geostore import GeometryTypes
+
+from project.geosource import parallel
+from project.geosource.exceptions import SourceException
+from project.geosource.models import CSVSource, GeoJSONSource, ShapefileSource
+from project.geosource.tests.helpers import get_file
+
+
+@mock.patch("project.geosource.app_settings.PARSE_WORKERS", 2)
+@mock.patch("project.geosource.app_settings.PARSE_CHUNK_SIZE", 2)
+class ParallelParsingTestCase(TestCase):
+    def assertParsedInParallel(self, source):
+        # Read from another instance, as the file of a source is read once
+        serial = list(type(source).objects.get(pk=source.pk)._iter_records())
+        with mock.patch(
+            "project.geosource.parallel.iter_parsed_records",
+            wraps=parallel.iter_parsed_records,
+        ) as iter_parsed_records:
+            records = list(source._read_records())
+        iter_parsed_records.assert_called_once()
+        self.assertTrue(records)
+        # Geometries parsed by workers are sent back as EWKB
+        geom = source.SOURCE_GEOM_ATTRIBUTE
+        self.assertEqual(
+            [{**record, geom: bytes(record[geom])} for record in records],
+            [{**record, geom: bytes(record[geom].ewkb)} for record in serial],
+        )
+
+    def test_csv_records_are_parsed_in_order(self):
+        source = CSVSource.objects.create(
+            name="source",
+            file=get_file("source.csv"),
+            geom_type=GeometryTypes.Point,
+            id_field="ID",
+            settings={
+                "encoding": "UTF-8",
+                "coordinate_reference_system": "EPSG_2154",
+                "char_delimiter": "doublequote",
+                "field_separator": "semicolon",
+                "decimal_separator": "point",
+                "use_header": True,
+                "coordinates_field": "two_columns",
+                "longitude_field": "XCOORD",
+                "latitude_field": "YCOORD",
+            },
+        )
+        self.assertParsedInParallel(source)
+
+    def test_shapefile_records_are_parsed_in_order(self):
+        source = ShapefileSource.objects.create(
+            name="source", geom_type=GeometryTypes.Polygon, file=get_file("test.zip")
+        )
+        self.assertParsedInParallel(source)
+
+    def test_geojson_records_are_parsed_in_order(self):
+        features = [
+            {
+                "type": "Feature",
+                "properties": {"id": i},
+                "geometry": {"type": "Point", "coordinates": [i, i]},
+            }
+            for i in range(5)
+        ]
+        source = GeoJSONSource.objects.create(
+            name="source",
+            geom_type=GeometryTypes.Point,
+            file=ContentFile(
+                json.dumps({"type": "FeatureCollection", "features": features}),
+                name="points.geojson",
+            ),
+        )
+        self.assertParsedInParallel(source)
+
+    def test_daemonic_processes_parse_records_in_parallel(self):
+        source = GeoJSONSource.objects.create(
+            name="source",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+        )
+        # As Celery prefork workers are
+        with (
+            mock.patch.dict(multiprocessing.current_process()._config, daemon=True),
+            mock.patch.dict(billiard.process.current_process()._config, daemon=True),
+        ):
+            self.assertParsedInParallel(source)
+
+    def test_invalid_geojson_features_raise(self):
+        source = GeoJSONSource.objects.create(
+            name="source",
+            geom_type=GeometryTypes.Point,
+            file=ContentFile(
+                b'{"type": "FeatureCollection", "features": [{"type": !}]}',
+                name="invalid.geojson",
+            ),
+        )
+        with self.assertRaises(SourceException):
+            list(source._read_records())
@@ -1,10 +1,15 @@
-from datetime import UTC, datetime
+from datetime import UTC, datetime, timedelta
 from unittest import mock
 
 from django.test import TestCase
 
-from project.geosource.models import GeoJSONSource, GeometryTypes, PostGISSource
-from project.geosource.periodics import auto_refresh_source
+from project.geosource.models import (
+    GeoJSONSource,
+    GeometryTypes,
+    PostGISSource,
+    SourceReporting,
+)
+from project.geosource.periodics import auto_refresh_source, plan_refreshes
 from project.geosource.tests.helpers import get_file
 
 
@@ -99,3 +104,46 @@ class PeriodicsTestCase(TestCase):
             auto_refresh_source()
 
             mocked2.assert_not_called()
+
+
+class PlanRefreshesTestCase(TestCase):
+    def get_source(self, name, duration=None, total=0):
+        report = None
+        if duration is not None or total:
+            started = datetime(2020, 1, 1, tzinfo=UTC)
+            report = SourceReporting.objects.create(
+                started=started,
+                ended=started + timedelta(seconds=duration) if duration else None,
+                total=total,
+            )
+        return GeoJSONSource.objects.create(
+            name=name,
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+            report=report,
+        )
+
+    def test_refreshes_are_packed_on_slots(self):
+        large = self.get_source("large", 1000, 100000)
+        small = self.get_source("small", 10, 1000)
+        medium = self.get_source("medium", 100, 10000)
+        unknown = self.get_source("unknown")
+        # Estimated from its row count at the average throughput
+        counted = self.get_source("counted", total=5000)
+
+        plan = plan_refreshes([large, small, medium, unknown, counted], 2)
+        self.assertEqual(
+            [(source.name, countdown) for source, countdown in plan],
+            [
+                ("small", 0),
+                ("counted", 0),
+                ("medium", 10),
+                ("unknown", 50),
+                ("large", 110),
+            ],
+        )
+
+    def test_single_slot_runs_refreshes_in_sequence(self):
+        sources = [self.get_source(f"source {i}", 10 * i) for i in (1, 2, 3)]
+        plan = plan_refreshes(sources, 1)
+        self.assertEqual([countdown for _, countdown in plan], [0, 10, 30])
@@ -0,0 +1,89 @@
+from django.test import SimpleTestCase
+
+from project.geosource.profile import (
+    SourceProfiler,
+    get_profile_quantiles,
+    get_profile_values,
+    to_number,
+)
+
+
+class ToNumberTestCase(SimpleTestCase):
+    def test_to_number(self):
+        self.assertEqual(to_number(2), 2)
+        self.assertEqual(to_number(" 1.5 "), 1.5)
+        self.assertEqual(to_number("12"), 12)
+        self.assertIsNone(to_number(True))
+        self.assertIsNone(to_number("1_000"))
+        self.assertIsNone(to_number("text"))
+
+
+class SourceProfilerTestCase(SimpleTestCase):
+    def profile(self, records, **kwargs):
+        profiler = SourceProfiler(
+            kwargs.get("sketch_size", 100), kwargs.get("max_values", 10), ("geom",)
+        )
+        for record in records:
+            profiler.add(record)
+        return profiler.as_dict()
+
+    def test_numeric_field(self):
+        profiles = self.profile(
+            [{"geom": None, "a": value} for value in (3, -1, "5", None, 3)]
+        )
+        self.assertEqual(list(profiles), ["a"])
+        self.assertEqual(
+            profiles["a"],
+            {
+                "count": 5,
+                "nulls": 1,
+                "values": [[3, 2], [-1, 1], ["5", 1]],
+                "complete": True,
+                "numeric": {
+                    "count": 4,
+                    "min": -1,
+                    "max": 5,
+                    "positive_min": 3,
+                    "positive_max": 5,
+                    "sketch": [-1, 3, 3, 5],
+                },
+            },
+        )
+
+    def test_categorical_field(self):
+        profiles = self.profile(
+            [{"a": value} for value in ("x", "y", "x", 1, True)] + [{"b": 1}],
+            max_values=2,
+        )
+        self.assertEqual(
+            profiles["a"],
+            {"count": 6, "nulls": 1, "values": [["x", 2], ["y", 1]], "complete": False},
+        )
+
+    def test_sketch_is_bounded(self):
+        profiles = self.profile([{"a": i} for i in range(1000)], sketch_size=10)
+        numeric = profiles["a"]["numeric"]
+        self.assertEqual(len(numeric["sketch"]), 10)
+        self.assertEqual(numeric["sketch"], sorted(numeric["sketch"]))
+        self.assertEqual((numeric["min"], numeric["max"]), (0, 999))
+
+    def test_quantiles_follow_ntile(self):
+        profiles = self.profile([{"a": value} for value in (10, 3, 1, 9, 5, 3)] * 2)
+        profile = profiles["a"]
+        self.assertEqual(get_profile_quantiles(profile, 3), [1, 3, 9, 10])
+
+        profile.update(count=10, nulls=4)
+        profile["numeric"]["count"] = 6
+        profile["numeric"]["sketch"] = [1, 3, 3, 5, 9, 10]
+        # Features without value are in the last class, which is dropped
+        self.assertEqual(get_profile_quantiles(profile, 3), [1, 9, 10])
+        self.assertEqual(get_profile_quantiles(profile, 20), [1, 3, 3, 5, 9, 10, 10])
+
+    def test_values(self):
+        profiles = self.profile([{"a": value} for value in (2, "b", None, "a", 2)])
+        self.assertEqual(
+            get_profile_values(profiles["a"]), [["a", 1], ["b", 1], [2, 2], [None, 1]]
+        )
+
+        profiles = self.profile([{"a": value} for value in "abc"], max_values=2)
+        self.assertIsNone(get_profile_values(profiles["a"]))
@@ -0,0 +1,67 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from project.geosource.models import SourceReporting
+from project.geosource.progress import (
+    RefreshProgress,
+    finish_progress,
+    get_progress,
+    get_progress_key,
+)
+from project.geosource.timing import StageTimer
+
+
+class RefreshProgressTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.delete_many([get_progress_key(1), get_progress_key(1, 0)])
+
+    @mock.patch("project.geosource.app_settings.PROGRESS_INTERVAL", 60)
+    def test_progress_is_throttled(self):
+        report = SourceReporting()
+        timer = StageTimer()
+        progress = RefreshProgress(1, report, timer, expected=10)
+        with timer.stage("write"):
+            for _ in timer.iterate("read", progress.iterate(range(4))):
+                pass
+        # Only the first record was published
+        self.assertEqual(get_progress(1)["read"], 1)
+        self.assertEqual(get_progress(1)["stage"], "read")
+
+        report.error_count += 1
+        progress.finish()
+        data = get_progress(1)
+        self.assertEqual(
+            (data["read"], data["failed"], data["stage"], data["finished"]),
+            (4, 1, None, True),
+        )
+        self.assertIsNone(data["eta"])
+
+    @mock.patch("project.geosource.app_settings.PROGRESS_INTERVAL", 0)
+    def test_progress_can_be_disabled(self):
+        RefreshProgress(1, SourceReporting()).finish()
+        self.assertIsNone(get_progress(1))
+
+    def test_eta_is_estimated_from_expected_records(self):
+        progress = RefreshProgress(1, SourceReporting(), expected=10)
+        progress.read = 5
+        progress.started -= 20
+        progress.publish(force=True)
+        self.assertEqual(get_progress(1)["eta"], 20)
+
+    def test_shards_progress_is_summed(self):
+        RefreshProgress(1, SourceReporting(), expected=10).publish(
+            force=True, stage="shards", shards=2
+        )
+        part = RefreshProgress(1, SourceReporting(error_count=1), part=0)
+        list(part.iterate(range(3)))
+        part.advance(2)
+        part.finish()
+
+        data = get_progress(1)
+        self.assertEqual((data["read"], data["written"], data["failed"]), (3, 2, 1))
+        self.assertFalse(data["finished"])
+
+        finish_progress(1)
+        self.assertTrue(get_progress(1)["finished"])
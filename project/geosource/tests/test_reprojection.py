@@ -0,0 +1,54 @@
+from unittest import mock
+
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.test import SimpleTestCase
+
+from project.geosource import reprojection
+from project.geosource.reprojection import get_transformer, reproject
+
+
+class ReprojectTestCase(SimpleTestCase):
+    def test_geometries_are_reprojected_as_gdal_does(self):
+        geometries = {
+            "point": Point(930077.50743, 6922202.67316, srid=2154),
+            "point_z": Point(930077.5, 6922202.6, 12, srid=2154),
+            "polygon": GEOSGeometry(
+                "SRID=2154;MULTIPOLYGON(((700000 6600000, 700100 6600000, "
+                "700100 6600100, 700000 6600000)))"
+            ),
+            "collection": GEOSGeometry(
+                "SRID=3857;GEOMETRYCOLLECTION(POINT(1 1), LINESTRING(0 0, 1000 1000))"
+            ),
+            "wgs84": Point(2, 42, srid=4326),
+        }
+        reprojected, errors = reproject(geometries)
+        self.assertEqual(errors, [])
+        self.assertEqual(reprojected.keys(), geometries.keys())
+        for key, geom in reprojected.items():
+            expected = geometries[key].transform(4326, clone=True)
+            self.assertEqual(geom.srid, 4326)
+            self.assertTrue(geom.equals_exact(expected, 1e-9), key)
+        self.assertEqual(reprojected["point_z"].z, 12)
+
+    def test_transformer_is_built_once_per_srid(self):
+        get_transformer(2154)
+        geometries = {i: Point(700000 + i, 6600000, srid=2154) for i in range(10)}
+        with mock.patch.object(
+            reprojection.Transformer,
+            "from_crs",
+            wraps=reprojection.Transformer.from_crs,
+        ) as from_crs:
+            reprojected, _ = reproject(geometries)
+            reprojected, _ = reproject(geometries)
+        from_crs.assert_not_called()
+        self.assertEqual(len(reprojected), 10)
+
+    def test_invalid_geometries_are_reported(self):
+        reprojected, errors = reproject(
+            {
+                "no_srid": Point(2, 42),
+                "unknown_srid": Point(2, 42, srid=999999),
+            }
+        )
+        self.assertEqual(reprojected, {})
+        self.assertEqual([key for key, _ in errors], ["no_srid", "unknown_srid"])
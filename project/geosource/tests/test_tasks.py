@@ -2,6 +2,7 @@ import logging
 from datetime import datetime
 from unittest import mock
 
+from celery.result import AsyncResult
 from constance.test import override_config
 from django.contrib.auth.models import Group
 from django.test import TestCase
@@ -175,3 +176,45 @@ class TaskTestCase(TestCase):
         except AttributeError:
             source.report.refresh_from_db()
             self.assertEqual(source.report.status, SourceReporting.Status.ERROR.value)
+
+
+class PendingTaskTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.source = GeoJSONSource.objects.create(
+            name="test",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+        )
+
+    @mock.patch("project.geosource.mixins.run_model_object_method.apply_async")
+    def test_pending_task_is_not_scheduled_twice(self, mock_apply_async):
+        mock_apply_async.side_effect = lambda *args, task_id, **kwargs: AsyncResult(
+            task_id
+        )
+        task = self.source.run_async_method("refresh_data", force=True)
+        duplicate = self.source.run_async_method("refresh_data", force=True)
+
+        mock_apply_async.assert_called_once()
+        self.assertEqual(duplicate.task_id, task.task_id)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.task_id, task.task_id)
+
+    @mock.patch("project.geosource.app_settings.PENDING_TASK_TIMEOUT", -1)
+    @mock.patch("project.geosource.mixins.run_model_object_method.apply_async")
+    def test_lost_pending_task_expires(self, mock_apply_async):
+        mock_apply_async.side_effect = lambda *args, task_id, **kwargs: AsyncResult(
+            task_id
+        )
+        task = self.source.run_async_method("refresh_data", force=True)
+        # Never started, the task no longer holds back the next request
+        retry = self.source.run_async_method("refresh_data", force=True)
+
+        self.assertEqual(mock_apply_async.call_count, 2)
+        self.assertNotEqual(retry.task_id, task.task_id)
+
+    @mock.patch("project.geosource.models.Source.refresh_data", return_value={})
+    def test_started_task_can_be_scheduled_again(self, mock_refresh_data):
+        self.source.run_async_method("refresh_data")
+        self.source.run_async_method("refresh_data")
+        self.assertEqual(mock_refresh_data.call_count, 2)
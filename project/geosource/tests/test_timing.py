@@ -0,0 +1,45 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from project.geosource.timing import StageTimer, get_peak_memory
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@mock.patch("project.geosource.timing.time.perf_counter", new_callable=Clock)
+class StageTimerTestCase(SimpleTestCase):
+    def test_nested_stages_are_not_counted_twice(self, clock):
+        timer = StageTimer()
+        with timer.stage("write"):
+            clock.now += 1
+            with timer.stage("index"):
+                clock.now += 2
+            clock.now += 3
+        with timer.stage("index"):
+            clock.now += 4
+        self.assertEqual(timer.as_dict(), {"write": 4, "index": 6})
+        self.assertEqual(timer.elapsed, 10)
+
+    def test_iteration_is_timed(self, clock):
+        def read():
+            for i in range(3):
+                clock.now += 1
+                yield i
+
+        timer = StageTimer()
+        with timer.stage("write"):
+            for _ in timer.iterate("read", read()):
+                clock.now += 2
+        self.assertEqual(timer.as_dict(), {"read": 3, "write": 6})
+
+
+class PeakMemoryTestCase(SimpleTestCase):
+    def test_peak_memory(self):
+        self.assertGreater(get_peak_memory(), 0)
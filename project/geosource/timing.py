@@ -0,0 +1,70 @@
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class StageTimer:
+    """
+    Accumulate the time spent in the stages of a process. Stages can be
+    nested, the time spent in an inner stage is not counted in the outer one.
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.started = time.perf_counter()
+        self.stack = []
+        self.mark = None
+
+    def _enter(self, name):
+        now = time.perf_counter()
+        if self.stack:
+            self.durations[self.stack[-1]] += now - self.mark
+        self.stack.append(name)
+        self.mark = now
+
+    def _exit(self):
+        now = time.perf_counter()
+        self.durations[self.stack.pop()] += now - self.mark
+        self.mark = now
+
+    @contextmanager
+    def stage(self, name):
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def iterate(self, name, iterable):
+        """Yield the items of an iterable, timing its iteration as a stage"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        """Durations of the stages, in seconds"""
+        return {name: round(duration, 3) for name, duration in self.durations.items()}
+
+
+def get_peak_memory():
+    """Peak resident memory of the process in KiB, None if it is not known"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, in KiB elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
@@ -1,14 +1,21 @@
+from itertools import chain
+
 from django.db.models import Count
+from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
+from . import app_settings
 from .filters import SourceFilterSet
 from .models import Source, SourceReporting
 from .parsers import NestedMultipartJSONParser
 from .permissions import SourcePermission
+from .progress import get_progress, iter_progress_events
+from .renderers import EventStreamRenderer, iter_csv_lines
 from .serializers import SourceListSerializer, SourceSerializer
 
 
@@ -54,12 +61,72 @@ class SourceModelViewset(ModelViewSet):
 
         return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=True, methods=["get"])
+    def errors(self, request, pk):
+        """Download every error of the last refresh, as a streamed CSV file"""
+        source = self.get_object()
+        if not source.report:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        rows = (
+            source.report.error_lines.order_by("pk")
+            .values_list("kind", "message")
+            .iterator()
+        )
+        response = StreamingHttpResponse(
+            iter_csv_lines(chain([("kind", "message")], rows)),
+            content_type="text/csv",
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{source.slug}-errors.csv"'
+        )
+        return response
+
+    @action(detail=True, methods=["get"])
+    def progress(self, request, pk):
+        """
+        Progress of the running or last refresh, read from the cache rather than
+        from the source report.
+        """
+        progress = get_progress(self.get_object().pk)
+        if progress is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(progress)
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="progress/stream",
+        renderer_classes=(EventStreamRenderer,),
+    )
+    def progress_stream(self, request, pk):
+        """
+        Stream the progress of the running refresh as server-sent events, for
+        PROGRESS_STREAM_DURATION seconds at most, after which clients reconnect.
+        """
+        if not app_settings.PROGRESS_STREAM:
+            raise NotFound
+        source = self.get_object()
+        response = StreamingHttpResponse(
+            iter_progress_events(source.pk, app_settings.PROGRESS_STREAM_DURATION),
+            content_type=EventStreamRenderer.media_type,
+        )
+        response["Cache-Control"] = "no-cache"
+        # Events are not buffered by proxies
+        response["X-Accel-Buffering"] = "no"
+        return response
+
     @action(detail=True, methods=["get"])
     def property_values(self, request, pk):
         """
         Returns all distinct values of specified GET "property" params from
         database for the specified source layer.
 
+        Values can be filtered by a "search" prefix. With "page" or "page_size"
+        params, they are paginated with the number of features holding them,
+        otherwise at most PROPERTY_VALUES_LIMIT values are listed. Only the
+        requested values are queried, and cached until the next refresh.
+
         Note: if some record has no value for this property, None is contained in the
         result list.
         """
@@ -71,6 +138,22 @@ class SourceModelViewset(ModelViewSet):
             )
 
         source = self.get_object()
-        result = source.get_layer().get_property_values(property_to_list)
+        values = source.get_property_values(
+            property_to_list, request.query_params.get("search")
+        )
 
-        return Response(result)
+        paginator = self.paginator
+        if (
+            not {
+                paginator.page_query_param,
+                paginator.page_size_query_param,
+            }
+            & request.query_params.keys()
+        ):
+            return Response(
+                [value for value, _ in values[: app_settings.PROPERTY_VALUES_LIMIT]]
+            )
+        page = self.paginate_queryset(values)
+        return self.get_paginated_response(
+            [{"value": value, "count": count} for value, count in page]
+        )
@@ -191,6 +191,76 @@ GEOSOURCE_LAYER_CALLBACK = "project.geosource.geostore_callbacks.layer_callback"
 GEOSOURCE_FEATURE_CALLBACK = "project.geosource.geostore_callbacks.feature_callback"
 GEOSOURCE_CLEAN_FEATURE_CALLBACK = "project.geosource.geostore_callbacks.clear_features"
 GEOSOURCE_DELETE_LAYER_CALLBACK = "project.geosource.geostore_callbacks.delete_layer"
+GEOSOURCE_TOUCH_FEATURE_CALLBACK = "project.geosource.geostore_callbacks.touch_features"
+GEOSOURCE_DELETE_FEATURE_CALLBACK = (
+    "project.geosource.geostore_callbacks.delete_features"
+)
+GEOSOURCE_SHADOW_LAYER_CALLBACK = (
+    "project.geosource.geostore_callbacks.shadow_layer_callback"
+)
+GEOSOURCE_PUBLISH_LAYER_CALLBACK = "project.geosource.geostore_callbacks.publish_layer"
+GEOSOURCE_DROP_LAYER_CALLBACK = "project.geosource.geostore_callbacks.drop_layer"
+GEOSOURCE_BULK_FEATURE_CALLBACK = (
+    "project.geosource.geostore_callbacks.bulk_feature_callback"
+)
+GEOSOURCE_SYNC_RELATIONS_CALLBACK = (
+    "project.geosource.geostore_callbacks.sync_relations"
+)
+GEOSOURCE_BULK_INGESTION = config("GEOSOURCE_BULK_INGESTION", default=False, cast=bool)
+GEOSOURCE_BULK_BATCH_SIZE = config("GEOSOURCE_BULK_BATCH_SIZE", default=1000, cast=int)
+GEOSOURCE_CHANGE_DETECTION = config(
+    "GEOSOURCE_CHANGE_DETECTION", default=True, cast=bool
+)
+GEOSOURCE_REFRESH_STRATEGY = config("GEOSOURCE_REFRESH_STRATEGY", default="merge")
+GEOSOURCE_ES_BULK_CHUNK_SIZE = config(
+    "GEOSOURCE_ES_BULK_CHUNK_SIZE", default=500, cast=int
+)
+GEOSOURCE_ES_BULK_MAX_BYTES = config(
+    "GEOSOURCE_ES_BULK_MAX_BYTES", default=100 * 1024 * 1024, cast=int
+)
+GEOSOURCE_REFRESH_SLOTS = config("GEOSOURCE_REFRESH_SLOTS", default=1, cast=int)
+GEOSOURCE_SAMPLE_SIZE = config("GEOSOURCE_SAMPLE_SIZE", default=50, cast=int)
+GEOSOURCE_SAMPLING = config("GEOSOURCE_SAMPLING", default="head")
+GEOSOURCE_SAMPLE_CHUNKS = config("GEOSOURCE_SAMPLE_CHUNKS", default=5, cast=int)
+GEOSOURCE_FIELD_PROFILES = config("GEOSOURCE_FIELD_PROFILES", default=False, cast=bool)
+GEOSOURCE_PROFILE_SKETCH_SIZE = config(
+    "GEOSOURCE_PROFILE_SKETCH_SIZE", default=1000, cast=int
+)
+GEOSOURCE_PROFILE_MAX_VALUES = config(
+    "GEOSOURCE_PROFILE_MAX_VALUES", default=100, cast=int
+)
+GEOSOURCE_PROPERTY_VALUES_LIMIT = config(
+    "GEOSOURCE_PROPERTY_VALUES_LIMIT", default=1000, cast=int
+)
+GEOSOURCE_PROPERTY_VALUES_CACHE_TIMEOUT = config(
+    "GEOSOURCE_PROPERTY_VALUES_CACHE_TIMEOUT", default=60 * 60 * 24, cast=int
+)
+GEOSOURCE_PARSE_WORKERS = config("GEOSOURCE_PARSE_WORKERS", default=1, cast=int)
+GEOSOURCE_PARSE_CHUNK_SIZE = config(
+    "GEOSOURCE_PARSE_CHUNK_SIZE", default=5000, cast=int
+)
+GEOSOURCE_REFRESH_SHARDS = config("GEOSOURCE_REFRESH_SHARDS", default=1, cast=int)
+GEOSOURCE_SHARD_MIN_ROWS = config("GEOSOURCE_SHARD_MIN_ROWS", default=500000, cast=int)
+GEOSOURCE_SHARDED_REFRESH_TIMEOUT = config(
+    "GEOSOURCE_SHARDED_REFRESH_TIMEOUT", default=6, cast=int
+)
+GEOSOURCE_MAX_TASK_RUNTIME = config("GEOSOURCE_MAX_TASK_RUNTIME", default=24, cast=int)
+GEOSOURCE_PENDING_TASK_TIMEOUT = config(
+    "GEOSOURCE_PENDING_TASK_TIMEOUT", default=600, cast=int
+)
+GEOSOURCE_PROGRESS_INTERVAL = config(
+    "GEOSOURCE_PROGRESS_INTERVAL", default=2, cast=float
+)
+GEOSOURCE_PROGRESS_STREAM = config(
+    "GEOSOURCE_PROGRESS_STREAM", default=False, cast=bool
+)
+GEOSOURCE_PROGRESS_STREAM_DURATION = config(
+    "GEOSOURCE_PROGRESS_STREAM_DURATION", default=30, cast=float
+)
+GEOSOURCE_ERROR_EXAMPLES = config("GEOSOURCE_ERROR_EXAMPLES", default=10, cast=int)
+GEOSOURCE_POSTGIS_ITERSIZE = config(
+    "GEOSOURCE_POSTGIS_ITERSIZE", default=2000, cast=int
+)
 
 REST_FRAMEWORK = {
     "TEST_REQUEST_DEFAULT_FORMAT": "json",
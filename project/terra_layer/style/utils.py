@@ -4,6 +4,10 @@ from functools import reduce
 
 from django.db import connection
 
+from project.geosource import app_settings as geosource_settings
+from project.geosource.models import Field
+from project.geosource.profile import get_profile_quantiles
+
 style_type_2_legend_shape = {
     "fill-extrusion": "square",
     "fill": "square",
@@ -36,10 +40,31 @@ def _flatten(levels):
     return list(reduce(lambda x, y: x + y, levels or []))
 
 
+def get_numeric_profile(geo_layer, field):
+    """
+    Return the profile of a numeric property recorded by the last refresh of the
+    layer source, None if there is none.
+    """
+    if not geosource_settings.FIELD_PROFILES:
+        return None
+    profile = (
+        Field.objects.filter(source__slug=geo_layer.name, name=field)
+        .values_list("profile", flat=True)
+        .first()
+    )
+    if profile and "numeric" in profile:
+        return profile
+    return None
+
+
 def get_min_max(geo_layer, field):
     """
     Return the max and the min value of a property.
     """
+    profile = get_numeric_profile(geo_layer, field)
+    if profile is not None:
+        numeric = profile["numeric"]
+        return [profile["nulls"] > 0, numeric["min"], numeric["max"]]
     with connection.cursor() as cursor:
         cursor.execute(
             """
@@ -63,6 +88,10 @@ def get_positive_min_max(geo_layer, field):
     """
     Return the max and the min value of a property.
     """
+    profile = get_numeric_profile(geo_layer, field)
+    if profile is not None:
+        numeric = profile["numeric"]
+        return [False, numeric["positive_min"], numeric["positive_max"]]
     with connection.cursor() as cursor:
         cursor.execute(
             """
@@ -87,6 +116,9 @@ def discretize_quantile(geo_layer, field, class_count):
     """
     Compute Quantile class boundaries from a layer property.
     """
+    profile = get_numeric_profile(geo_layer, field)
+    if profile is not None:
+        return get_profile_quantiles(profile, class_count)
     with connection.cursor() as cursor:
         cursor.execute(
             """
@@ -1,4 +1,5 @@
 import random
+from unittest import mock
 
 from django.contrib.gis.geos import Point
 from django.test import TestCase
@@ -10,7 +11,9 @@ from project.terra_layer.style.utils import (
     ceil_scale,
     circle_boundaries_candidate,
     circle_boundaries_filter_values,
+    discretize,
     get_min_max,
+    get_positive_min_max,
     round_scale,
     trunc_scale,
 )
@@ -62,6 +65,31 @@ class StyleTestCase(TestCase):
         geo_layer = self.source.get_layer()
         self.assertEqual(get_min_max(geo_layer, "a"), [False, None, None])
 
+    @mock.patch("project.geosource.app_settings.FIELD_PROFILES", True)
+    def test_min_max_from_field_profile(self):
+        geo_layer = self.source.get_layer()
+        self.source.fields.create(
+            name="a",
+            profile={
+                "count": 5,
+                "nulls": 1,
+                "values": [],
+                "complete": False,
+                "numeric": {
+                    "count": 4,
+                    "min": -1,
+                    "max": 5,
+                    "positive_min": 2,
+                    "positive_max": 5,
+                    "sketch": [-1, 2, 3, 5],
+                },
+            },
+        )
+        with self.assertNumQueries(3):
+            self.assertEqual(get_min_max(geo_layer, "a"), [True, -1, 5])
+            self.assertEqual(get_positive_min_max(geo_layer, "a"), [False, 2, 5])
+            self.assertEqual(discretize(geo_layer, "a", "quantile", 2), [-1, 5, 5])
+
     def test_circle_boundaries_0(self):
         min = 0
         max = 1